@@ -273,7 +273,7 @@ export async function POST(request: NextRequest) {
       return {
         id: img.id || `img${i + 1}`,
         name: img.name || `image_${String(i + 1).padStart(3, "0")}.png`,
-        url: `data:image/png;base64,${img.b64}`,
+        url: `data:${img.mime || "image/png"};base64,${img.b64}`,
         b64: img.b64,
 
         // IA imágenes
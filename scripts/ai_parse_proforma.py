@@ -6,34 +6,70 @@ Lee TODO el PDF (sin límite de páginas), lo convierte a imágenes base64
 y envía todo a ChatGPT para extracción completa de ítems.
 """
 
-import sys, json, base64
+import os, sys, json, base64
+from collections import Counter
 from typing import List, Dict, Any
-import fitz  # PyMuPDF
-import requests
 import re
 
 # ===== stdout limpio =====
 _REAL_STDOUT = sys.stdout
 sys.stdout = sys.stderr
+
+from sesion_pdf import PdfSession
+from cliente_http import get_client
 def _emit_json(obj: Dict[str, Any]) -> None:
     _REAL_STDOUT.write(json.dumps(obj, ensure_ascii=False))
     _REAL_STDOUT.flush()
 
+def _emit_line(obj: Dict[str, Any]) -> None:
+    """Un registro NDJSON (modo --format ndjson)."""
+    _REAL_STDOUT.write(json.dumps(obj, ensure_ascii=False) + "\n")
+    _REAL_STDOUT.flush()
+
 # ==========================================================
 # CONVERSIÓN DE PDF A IMÁGENES BASE64 (SIN LÍMITE)
 # ==========================================================
-def pdf_to_images_b64(path: str, max_pages: int = None, zoom: float = 2.0) -> List[str]:
-    out: List[str] = []
-    doc = fitz.open(path)
-    total_pages = len(doc)
-    if max_pages is None or max_pages > total_pages:
-        max_pages = total_pages
-    for i in range(max_pages):
-        page = doc.load_page(i)
-        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
-        out.append(base64.b64encode(pix.tobytes("png")).decode("utf-8"))
-    doc.close()
-    return out
+def pdf_to_images_b64(path: str, max_pages: int = None, zoom: float = 2.0, session=None) -> List[str]:
+    """Con session (PdfSession), reutiliza sus páginas interpretadas y renders cacheados."""
+    own = session is None
+    if own:
+        session = PdfSession(path)
+    try:
+        total_pages = len(session)
+        if max_pages is None or max_pages > total_pages:
+            max_pages = total_pages
+        return [base64.b64encode(session.render_png(i, zoom)).decode("utf-8") for i in range(max_pages)]
+    finally:
+        if own:
+            session.close()
+
+# Páginas con capa de texto (tabla vectorial / texto) van como TEXTO, no como imagen:
+# menos tokens y sin depender de la visión. "0" = todas como imagen (comportamiento anterior).
+AI_TEXT_PAGES = os.getenv("AI_TEXT_PAGES", "1") == "1"
+# Plazo total de la llamada al modelo (intentos de 300 s + esperas entre reintentos)
+AI_DEADLINE = float(os.getenv("AI_DEADLINE", "900"))
+
+
+def page_contents(session, zoom: float = 2.0, text_pages: bool = AI_TEXT_PAGES) -> tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Partes del mensaje según el pre-vuelo (PdfSession.plan): texto extraído para las
+    páginas con texto, imagen PNG para escaneadas / solo imágenes; las páginas en
+    blanco no se envían. Devuelve (partes, conteo por modo).
+    """
+    parts: List[Dict[str, Any]] = []
+    sent = Counter()
+    for step in session.plan():
+        i = step["page"] - 1
+        if text_pages and step["kind"] in ("vector_table", "text"):
+            parts.append({"type": "text", "text": f"--- Página {i + 1} (texto extraído) ---\n{session.text(i)}"})
+            sent["text"] += 1
+        elif step["kind"] == "blank":
+            sent["blank"] += 1
+        else:
+            b64 = base64.b64encode(session.render_png(i, zoom)).decode("utf-8")
+            parts.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{b64}"}})
+            sent["image"] += 1
+    return parts, dict(sent)
 
 # ==========================================================
 # HELPERS DE FORMATO Y NÚMEROS
@@ -51,26 +87,140 @@ def clean_partida(v) -> str:
     s = "".join(ch for ch in s if ch.isdigit())
     return s[:10] if s else ""
 
+def normalize_row(rrow: Dict[str, Any]) -> Dict[str, Any]:
+    """Fila tal como la devuelve el modelo -> fila del contrato de salida."""
+    rrow = rrow or {}
+    nombre = rrow.get("nombre_comercial")
+    modelo = rrow.get("modelo")
+    desc = rrow.get("descripcion")
+
+    if nombre and modelo and nombre.strip().upper() == modelo.strip().upper():
+        nombre = f"PRODUCTO {modelo}"
+    if not nombre and modelo:
+        nombre = f"PRODUCTO {modelo}"
+    if not modelo and nombre:
+        m = re.search(r"[A-Z]{2,}\d+[A-Z]*", nombre)
+        if m:
+            modelo = m.group(0)
+    if not desc:
+        desc = f"Artículo {nombre.title()}" if nombre else "Producto sin descripción"
+
+    return {
+        "nombre_comercial": nombre.upper().strip() if nombre else None,
+        "descripcion": desc,
+        "modelo": modelo,
+        "unidad_de_medida": rrow.get("unidad_de_medida"),
+        "cantidad_x_caja": try_float(rrow.get("cantidad_x_caja")),
+        "cajas": try_float(rrow.get("cajas")),
+        "total_unidades": try_float(rrow.get("total_unidades")),
+        "partida": clean_partida(rrow.get("partida")),
+        "precio_unitario_usd": try_float(rrow.get("precio_unitario_usd")),
+        "total_usd": try_float(rrow.get("total_usd")),
+    }
+
+def load_model_json(raw: str) -> Dict[str, Any]:
+    """JSON de la respuesta; si vino cortado, se intenta cerrar en la última llave."""
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        # intentar reparar
+        fixed = raw.rsplit("}", 1)[0] + "}"
+        try:
+            return json.loads(fixed)
+        except Exception:
+            print("[WARN] Respuesta JSON incompleta o corrupta", file=sys.stderr)
+            return {"rows": [], "notas": "Respuesta incompleta del modelo"}
+
+# ==========================================================
+# STREAMING (--format ndjson)
+# ==========================================================
+class RowScanner:
+    """
+    Objetos completos del arreglo "rows" a medida que llega el texto del modelo
+    (stream), sin esperar al JSON entero: cada feed() devuelve las filas que se cerraron.
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = None      # dónde sigue el arreglo "rows" (None = todavía no empezó)
+        self.done = False
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        self.buf += text
+        out: List[Dict[str, Any]] = []
+        if self.pos is None:
+            m = re.search(r'"rows"\s*:\s*\[', self.buf)
+            if not m:
+                return out
+            self.pos = m.end()
+        while not self.done:
+            j = self.pos
+            while j < len(self.buf) and self.buf[j] in " \t\r\n,":
+                j += 1
+            if j >= len(self.buf):
+                break
+            if self.buf[j] == "]":
+                self.done = True
+                break
+            if self.buf.find("}", j) < 0:
+                break
+            try:
+                obj, end = self._decoder.raw_decode(self.buf, j)
+            except json.JSONDecodeError:
+                break  # fila a medias: esperar más texto
+            if isinstance(obj, dict):
+                out.append(obj)
+            self.pos = end
+        return out
+
+def stream_chat(api_key: str, body: Dict[str, Any]):
+    """Fragmentos de texto de la respuesta de chat/completions con stream=True (SSE)."""
+    # Los reintentos cubren hasta recibir los encabezados; cortado ya el stream, no se repite
+    with get_client().chat(api_key, {**body, "stream": True}, timeout=300, deadline=AI_DEADLINE, stream=True) as r:
+        r.raise_for_status()
+        for line in r.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            payload = line[5:].strip()
+            if payload == "[DONE]":
+                break
+            choices = json.loads(payload).get("choices") or [{}]
+            delta = (choices[0].get("delta") or {}).get("content")
+            if delta:
+                yield delta
+
 # ==========================================================
 # MAIN PRINCIPAL
 # ==========================================================
 def main():
-    if len(sys.argv) < 4:
+    argv = sys.argv[1:]
+    fmt = "json"
+    if "--format" in argv:
+        k = argv.index("--format")
+        fmt = argv[k + 1] if k + 1 < len(argv) else "json"
+        del argv[k:k + 2]
+    ndjson = fmt == "ndjson"
+
+    if len(argv) < 3:
         _emit_json({
             "success": False,
-            "error": "usage: ai_parse_proforma.py <pdf_path> <max_pages> <OPENAI_API_KEY>"
+            "error": "usage: ai_parse_proforma.py <pdf_path> <max_pages> <OPENAI_API_KEY> [--format ndjson]"
         })
         return
 
-    pdf_path = sys.argv[1]
-    max_pages = int(sys.argv[2])
-    api_key = sys.argv[3]
+    pdf_path = argv[0]
+    max_pages = int(argv[1])
+    api_key = argv[2]
 
+    session = None
+    modes: Dict[str, int] = {}
+    emitted = 0
     try:
-        # 1) Convertir TODO el PDF a imágenes base64
-        images = pdf_to_images_b64(pdf_path, max_pages=None, zoom=2.0)
-        print(f"[INFO] PDF convertido a {len(images)} imágenes base64", file=sys.stderr)
-
+        # 1) Pre-vuelo: TODO el PDF, cada página como texto o imagen según su tipo
+        session = PdfSession(pdf_path)
+        pages, modes = page_contents(session, zoom=2.0)
+        print(f"[INFO] PDF de {len(session)} páginas -> {modes}", file=sys.stderr)
         # 2) Prompt principal
         system = (
             "Eres un asistente experto en interpretar PROFORMAS o INVOICES con tablas de productos. "
@@ -107,85 +257,67 @@ def main():
         content: List[Dict[str, Any]] = [
             {"type": "text", "text": "Extrae todos los ítems de esta proforma. Devuelve SOLO JSON válido."}
         ]
-        for b64 in images:
-            content.append({
-                "type": "image_url",
-                "image_url": {"url": f"data:image/png;base64,{b64}"}
-            })
+        content.extend(pages)
 
         # 4) Llamada a OpenAI
-        r = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "gpt-4o-mini",
-                "temperature": 0.1,
-                "response_format": {"type": "json_object"},
-                "messages": [
-                    {"role": "system", "content": system},
-                    {"role": "user", "content": content},
-                ],
-                # máximo permitido para salida larga
-                "max_tokens": 16000,
-            },
-            timeout=300,
-        )
+        body = {
+            "model": "gpt-4o-mini",
+            "temperature": 0.1,
+            "response_format": {"type": "json_object"},
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": content},
+            ],
+            # máximo permitido para salida larga
+            "max_tokens": 16000,
+        }
+
+        if ndjson:
+            # Las filas salen apenas el modelo cierra cada objeto; el resumen, al final
+            scanner = RowScanner()
+            parts: List[str] = []
+            for delta in stream_chat(api_key, body):
+                parts.append(delta)
+                ready = scanner.feed(delta)
+                if ready:
+                    _emit_line({"type": "rows", "rows": [normalize_row(rrow) for rrow in ready]})
+                    emitted += len(ready)
+            data = load_model_json("".join(parts) or "{}")
+            rows = data.get("rows", []) if isinstance(data, dict) else []
+            # Lo que el escáner no pudo seguir (p. ej. JSON reparado) sale en un último bloque
+            rest = rows[emitted:] if isinstance(rows, list) else []
+            if rest:
+                _emit_line({"type": "rows", "rows": [normalize_row(rrow) for rrow in rest]})
+                emitted += len(rest)
+            _emit_line({"type": "summary", "success": True, "total_rows": emitted,
+                        "notas": data.get("notas") if isinstance(data, dict) else None, "pages": modes,
+                        "http": get_client().report()})
+            return
+
+        r = get_client().chat(api_key, body, timeout=300, deadline=AI_DEADLINE)
 
         r.raise_for_status()
         raw = r.json()["choices"][0]["message"]["content"] or "{}"
 
         # 5) Reparar JSON incompleto
-        try:
-            data = json.loads(raw)
-        except json.JSONDecodeError:
-            # intentar reparar
-            fixed = raw.rsplit("}", 1)[0] + "}"
-            try:
-                data = json.loads(fixed)
-            except Exception:
-                print("[WARN] Respuesta JSON incompleta o corrupta", file=sys.stderr)
-                data = {"rows": [], "notas": "Respuesta incompleta del modelo"}
+        data = load_model_json(raw)
 
         # 6) Normalizar filas
         rows = data.get("rows", []) if isinstance(data, dict) else []
-        norm = []
-        for rrow in rows:
-            nombre = (rrow or {}).get("nombre_comercial")
-            modelo = (rrow or {}).get("modelo")
-            desc = (rrow or {}).get("descripcion")
-
-            if nombre and modelo and nombre.strip().upper() == modelo.strip().upper():
-                nombre = f"PRODUCTO {modelo}"
-            if not nombre and modelo:
-                nombre = f"PRODUCTO {modelo}"
-            if not modelo and nombre:
-                m = re.search(r"[A-Z]{2,}\d+[A-Z]*", nombre)
-                if m:
-                    modelo = m.group(0)
-            if not desc:
-                desc = f"Artículo {nombre.title()}" if nombre else "Producto sin descripción"
-
-            norm.append({
-                "nombre_comercial": nombre.upper().strip() if nombre else None,
-                "descripcion": desc,
-                "modelo": modelo,
-                "unidad_de_medida": (rrow or {}).get("unidad_de_medida"),
-                "cantidad_x_caja": try_float((rrow or {}).get("cantidad_x_caja")),
-                "cajas": try_float((rrow or {}).get("cajas")),
-                "total_unidades": try_float((rrow or {}).get("total_unidades")),
-                "partida": clean_partida((rrow or {}).get("partida")),
-                "precio_unitario_usd": try_float((rrow or {}).get("precio_unitario_usd")),
-                "total_usd": try_float((rrow or {}).get("total_usd")),
-            })
+        norm = [normalize_row(rrow) for rrow in rows]
 
         # 7) Salida final
-        _emit_json({"success": True, "rows": norm, "notas": data.get("notas")})
+        _emit_json({"success": True, "rows": norm, "notas": data.get("notas"), "pages": modes,
+                    "http": get_client().report()})
 
     except Exception as e:
-        _emit_json({"success": False, "error": str(e)})
+        if ndjson:
+            _emit_line({"type": "summary", "success": False, "error": str(e), "total_rows": emitted, "pages": modes})
+        else:
+            _emit_json({"success": False, "error": str(e)})
+    finally:
+        if session is not None:
+            session.close()
 
 # ==========================================================
 if __name__ == "__main__":
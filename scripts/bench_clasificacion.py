@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark del clasificador de productos (prep_liquidacion) contra la API real:
+una imagen por llamada frente a lotes de K imágenes por llamada (CLASSIFY_BATCH).
+Toma las imágenes de producto de un PDF (mismo pre-filtro que prep_liquidacion:
+sin duplicados ni viñetas / logos) y, por modo, mide:
+  - llamadas HTTP (incluye reintentos, que van aparte), segundos e imágenes por segundo
+  - tokens de entrada / salida por imagen y costo estimado por imagen
+  - reintentos de a una (ítems que el lote no devolvió o devolvió mal formados)
+  - concordancia del capítulo arancelario (4 dígitos) con el modo de una imagen
+
+Cuesta dinero: cada modo clasifica todas las imágenes. Sin caché persistente.
+Precios (USD por millón de tokens) en PRICE_IN_PER_M / PRICE_OUT_PER_M (gpt-4o-mini).
+
+Uso: python scripts/bench_clasificacion.py <pdf> <openai_api_key> [max_imagenes] [K ...]
+"""
+
+import os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Los logs del clasificador van a stderr; las tablas quedan en stdout
+_REAL_STDOUT = sys.stdout
+sys.stdout = sys.stderr
+
+from extraerimagenes import iter_images_from_pdf, image_record, new_duplicate_index, find_duplicate, classifier_variant, product_check, repeat_pages
+from prep_liquidacion import ClassifyLimiter, classify_all, to_b64
+
+PRICE_IN_PER_M = float(os.getenv("PRICE_IN_PER_M", "0.15"))
+PRICE_OUT_PER_M = float(os.getenv("PRICE_OUT_PER_M", "0.60"))
+
+
+def _emit(line: str) -> None:
+    _REAL_STDOUT.write(line + "\n")
+    _REAL_STDOUT.flush()
+
+
+def product_calls(pdf_path: str, limit: int) -> dict:
+    """{nombre: (b64, mime)} de las imágenes que prep_liquidacion mandaría al clasificador."""
+    extracted = [(image_record(i, p, r, d), d) for i, p, r, d in iter_images_from_pdf(pdf_path)]
+    repeats = repeat_pages([rec for rec, _ in extracted])
+    seen = new_duplicate_index()
+    calls = {}
+    for rec, data in extracted:
+        if find_duplicate(rec, seen) is not None:
+            continue
+        if not product_check(data, rec["rect"], repeats.get(rec["sha1"], 1))[0]:
+            continue
+        small, mime = classifier_variant(data)
+        calls[rec["name"]] = (to_b64(small), mime)
+        if len(calls) >= limit:
+            break
+    return calls
+
+
+def bench_batch(calls: dict, api_key: str, sizes: list[int]) -> None:
+    n = len(calls)
+    _emit(f"{'modo':>8} {'llamadas':>8} {'reint.':>6} {'seg':>7} {'img/s':>6} {'tok_in/img':>10} {'tok_out/img':>11} "
+          f"{'USD/img':>9} {'de a una':>8} {'capítulo=':>9}")
+    base = None
+    for k in sizes:
+        limiter = ClassifyLimiter()
+        t0 = time.perf_counter()
+        results = classify_all(calls, api_key, limiter, batch=k)
+        dt = time.perf_counter() - t0
+        s = limiter.stats
+        cost = (s["prompt_tokens"] * PRICE_IN_PER_M + s["completion_tokens"] * PRICE_OUT_PER_M) / 1e6
+        chapters = {f: r["hs_code"][:4] for f, r in results.items()}
+        if base is None:
+            base = chapters
+        same = sum(chapters[f] == base[f] for f in calls) / n
+        _emit(f"{'K=' + str(k):>8} {s['attempts']:>8} {s['retries']:>6} {dt:>7.2f} {n / dt:>6.2f} {s['prompt_tokens'] / n:>10.0f} "
+              f"{s['completion_tokens'] / n:>11.0f} {cost / n:>9.6f} {s['batch_fallbacks']:>8} {same:>9.0%}")
+
+
+def main():
+    if len(sys.argv) < 3:
+        _emit("Uso: python bench_clasificacion.py <pdf> <openai_api_key> [max_imagenes] [K ...]")
+        sys.exit(1)
+    pdf_path, api_key = sys.argv[1], sys.argv[2]
+    limit = int(sys.argv[3]) if len(sys.argv) > 3 else 24
+    sizes = [int(k) for k in sys.argv[4:]] or [4, 8]
+    sizes = [1] + [k for k in sizes if k > 1]  # el modo de una imagen es la referencia
+
+    calls = product_calls(pdf_path, limit)
+    if not calls:
+        _emit("[bench] El PDF no tiene imágenes de producto")
+        sys.exit(1)
+    _emit(f"[bench] {len(calls)} imágenes de producto; lotes K={sizes[1:]}")
+    bench_batch(calls, api_key, sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de extracción de imágenes (extraerimagenes.extract_images_from_pdf).
+Genera un catálogo sintético tipo proforma y mide:
+  - el tiempo según nº de procesos (workers)
+  - render por clip desde un display list cacheado vs page.get_pixmap() por clip
+  - passthrough del JPEG/PNG embebido vs re-render a PNG (tiempo y bytes)
+  - descubrimiento de placements (get_image_info + numpy) vs el recorrido anterior
+    por xref, verificando que el orden visual sea idéntico (sale con código 1 si no)
+  - sesión PDF compartida (extracción + texto + render de páginas + parser) vs cada etapa
+    abriendo el PDF por su cuenta; verifica salidas idénticas y que ninguna página se
+    interprete ni rasterice más de una vez (sale con código 1 si no)
+  - pre-vuelo por página (tabla vectorial / texto / escaneada / solo fotos / escaneo que
+    no llena la página / en blanco): tipos y motores esperados (solo la página en blanco
+    se salta) y que pdfplumber no encuentre tablas fuera del motor de tablas
+
+Uso: python scripts/bench_extraccion.py [paginas] [imagenes_por_pagina]
+"""
+
+import os, sys, time, random, tempfile
+import fitz  # PyMuPDF
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from extraerimagenes import extract_images_from_pdf, iter_images_from_pdf, _page_placements
+from sesion_pdf import PdfSession
+import pdf_to_images_b64 as page_renders
+
+
+# ==========================================================
+# PDF SINTÉTICO
+# ==========================================================
+def _sample_image(seed: int, size: int = 320) -> bytes:
+    """Imagen de prueba con franjas + ruido (no comprime trivialmente); pares PNG, impares JPEG."""
+    buf = bytearray(os.urandom(size * size * 3))
+    for y in range(0, size, 4):
+        row = y * size * 3
+        for x in range(0, size * 3, 3):
+            buf[row + x] = (x // 3 + seed * 37) % 256
+    pix = fitz.Pixmap(fitz.csRGB, size, size, bytes(buf), False)
+    return pix.tobytes("png") if seed % 2 == 0 else pix.tobytes("jpg", jpg_quality=85)
+
+
+def build_catalog(path: str, pages: int, per_page: int, cols: int = 3, ruling: int = 0) -> None:
+    """
+    Catálogo con `per_page` fotos en rejilla + texto (modelo / precio) por página.
+    `ruling` agrega líneas vectoriales (tablas de especificaciones) para que interpretar
+    la página cueste lo que cuesta en un catálogo real.
+    """
+    doc = fitz.open()
+    images = [_sample_image(i) for i in range(8)]
+    rows = max(1, -(-per_page // cols))
+    for p in range(pages):
+        page = doc.new_page(width=595, height=842)
+        cell_w = (595 - 60) / cols
+        cell_h = (842 - 80) / rows
+        for k in range(per_page):
+            r, c = divmod(k, cols)
+            x0 = 30 + c * cell_w
+            y0 = 40 + r * cell_h
+            rect = fitz.Rect(x0 + 4, y0 + 4, x0 + cell_w - 4, y0 + cell_h - 18)
+            page.insert_image(rect, stream=images[(p * per_page + k) % len(images)])
+            page.insert_text((x0 + 4, y0 + cell_h - 6), f"MOD-{p:03d}{k:02d}  $ {k * 3.5:.2f}", fontsize=7)
+        if ruling:
+            shape = page.new_shape()
+            for i in range(ruling):
+                y = 40 + (i * 762.0 / ruling)
+                shape.draw_line((30, y), (565, y))
+            shape.finish(width=0.2, color=(0.6, 0.6, 0.6))
+            shape.commit(overlay=False)
+    doc.save(path)
+    doc.close()
+
+
+def build_icon_pages(path: str, pages: int, per_page: int, seed: int = 7) -> None:
+    """
+    Páginas con cientos de miniaturas ÚNICAS (íconos / fotos de tabla de specs) en
+    posiciones con ruido en Y, para caer en los bordes de los buckets de fila.
+    """
+    rnd = random.Random(seed)
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page(width=595, height=842)
+        for k in range(per_page):
+            pix = fitz.Pixmap(fitz.csRGB, 8, 8, os.urandom(8 * 8 * 3), False)
+            x0 = 20 + (k % 20) * 27 + rnd.choice((0.0, 0.0, 0.5))
+            y0 = 20 + (k // 20) * 30 + rnd.uniform(-6, 6)
+            size = rnd.choice((12, 16, 20))
+            page.insert_image(fitz.Rect(x0, y0, x0 + size, y0 + size), pixmap=pix)
+    doc.save(path)
+    doc.close()
+
+
+def build_repeat_page(path: str, seed: int = 11) -> None:
+    """
+    Página con la misma imagen dibujada varias veces: un logo con un solo nombre de
+    recurso invocado en 3 lugares, una foto repetida con otro nombre por instancia y
+    una foto única.
+    """
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    logo = page.insert_image(fitz.Rect(20, 20, 60, 60), stream=_sample_image(seed, 64))
+    photo = page.insert_image(fitz.Rect(100, 200, 250, 350), stream=_sample_image(seed + 1))
+    page.insert_image(fitz.Rect(300, 200, 450, 350), xref=photo)
+    page.insert_image(fitz.Rect(100, 500, 250, 650), stream=_sample_image(seed + 2))
+    # Mismo nombre (mismo "Do") en otras 2 posiciones; coordenadas PDF con origen abajo
+    name = next(m[7] for m in page.get_images(full=True) if m[0] == logo)
+    extra = f"\nq 40 0 0 40 535 782 cm /{name} Do Q\nq 40 0 0 40 20 20 cm /{name} Do Q\n"
+    xref = page.get_contents()[0]
+    doc.update_stream(xref, doc.xref_stream(xref) + extra.encode())
+    doc.save(path)
+    doc.close()
+
+
+# ==========================================================
+# MEDICIÓN
+# ==========================================================
+# Los logs del extractor van a stderr; las tablas quedan en stdout
+_REAL_STDOUT = sys.stdout
+sys.stdout = sys.stderr
+
+
+def _emit(line: str) -> None:
+    _REAL_STDOUT.write(line + "\n")
+    _REAL_STDOUT.flush()
+
+
+def _timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return time.perf_counter() - t0, out
+
+
+def bench_workers(pdf_path: str, tmp: str) -> None:
+    cpu = os.cpu_count() or 1
+    counts = sorted({1, 2, 4, 8, cpu} & set(range(1, cpu + 1))) or [1]
+    base = None
+    _emit(f"\n== Render por procesos (CPU: {cpu}) ==")
+    _emit(f"{'workers':>8} {'seg':>8} {'imgs':>6} {'speedup':>8}")
+    for w in counts:
+        out = os.path.join(tmp, f"w{w}")
+        secs, n = _timed(extract_images_from_pdf, pdf_path, out, workers=w, passthrough=False)
+        base = base or secs
+        _emit(f"{w:>8} {secs:>8.2f} {n:>6} {base / secs:>7.2f}x")
+
+
+def bench_displaylist(tmp: str, pages: int = 6, per_page: int = 30) -> None:
+    """Páginas densas (muchas fotos): un display list por página vs reinterpretar por clip."""
+    pdf_path = os.path.join(tmp, "denso.pdf")
+    build_catalog(pdf_path, pages, per_page, cols=5, ruling=4000)
+    _emit(f"\n== Display list por página ({pages} págs x {per_page} imágenes) ==")
+    _emit(f"{'modo':>14} {'seg':>8} {'imgs':>6}")
+    times = {}
+    for label, flag in (("get_pixmap", False), ("displaylist", True)):
+        out = os.path.join(tmp, f"dl_{label}")
+        secs, n = _timed(extract_images_from_pdf, pdf_path, out, workers=1, displaylist=flag, passthrough=False)
+        times[label] = secs
+        _emit(f"{label:>14} {secs:>8.2f} {n:>6}")
+    _emit(f"{'speedup':>14} {times['get_pixmap'] / times['displaylist']:>7.2f}x")
+
+
+def _folder_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+def bench_passthrough(pdf_path: str, tmp: str) -> None:
+    """Copia directa del stream embebido vs rasterizar el clip a zoom 2."""
+    _emit("\n== Passthrough vs render ==")
+    _emit(f"{'modo':>14} {'seg':>8} {'imgs':>6} {'MB':>8}")
+    for label, flag in (("render", False), ("passthrough", True)):
+        out = os.path.join(tmp, f"pt_{label}")
+        secs, n = _timed(extract_images_from_pdf, pdf_path, out, workers=1, passthrough=flag)
+        _emit(f"{label:>14} {secs:>8.2f} {n:>6} {_folder_bytes(out) / 1e6:>8.2f}")
+
+
+def _legacy_placements(page, row_tol_ratio: float = 0.018, row_tol_px=None, invert_y: bool = False):
+    """Referencia: descubrimiento anterior (get_images + get_image_bbox / get_image_rects por xref)."""
+    items = []
+    page_h = float(page.rect.height)
+    tol = float(max(8.0, (row_tol_px if row_tol_px is not None else page_h * row_tol_ratio)))
+    for meta in page.get_images(full=True):
+        xref = meta[0]
+        imname = meta[7] if len(meta) > 7 else None
+        rect_list = []
+        if imname:
+            try:
+                r = page.get_image_bbox(imname)
+                if r and not r.is_empty:
+                    rect_list.append(r)
+            except Exception:
+                pass
+        if not rect_list:
+            rect_list = page.get_image_rects(xref) or []
+        for rect in rect_list:
+            if not rect or rect.is_empty:
+                continue
+            y_center = (rect.y0 + rect.y1) / 2.0
+            if invert_y:
+                y_center = page_h - y_center
+            items.append((round(y_center / tol), min(rect.x0, rect.x1), xref, rect))
+    items.sort(key=lambda t: (t[0], t[1]))
+    return [(xref, rect) for _, __, xref, rect in items]
+
+
+def bench_placements(tmp: str, pages: int = 2, per_page: int = 160) -> bool:
+    """
+    Tiempo de descubrimiento + verificación de orden (y conteo) idéntico al recorrido
+    anterior, también con una imagen dibujada varias veces en la misma página.
+    """
+    pdf_path = os.path.join(tmp, "iconos.pdf")
+    build_icon_pages(pdf_path, pages, per_page)
+    repeat_path = os.path.join(tmp, "repetidas.pdf")
+    build_repeat_page(repeat_path)
+    _emit(f"\n== Descubrimiento de placements ({pages} págs x {per_page} miniaturas) ==")
+
+    same = True
+    doc = fitz.open(pdf_path)
+    repeat = fitz.open(repeat_path)
+    for kwargs in ({}, {"row_tol_px": 10.0}, {"invert_y": True}):
+        for page in [*doc, *repeat]:
+            old = [(x, tuple(round(v, 3) for v in r)) for x, r in _legacy_placements(page, **kwargs)]
+            new = [
+                (x, tuple(round(v, 3) for v in r))
+                for x, r, _ in _page_placements(
+                    page, 0.018, kwargs.get("row_tol_px"), kwargs.get("invert_y", False)
+                )
+            ]
+            same = same and old == new
+
+    times = {}
+    for label, fn in (
+        ("anterior", lambda pg: _legacy_placements(pg)),
+        ("image_info", lambda pg: _page_placements(pg, 0.018, None, False)),
+    ):
+        fresh = fitz.open(pdf_path)  # sin cachés de página entre modos
+        secs, _ = _timed(lambda: [fn(pg) for pg in fresh])
+        fresh.close()
+        times[label] = secs
+        _emit(f"{label:>14} {secs:>8.3f} s")
+    doc.close()
+    repeat.close()
+    _emit(f"{'speedup':>14} {times['anterior'] / times['image_info']:>7.2f}x")
+    _emit(f"{'orden':>14} {'idéntico' if same else 'DIFERENTE'}")
+    return same
+
+
+def build_mixed(path: str) -> list[tuple[str, str]]:
+    """Una página de cada tipo; devuelve (tipo, motor) esperados por página."""
+    doc = fitz.open()
+    # Tabla vectorial: rejilla con ruling + celdas
+    page = doc.new_page(width=595, height=842)
+    xs, ys = [40, 120, 320, 420, 520], [60 + 20 * r for r in range(12)]
+    for y in ys:
+        page.draw_line((xs[0], y), (xs[-1], y), width=0.5)
+    for x in xs:
+        page.draw_line((x, ys[0]), (x, ys[-1]), width=0.5)
+    heads = ["ITEM", "DESCRIPTION", "QTY", "UNIT PRICE"]
+    for r in range(len(ys) - 1):
+        for c in range(len(xs) - 1):
+            txt = heads[c] if r == 0 else [str(r), f"Bomba MOD-{r:03d}", str(r * 10), f"{r * 3.5:.2f}"][c]
+            page.insert_text((xs[c] + 3, ys[r] + 14), txt, fontsize=8)
+    # Texto sin tablas
+    page = doc.new_page(width=595, height=842)
+    page.insert_textbox(fitz.Rect(40, 40, 555, 800), "Términos y condiciones de pago. " * 40, fontsize=9)
+    # Escaneada: una imagen a página completa, sin capa de texto
+    page = doc.new_page(width=595, height=842)
+    page.insert_image(page.rect, stream=_sample_image(2, 600))
+    # Solo fotos pequeñas
+    page = doc.new_page(width=595, height=842)
+    for k in range(4):
+        page.insert_image(fitz.Rect(40 + 130 * k, 40, 160 + 130 * k, 160), stream=_sample_image(k))
+    # Escaneo de la tabla que no llena la página (< PREFLIGHT_SCAN_COVERAGE): también va a OCR
+    scan = doc[0].get_pixmap(matrix=fitz.Matrix(2, 2), clip=fitz.Rect(30, 50, 530, 290)).tobytes("png")
+    page = doc.new_page(width=595, height=842)
+    page.insert_image(fitz.Rect(40, 60, 540, 300), stream=scan)
+    # En blanco
+    doc.new_page(width=595, height=842)
+    doc.save(path)
+    doc.close()
+    return [
+        ("vector_table", "tables"), ("text", "text"), ("scanned", "ocr"),
+        ("image_only", "ocr"), ("image_only", "ocr"), ("blank", "skip"),
+    ]
+
+
+def bench_preflight(tmp: str) -> bool:
+    import pdfplumber
+    pdf_path = os.path.join(tmp, "mixto.pdf")
+    expected = build_mixed(pdf_path)
+    _emit("\n== Pre-vuelo por página ==")
+    with PdfSession(pdf_path) as session:
+        secs, plan = _timed(session.plan)
+    kinds = [(p["kind"], p["engine"]) for p in plan]
+    with pdfplumber.open(pdf_path) as pdf:
+        # Tiempo de lo que se ahorra: intentar tablas en TODAS las páginas
+        secs_try, found = _timed(lambda: [bool(pg.extract_tables()) for pg in pdf.pages])
+    skipped_ok = all(not f for f, p in zip(found, plan) if p["engine"] != "tables")
+    for p in plan:
+        _emit(f"{p['page']:>6} {p['kind']:>14} {p['engine']:>8} chars={p['chars']} ruling={p['ruling']} img={p['image_coverage']}")
+    _emit(f"{'pre-vuelo':>14} {secs * 1000:>8.1f} ms   (extract_tables en todas: {secs_try * 1000:.1f} ms)")
+    _emit(f"{'tipos':>14} {'esperados' if kinds == expected else 'DIFERENTES'}; "
+          f"{'sin tablas perdidas' if skipped_ok else 'TABLA PERDIDA'}")
+    return kinds == expected and skipped_ok
+
+
+def _stages(pdf_path: str, session=None) -> dict:
+    """Lo que hace una corrida completa: imágenes, texto, páginas para la IA y (si está) parser."""
+    out = {"images": [d for *_, d in iter_images_from_pdf(pdf_path, workers=1, session=session)]}
+    if session is not None:
+        out["text"] = [session.text(i) for i in range(len(session))]
+    else:
+        with fitz.open(pdf_path) as doc:
+            out["text"] = [page.get_text() for page in doc]
+    out["pages"] = page_renders.pdf_to_images_b64(pdf_path, max_pages=10**6, session=session)
+    try:
+        from parser_proforma import parse_pdf_hybrid
+    except ImportError:
+        return out
+    with open(pdf_path, "rb") as f:
+        df = parse_pdf_hybrid(f.read(), session=session)
+    out["rows"] = df.to_dict("records")
+    return out
+
+
+def bench_session(pdf_path: str) -> bool:
+    _emit("\n== Sesión PDF compartida vs etapas independientes ==")
+    secs_alone, alone = _timed(_stages, pdf_path)
+    with PdfSession(pdf_path) as session:
+        secs_shared, shared = _timed(_stages, pdf_path, session)
+        rep = session.report()
+    same = alone == shared
+    once = rep["max_parses_per_page"] <= 1 and rep["max_renders_per_page_zoom"] <= 1 and rep["max_plumber_per_page"] <= 1
+    _emit(f"{'independiente':>14} {secs_alone:>8.2f} s")
+    _emit(f"{'sesión':>14} {secs_shared:>8.2f} s")
+    _emit(f"{'speedup':>14} {secs_alone / secs_shared:>7.2f}x")
+    _emit(f"{'contadores':>14} {rep}")
+    _emit(f"{'salida':>14} {'idéntica' if same else 'DIFERENTE'}; {'1 vez por página' if once else 'REPETIDA'}")
+    return same and once
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    per_page = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, "catalogo.pdf")
+        build_catalog(pdf_path, pages, per_page)
+        _emit(f"[bench] Catálogo sintético: {pages} páginas x {per_page} imágenes")
+        bench_workers(pdf_path, tmp)
+        bench_displaylist(tmp)
+        bench_passthrough(pdf_path, tmp)
+        ok = bench_placements(tmp)
+        ok = bench_session(pdf_path) and ok
+        ok = bench_preflight(tmp) and ok
+        if not ok:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
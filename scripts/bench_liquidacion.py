@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark del pipeline de liquidacion_completa (extracción -> subida + clasificación
+solapadas). Sobre un PDF sintético de fotos únicas, con la subida a Drive y el
+clasificador reemplazados por esperas fijas (sin red, sin costo), mide por escenario:
+  - total de punta a punta (wall)
+  - suma de las etapas (lo que tardaría hacer cada imagen entera antes de la siguiente)
+  - etapa efectiva más lenta (ocupado / hilos)
+y verifica que el total quede cerca de la etapa más lenta y no de la suma: total <=
+MAX_VS_BOTTLENECK x etapa más lenta y total < suma (sale con código 1 si no).
+
+Uso: python scripts/bench_liquidacion.py [imagenes] [seg_subida seg_clasificacion ...]
+"""
+
+import os, sys, time, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Sin caché persistente: cada corrida clasifica todo
+os.environ["CLASSIFY_CACHE"] = "0"
+
+# Los logs del pipeline van a stderr; las tablas quedan en stdout
+_REAL_STDOUT = sys.stdout
+sys.stdout = sys.stderr
+
+import fitz  # PyMuPDF
+import liquidacion_completa as lc
+from bench_extraccion import _sample_image
+
+MAX_VS_BOTTLENECK = float(os.getenv("MAX_VS_BOTTLENECK", "1.5"))
+
+
+def _emit(line: str) -> None:
+    _REAL_STDOUT.write(line + "\n")
+    _REAL_STDOUT.flush()
+
+
+def build_photos(path: str, n: int, per_page: int = 6) -> None:
+    """PDF con n fotos distintas (ninguna duplicada ni con pinta de logo), 2 columnas."""
+    doc = fitz.open()
+    for k in range(n):
+        if k % per_page == 0:
+            page = doc.new_page(width=595, height=842)
+        r, c = divmod(k % per_page, 2)
+        x0, y0 = 40 + c * 270, 40 + r * 260
+        page.insert_image(fitz.Rect(x0, y0, x0 + 240, y0 + 240), stream=_sample_image(k, 160))
+    doc.save(path)
+    doc.close()
+
+
+def fake_stages(upload_s: float, classify_s: float) -> None:
+    """Subida y clasificador simulados: solo esperan (como la red) y devuelven algo válido."""
+    def upload(data, name, folder_id):
+        time.sleep(upload_s)
+        return f"https://drive.google.com/file/d/{name}/view"
+
+    def classify(items, api_key, usage=None):
+        time.sleep(classify_s)
+        if usage is not None:
+            with lc._USAGE_LOCK:
+                usage["requests"] += 1
+        return [{"hs_code": "000000", "commercial_name": "x", "confidence": 1.0, "reason": ""} for _ in items]
+
+    lc._upload_url = upload
+    lc.classify_images_batch = classify
+    lc.create_liquidacion_sheet = lambda image_data, doc_name, folder_id: ""
+
+
+def bench_overlap(pdf_path: str, scenarios: list[tuple[float, float]]) -> bool:
+    _emit(f"{'subida':>7} {'clasif.':>7} {'total':>7} {'suma':>7} {'más lenta':>9} "
+          f"{'total/suma':>10} {'total/lenta':>11}")
+    ok = True
+    for upload_s, classify_s in scenarios:
+        fake_stages(upload_s, classify_s)
+        out = lc.process_liquidacion_completa(pdf_path, "bench", "folder", "key")
+        if not out.get("success"):
+            _emit(f"[bench] Falló el pipeline: {out.get('error')}")
+            return False
+        t = out["timings"]
+        ok = ok and t["total_s"] < t["serial_s"] and t["vs_bottleneck"] <= MAX_VS_BOTTLENECK
+        _emit(f"{upload_s:>7.3f} {classify_s:>7.3f} {t['total_s']:>7.2f} {t['serial_s']:>7.2f} "
+              f"{t['bottleneck_s']:>9.2f} {t['vs_serial']:>10.2f} {t['vs_bottleneck']:>11.2f}")
+    _emit(f"{'solape':>7} {'cerca de la etapa más lenta' if ok else 'NO'}")
+    return ok
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 48
+    args = [float(v) for v in sys.argv[2:]]
+    # Parejo, limitado por la subida y limitado por el clasificador
+    scenarios = list(zip(args[::2], args[1::2])) or [(0.05, 0.05), (0.15, 0.03), (0.03, 0.15)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, "fotos.pdf")
+        build_photos(pdf_path, n)
+        _emit(f"[bench] {n} fotos; hilos subida={lc.UPLOAD_WORKERS} clasificación={lc.CLASSIFY_WORKERS} "
+              f"lote={lc.CLASSIFY_BATCH} en vuelo={lc.PIPELINE_DEPTH}")
+        if not bench_overlap(pdf_path, scenarios):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,546 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark del parser de proformas (parser_proforma.py) sobre proformas sintéticas.
+Mide arranque + latencia según cómo lo invoca prep_liquidacion:
+  - subprocess: CLI en un intérprete nuevo + JSON de ida y vuelta (modo anterior)
+  - inprocess:  parse_proforma() importado (primera llamada con imports / siguientes)
+  - worker:     proceso aparte ya caliente (arranque del pool / llamadas siguientes)
+y verifica que los tres devuelvan las mismas filas (sale con código 1 si no).
+También mide extract_tables repartido en procesos (--workers) frente al modo serial,
+y compara los motores de tablas (--engine pymupdf / pdfplumber / auto) sobre un corpus
+de variantes de proforma: tiempo y concordancia de filas con pdfplumber (sale con
+código 1 si algún motor no concuerda al 100% en alguna variante).
+normalize_dataframe se mide contra la versión anterior (fila a fila) a 1k/10k/100k
+filas, verificando que el DataFrame resultante sea idéntico (sale con código 1 si no).
+La serialización de salida (df_to_rows + JSON) se compara con la anterior (iterrows +
+clean_nans + json.dumps) con ambos backends JSON y en formato columnar; el JSON
+decodificado debe ser el mismo (sale con código 1 si no).
+La ingesta de Excel / CSV (parse_sheet: xlsx read_only y CSV por bloques) se compara
+con la carga completa en memoria (pd.read_excel / lista de filas): tiempo, pico de
+memoria (tracemalloc) y filas idénticas (sale con código 1 si no).
+El OCR por regiones (OCR_MODE=regions) se compara con el render de página completa
+sobre páginas escaneadas (fotos + tabla, solo tabla, solo fotos): tiempo de render y
+megapíxeles que llegarían al OCR; toda palabra de la tabla debe caer dentro de una
+región y las regiones no deben cubrir más del 5% del área de las fotos (en la página
+de solo fotos queda la línea de título como región; sale con código 1 si no).
+
+Uso: python scripts/bench_parser.py [paginas] [filas_por_pagina]
+"""
+
+import os, sys, csv, time, json, random, tempfile, subprocess, tracemalloc
+import fitz  # PyMuPDF
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Los logs del parser van a stderr; las tablas quedan en stdout
+_REAL_STDOUT = sys.stdout
+sys.stdout = sys.stderr
+
+
+def _emit(line: str) -> None:
+    _REAL_STDOUT.write(line + "\n")
+    _REAL_STDOUT.flush()
+
+
+def _timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return time.perf_counter() - t0, out
+
+
+# ==========================================================
+# PROFORMA SINTÉTICA
+# ==========================================================
+HEADERS = ["ITEM", "MODEL", "DESCRIPTION", "QTY", "PACKAGE", "UNIT PRICE", "AMOUNT", "HS CODE"]
+
+
+def proforma_cells(p: int, r: int) -> list[str]:
+    """Celdas de la fila r (desde 1) de la página p; algunas con $ y separador de miles."""
+    n = p * 1000 + r
+    qty = (n % 37 + 1) * 10
+    price = (n % 91) * 1.25 + 0.5
+    return [
+        str(n), f"MOD-{n:05d}", f"Bomba centrífuga {n % 13} HP", f"{qty:,}",
+        str(n % 9 + 1), f"${price:.2f}", f"{qty * price:,.2f}", f"8413.70.{n % 100:02d}",
+    ]
+
+
+def build_proforma(
+    path: str,
+    pages: int,
+    rows: int,
+    blanks: float = 0.0,        # fracción de celdas vacías
+    rects: bool = False,        # rejilla dibujada como un rectángulo por celda
+    title: bool = False,        # membrete / texto suelto sobre la tabla
+    two_line: bool = False,     # descripciones en dos renglones dentro de la celda
+    seed: int = 0,
+) -> None:
+    """Tablas con ruling completo (lo que pdfplumber detecta) y encabezado en cada página."""
+    rnd = random.Random(seed)
+    widths = [30, 62, 150, 45, 45, 60, 70, 68]
+    xs = [20]
+    for w in widths:
+        xs.append(xs[-1] + w)
+    top = 110 if title else 50
+    row_h = min(24.0 if two_line else 18.0, (820.0 - top) / (rows + 1))
+    fs = min(7, (row_h - 4) / (2 if two_line else 1))
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page(width=595, height=842)
+        if title:
+            page.insert_text((20, 40), "PROFORMA INVOICE", fontsize=14)
+            page.insert_text((20, 60), f"No. PI-{seed:03d}-{p:02d}    Fecha: 2025-10-22    Cliente: CESCH", fontsize=8)
+        ys = [top + row_h * k for k in range(rows + 2)]
+        shape = page.new_shape()
+        if rects:
+            for r in range(rows + 1):
+                for c in range(len(widths)):
+                    shape.draw_rect(fitz.Rect(xs[c], ys[r], xs[c + 1], ys[r + 1]))
+        else:
+            for y in ys:
+                shape.draw_line((xs[0], y), (xs[-1], y))
+            for x in xs:
+                shape.draw_line((x, ys[0]), (x, ys[-1]))
+        shape.finish(width=0.4, color=(0, 0, 0))
+        shape.commit()
+        for r in range(rows + 1):
+            cells = HEADERS if r == 0 else proforma_cells(p, r)
+            for c, txt in enumerate(cells):
+                if r and c not in (0, 3) and rnd.random() < blanks:
+                    continue
+                if two_line and r and c == 2:
+                    page.insert_text((xs[c] + 2, ys[r] + fs + 2), txt, fontsize=fs)
+                    page.insert_text((xs[c] + 2, ys[r] + 2 * fs + 3), "Acero inoxidable", fontsize=fs)
+                    continue
+                page.insert_text((xs[c] + 2, ys[r] + row_h - 5), txt, fontsize=fs)
+    doc.save(path)
+    doc.close()
+
+
+# Corpus de variantes para comparar motores de tablas
+CORPUS = [
+    ("simple", {}),
+    ("vacías", {"blanks": 0.15, "seed": 1}),
+    ("rectángulos", {"rects": True, "seed": 2}),
+    ("membrete", {"title": True, "seed": 3}),
+    ("dos renglones", {"two_line": True, "seed": 4}),
+    ("todo", {"blanks": 0.1, "rects": True, "title": True, "two_line": True, "seed": 5}),
+]
+
+
+# ==========================================================
+# MEDICIÓN
+# ==========================================================
+def _cli_rows(pdf_path: str) -> list:
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser_proforma.py")
+    out = subprocess.check_output([sys.executable, script, pdf_path], stderr=subprocess.DEVNULL)
+    return json.loads(out)["rows"]
+
+
+def bench_modes(pdf_path: str, calls: int = 3) -> bool:
+    _emit(f"\n== Invocación del parser ({calls} llamadas por modo) ==")
+    _emit(f"{'modo':>22} {'seg':>8}")
+    results = {}
+
+    secs = [_timed(_cli_rows, pdf_path) for _ in range(calls)]
+    results["subprocess"] = secs[-1][1]
+    _emit(f"{'subprocess (c/u)':>22} {sum(s for s, _ in secs) / calls:>8.3f}")
+
+    # worker antes que inprocess: el fork no debe heredar los imports ya hechos
+    import prep_liquidacion
+    t_start, pool = _timed(prep_liquidacion.start_parser_worker, wait=True)
+    secs = [_timed(lambda: prep_liquidacion.submit_parser_proforma(pdf_path, mode="worker")()) for _ in range(calls)]
+    results["worker"] = json.loads(json.dumps(secs[-1][1]))
+    pool.shutdown()
+    _emit(f"{'worker arranque':>22} {t_start:>8.3f}")
+    _emit(f"{'worker 1ª':>22} {secs[0][0]:>8.3f}")
+    _emit(f"{'worker siguientes':>22} {sum(s for s, _ in secs[1:]) / max(1, calls - 1):>8.3f}")
+
+    t_import, _ = _timed(__import__, "parser_proforma")
+    from parser_proforma import parse_proforma
+    secs = [_timed(parse_proforma, pdf_path) for _ in range(calls)]
+    results["inprocess"] = json.loads(json.dumps(secs[-1][1]))
+    _emit(f"{'inprocess import':>22} {t_import:>8.3f}")
+    _emit(f"{'inprocess 1ª':>22} {secs[0][0]:>8.3f}")
+    _emit(f"{'inprocess siguientes':>22} {sum(s for s, _ in secs[1:]) / max(1, calls - 1):>8.3f}")
+
+    same = results["subprocess"] == results["inprocess"] == results["worker"]
+    _emit(f"{'filas':>22} {len(results['inprocess'])} ({'idénticas' if same else 'DIFERENTES'})")
+    return same
+
+
+def bench_table_workers(pdf_path: str) -> bool:
+    from parser_proforma import parse_proforma
+    cpu = os.cpu_count() or 1
+    counts = sorted({1, 2, 4, cpu})
+    _emit(f"\n== extract_tables por procesos (CPU: {cpu}) ==")
+    _emit(f"{'workers':>8} {'seg':>8} {'filas':>6} {'speedup':>8}")
+    base = ref = None
+    same = True
+    for w in counts:
+        secs, rows = _timed(parse_proforma, pdf_path, workers=w)
+        base = base or secs
+        ref = rows if ref is None else ref
+        same = same and rows == ref
+        _emit(f"{w:>8} {secs:>8.2f} {len(rows):>6} {base / secs:>7.2f}x")
+    _emit(f"{'filas':>8} {'idénticas' if same else 'DIFERENTES'}")
+    return same
+
+
+def bench_engines(tmp: str, pages: int, rows: int) -> bool:
+    from parser_proforma import extract_tables, parse_proforma, TABLE_ENGINES
+    from sesion_pdf import PdfSession
+    _emit(f"\n== Motores de tablas ({pages} págs x {rows} filas por variante) ==")
+    _emit(f"{'variante':>14} " + " ".join(f"{e:>11}" for e in TABLE_ENGINES) + f" {'filas':>6} {'concuerdan':>11}")
+    totals = {e: 0.0 for e in TABLE_ENGINES}
+    ok = True
+    for name, kwargs in CORPUS:
+        pdf_path = os.path.join(tmp, f"corpus_{kwargs.get('seed', 0)}.pdf")
+        build_proforma(pdf_path, pages, rows, **kwargs)
+        secs, out = {}, {}
+        for engine in TABLE_ENGINES:
+            with PdfSession(pdf_path) as session:  # sesión nueva: sin cachés entre motores
+                secs[engine], _ = _timed(extract_tables, session, list(range(pages)), 1, engine)
+            totals[engine] += secs[engine]
+            out[engine] = parse_proforma(pdf_path, workers=1, engine=engine)
+        ref = out["pdfplumber"]
+        agree = min(
+            sum(a == b for a, b in zip(out[e], ref)) / max(1, len(ref), len(out[e]))
+            for e in TABLE_ENGINES
+        )
+        ok = ok and agree == 1.0
+        _emit(f"{name:>14} " + " ".join(f"{secs[e]:>10.3f}s" for e in TABLE_ENGINES)
+              + f" {len(ref):>6} {agree * 100:>10.1f}%")
+    _emit(f"{'total':>14} " + " ".join(f"{totals[e]:>10.3f}s" for e in TABLE_ENGINES))
+    _emit(f"{'speedup':>14} " + " ".join(f"{totals['pdfplumber'] / totals[e]:>10.2f}x" for e in TABLE_ENGINES))
+    _emit(f"{'filas':>14} {'idénticas' if ok else 'DIFERENTES'} a pdfplumber")
+    return ok
+
+
+def _to_numeric_ignore(s):
+    """pd.to_numeric(errors="ignore") sin el parámetro deprecado: mismo resultado."""
+    try:
+        return pd.to_numeric(s)
+    except (ValueError, TypeError):
+        return s
+
+
+def _legacy_normalize(df):
+    """Referencia: normalize_dataframe anterior (apply por fila, cuatro pasos por columna)."""
+    from parser_proforma import TARGET_COLUMNS, HEADER_ALIASES
+
+    def match(name):
+        n = name.strip().lower()
+        if n in HEADER_ALIASES:
+            return HEADER_ALIASES[n]
+        for k in HEADER_ALIASES:
+            if k in n:
+                return HEADER_ALIASES[k]
+        return None
+
+    new_cols = {}
+    for c in df.columns:
+        mapped = match(str(c))
+        if mapped:
+            new_cols[c] = mapped
+    df = df.rename(columns=new_cols)
+    df = df.loc[:, ~df.columns.duplicated()]
+    for col in TARGET_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+    df = df.reindex(columns=TARGET_COLUMNS, fill_value=None)
+    for c in ["qty", "package", "unit_price", "total_amount"]:
+        df[c] = (
+            df[c].astype(str)
+            .str.replace(",", "", regex=False)
+            .str.replace("$", "", regex=False)
+            .str.extract(r"([-+]?\d*\.?\d+)")[0]
+        )
+        df[c] = _to_numeric_ignore(df[c])
+    df = df.dropna(how="all")
+    df = df[
+        df[["qty", "unit_price", "total_amount"]]
+        .apply(lambda r: any(pd.notna(x) and str(x).strip() != "" for x in r), axis=1)
+    ]
+    exclude_words = [
+        "structure", "size", "weight", "efficiency", "rotating", "speed",
+        "depth", "type", "shaft", "width", "number", "overall", "guage", "track"
+    ]
+    df = df[~df["model"].astype(str).str.lower().isin(exclude_words)]
+    return df.where(pd.notna(df), None)
+
+
+def packing_list(n: int, seed: int = 0):
+    """Filas crudas tipo pdfplumber (encabezados de proforma, celdas de texto, vacías, subtítulos)."""
+    rnd = random.Random(seed)
+    headers = HEADERS + ["REMARK", None]
+    rows = []
+    for k in range(n):
+        roll = rnd.random()
+        if roll < 0.03:
+            rows.append(dict.fromkeys(headers))                       # fila vacía
+            continue
+        cells = proforma_cells(k // 40, k % 40 + 1) + ["", None]
+        if roll < 0.08:
+            cells[1] = rnd.choice(["Weight", "SIZE", "Speed", "Track"])  # especificación, no producto
+        if roll < 0.12:
+            cells[3] = cells[5] = cells[6] = rnd.choice(["", None, "-"])  # subtítulo sin cantidades
+        if rnd.random() < 0.1:
+            cells[5] = f"USD {cells[5]}"
+        rows.append(dict(zip(headers, cells)))
+    return pd.DataFrame(rows)
+
+
+def bench_normalize(sizes=(1_000, 10_000, 100_000)) -> bool:
+    from parser_proforma import normalize_dataframe
+    _emit("\n== normalize_dataframe: anterior vs vectorizado ==")
+    _emit(f"{'filas':>8} {'anterior':>10} {'vector.':>10} {'speedup':>8} {'salida':>10}")
+    same_all = True
+    for n in sizes:
+        raw = packing_list(n, seed=n)
+        t_old, old = _timed(_legacy_normalize, raw.copy())
+        t_new, new = _timed(normalize_dataframe, raw.copy())
+        same = old.equals(new) and list(old.dtypes) == list(new.dtypes) and list(old.index) == list(new.index)
+        same_all = same_all and same
+        _emit(f"{n:>8} {t_old:>9.3f}s {t_new:>9.3f}s {t_old / t_new:>7.2f}x {'idéntica' if same else 'DIFERENTE':>10}")
+    return same_all
+
+
+def _legacy_serialize(df) -> str:
+    from parser_proforma import clean_nans
+    rows = []
+    for _, r in df.iterrows():
+        rows.append({
+            "nombre_comercial": r.get("commercial_name"),
+            "descripcion": r.get("notes") or "Sin descripción",
+            "modelo": r.get("model"),
+            "unidad_de_medida": "PZA",
+            "cantidad_x_caja": r.get("package") or 1,
+            "cajas": 1,
+            "total_unidades": r.get("qty") or 1,
+            "partida": r.get("hs_code"),
+            "precio_unitario_usd": r.get("unit_price"),
+            "total_usd": r.get("total_amount")
+        })
+    rows = clean_nans(rows)
+    return json.dumps(clean_nans({
+        "meta": {"currency": "USD"},
+        "columns": list(rows[0].keys()) if rows else [],
+        "rows": rows,
+        "warnings": []
+    }), ensure_ascii=False, allow_nan=False)
+
+
+def _serialize(df, backend: str, columnar: bool = False) -> str:
+    import parser_proforma as pp
+    prev, pp.JSON_BACKEND = pp.JSON_BACKEND, backend
+    try:
+        if columnar:
+            columns, rows = pp.df_to_columns(df)
+        else:
+            rows = pp.df_to_rows(df)
+            columns = list(rows[0].keys()) if rows else []
+        return pp.dumps({"meta": {"currency": "USD"}, "columns": columns, "rows": rows, "warnings": []})
+    finally:
+        pp.JSON_BACKEND = prev
+
+
+def bench_serialize(sizes=(1_000, 10_000, 100_000)) -> bool:
+    import parser_proforma as pp
+    _emit("\n== Serialización de salida: anterior (iterrows + clean_nans) vs columnar ==")
+    backends = ["json"] + (["orjson"] if pp.orjson is not None else [])
+    _emit(f"{'filas':>8} {'anterior':>10} " + " ".join(f"{b:>10}" for b in backends)
+          + f" {'columnar':>10} {'bytes ant.':>11} {'bytes col.':>11} {'salida':>10}")
+    same_all = True
+    for n in sizes:
+        df = pp.normalize_dataframe(packing_list(n, seed=n))
+        t_old, old = _timed(_legacy_serialize, df)
+        expected = json.loads(old)
+        times, same = [], True
+        for b in backends:
+            t, out = _timed(_serialize, df, b)
+            times.append(t)
+            same = same and json.loads(out) == expected
+        t_col, col = _timed(_serialize, df, backends[-1], True)
+        decoded = json.loads(col)
+        same = same and [dict(zip(decoded["columns"], r)) for r in decoded["rows"]] == expected["rows"]
+        same_all = same_all and same
+        _emit(f"{n:>8} {t_old:>9.3f}s " + " ".join(f"{t:>9.3f}s" for t in times)
+              + f" {t_col:>9.3f}s {len(old.encode()):>11} {len(col.encode()):>11} {'idéntica' if same else 'DIFERENTE':>10}")
+    return same_all
+
+
+# Columnas que el parser no usa (pesos, volumen, foto): en la hoja pero fuera de la salida
+SHEET_EXTRA = ["N.W. (KG)", "G.W. (KG)", "CBM", "PHOTO"]
+
+
+def sheet_rows(n: int, seed: int = 0):
+    """Packing list como hoja: título y datos del proveedor arriba, encabezado, n filas, total."""
+    rnd = random.Random(seed)
+    yield ["ACME PUMPS CO., LTD."]
+    yield ["PACKING LIST / PROFORMA INVOICE", None, None, "Date:", "2025-10-22"]
+    yield []
+    yield HEADERS + ["REMARK"] + SHEET_EXTRA
+    for k in range(n):
+        c = proforma_cells(k // 40, k % 40 + 1)
+        qty = int(c[3].replace(",", ""))
+        price = float(c[5].lstrip("$"))
+        note = "" if rnd.random() < 0.7 else "FRAGILE"
+        yield [int(c[0]), c[1], c[2], qty, int(c[4]), price, round(qty * price, 2), c[7], note,
+               round(qty * 0.8, 1), round(qty * 0.9, 1), 0.12, f"img_{k}.jpg"]
+    yield [None, None, "TOTAL", None, None, None, None]
+
+
+def build_sheets(tmp: str, n: int) -> tuple[str, str]:
+    from openpyxl import Workbook
+    xlsx, csv_path = os.path.join(tmp, f"pl_{n}.xlsx"), os.path.join(tmp, f"pl_{n}.csv")
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Packing list")
+    for row in sheet_rows(n, seed=n):
+        ws.append(row)
+    wb.save(xlsx)
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerows(sheet_rows(n, seed=n))
+    return xlsx, csv_path
+
+
+def _whole_sheet(path: str):
+    """Carga completa anterior a parse_sheet: toda la hoja en un DataFrame y luego normalizar."""
+    from parser_proforma import find_header_row, normalize_dataframe
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            grid = pd.DataFrame(list(csv.reader(f)))
+        grid = grid.mask(grid.eq(""))
+    else:
+        grid = pd.read_excel(path, header=None, dtype=object)
+    grid = grid.astype(object).where(pd.notna(grid), None)
+    cells = grid.values.tolist()
+    h = find_header_row(cells)
+    df = pd.DataFrame(cells[h + 1:], columns=[str(v) for v in cells[h]])
+    return normalize_dataframe(df).reset_index(drop=True)
+
+
+def _peak(fn, *args):
+    tracemalloc.start()
+    try:
+        t, out = _timed(fn, *args)
+        return t, tracemalloc.get_traced_memory()[1] / 2**20, out
+    finally:
+        tracemalloc.stop()
+
+
+def bench_sheets(tmp: str, sizes=(10_000, 50_000)) -> bool:
+    from parser_proforma import parse_sheet, df_to_rows
+    _emit("\n== Excel / CSV: carga completa vs parse_sheet (por bloques) ==")
+    _emit(f"{'archivo':>16} {'completa':>10} {'MB':>7} {'bloques':>10} {'MB':>7} {'speedup':>8} {'filas':>7} {'salida':>10}")
+    same_all = True
+    for n in sizes:
+        for path in build_sheets(tmp, n):
+            _timed(parse_sheet, path)  # calentar imports
+            t_old, _ = _timed(_whole_sheet, path)
+            t_new, new = _timed(parse_sheet, path)
+            _, m_old, old = _peak(_whole_sheet, path)
+            _, m_new, _ = _peak(parse_sheet, path)
+            same = df_to_rows(old) == df_to_rows(new)
+            same_all = same_all and same
+            _emit(f"{os.path.basename(path):>16} {t_old:>9.3f}s {m_old:>7.1f} {t_new:>9.3f}s {m_new:>7.1f} "
+                  f"{t_old / t_new:>7.2f}x {len(new):>7} {'idéntica' if same else 'DIFERENTE':>10}")
+    return same_all
+
+
+def _product_photo(seed: int, size: int = 300) -> bytes:
+    """Foto de producto sobre fondo blanco (degradado + ruido dentro de una elipse)."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size]
+    inside = ((x - size / 2) ** 2 / (size * 0.35) ** 2 + (y - size / 2) ** 2 / (size * 0.45) ** 2) < 1
+    shade = (80 + 120 * x / size + rng.normal(0, 20, (size, size))).clip(0, 255)
+    img = np.full((size, size, 3), 255, np.uint8)
+    for c in range(3):
+        img[..., c] = np.where(inside, (shade * (0.6 + 0.2 * c)).clip(0, 255), 255)
+    return fitz.Pixmap(fitz.csRGB, size, size, img.tobytes(), False).tobytes("png")
+
+
+def build_scanned(path: str, dpi: int = 200) -> list[list]:
+    """
+    PDF escaneado (cada página = una imagen, sin capa de texto): fotos + tabla, solo
+    tabla, solo fotos. Devuelve por página (cajas de las palabras de la tabla, cajas
+    de las fotos), en puntos.
+    """
+    layouts = [(True, 20), (False, 45), (True, 0)]
+    out, boxes = fitz.open(), []
+    for p, (photos, rows) in enumerate(layouts):
+        src = fitz.open()
+        page = src.new_page(width=595, height=842)
+        y = 420 if photos else 60
+        shots = [fitz.Rect(40 + 180 * k, 70, 200 + 180 * k, 330) for k in range(3)] if photos else []
+        if photos:
+            page.insert_text((40, 40), "ACME PUMPS CO., LTD.", fontsize=14)
+            for k, rect in enumerate(shots):
+                page.insert_image(rect, stream=_product_photo(p * 3 + k))
+                page.insert_text((60 + 180 * k, 345), f"Foto {k + 1}", fontsize=8)
+        for r in range(rows):
+            c = proforma_cells(p, r + 1)
+            page.insert_text((40, y), f"{c[0]}  {c[1]}  {c[2]}  {c[3]}  {c[5]}  {c[6]}", fontsize=9)
+            y += 16
+        words = [fitz.Rect(w[:4]) for w in page.get_text("words") if w[1] >= 400 or not photos]
+        boxes.append((words, shots))
+        png = page.get_pixmap(dpi=dpi).tobytes("png")
+        src.close()
+        scan = out.new_page(width=595, height=842)
+        scan.insert_image(scan.rect, stream=png)
+    out.save(path)
+    out.close()
+    return boxes
+
+
+def bench_ocr_regions(tmp: str) -> bool:
+    import parser_proforma as pp
+    from sesion_pdf import PdfSession
+    pdf_path = os.path.join(tmp, "escaneada.pdf")
+    boxes = build_scanned(pdf_path)
+    _emit(f"\n== OCR: página completa ({pp.OCR_DPI} dpi) vs regiones (layout {pp.OCR_LAYOUT_DPI} dpi) ==")
+    _emit(f"{'página':>11} {'completa':>10} {'MPx':>7} {'regiones':>10} {'MPx':>7} {'n':>3} {'dpi':>9} {'tabla':>6} {'fotos':>6}")
+    ok = True
+    names = ["fotos+tabla", "solo tabla", "solo fotos"]
+    with PdfSession(pdf_path) as session:
+        for i, name in enumerate(names):
+            t_page, img = _timed(pp._page_image, session, i)
+            t_reg, crops = _timed(pp._region_images, session, i)
+            regions = pp.ocr_regions(session, i)
+            words, shots = boxes[i]
+            covered = all(any(r.contains(w) for r, _ in regions) for w in words)
+            # Las fotos no se rasterizan a alta resolución (solo se tolera el margen de la región)
+            in_photo = sum(abs(r & s) for r, _ in regions for s in shots) / max(1.0, sum(abs(s) for s in shots))
+            ok = ok and covered and in_photo < 0.05
+            mpx_page = img.shape[0] * img.shape[1] / 1e6
+            mpx_reg = sum(c.shape[0] * c.shape[1] for c in crops) / 1e6
+            dpis = ",".join(str(d) for _, d in regions) or "-"
+            _emit(f"{name:>11} {t_page:>9.3f}s {mpx_page:>7.2f} {t_reg:>9.3f}s {mpx_reg:>7.2f} {len(regions):>3} "
+                  f"{dpis:>9} {'cubre' if covered else 'NO':>6} {in_photo:>6.1%}")
+    return ok
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, "proforma.pdf")
+        build_proforma(pdf_path, pages, rows)
+        _emit(f"[bench] Proforma sintética: {pages} páginas x {rows} filas")
+        ok = bench_modes(pdf_path)
+        ok = bench_table_workers(pdf_path) and ok
+        ok = bench_engines(tmp, min(pages, 4), rows) and ok
+        ok = bench_normalize() and ok
+        ok = bench_serialize() and ok
+        ok = bench_sheets(tmp) and ok
+        ok = bench_ocr_regions(tmp) and ok
+        if not ok:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
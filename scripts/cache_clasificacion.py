@@ -0,0 +1,229 @@
+# scripts/cache_clasificacion.py
+"""
+Caché persistente de clasificaciones (SQLite) direccionada por contenido: la misma
+foto del mismo SKU vuelve en muchas proformas y no hace falta pagar otra llamada.
+
+Clave: (espacio, sha1 de los bytes de la imagen). El espacio separa clasificadores
+con prompts / campos distintos (prep_liquidacion vs liquidacion_completa). Con
+phash_distance se acepta además una imagen "casi igual" (dHash a <= N bits:
+re-escalada, recomprimida). Las entradas vencen a los ttl_days y, pasado max_entries,
+se descartan las usadas hace más tiempo (LRU).
+
+Uso: python scripts/cache_clasificacion.py   -> estado de la caché en JSON
+"""
+
+import os, sys, json, time, sqlite3, tempfile, threading
+from collections import Counter
+
+import numpy as np
+
+
+# Archivo de la caché ("0" en CLASSIFY_CACHE la desactiva)
+CLASSIFY_CACHE = os.getenv("CLASSIFY_CACHE", "1") == "1"
+CLASSIFY_CACHE_PATH = os.getenv(
+    "CLASSIFY_CACHE_PATH", os.path.join(tempfile.gettempdir(), "cesch_classify_cache.sqlite")
+)
+CLASSIFY_CACHE_TTL_DAYS = float(os.getenv("CLASSIFY_CACHE_TTL_DAYS", "90"))
+CLASSIFY_CACHE_MAX = int(os.getenv("CLASSIFY_CACHE_MAX", "50000"))
+# Distancia máxima (bits de dHash) para reutilizar una imagen casi igual; vacío = solo sha1
+_PHASH = os.getenv("CLASSIFY_CACHE_PHASH", "")
+CLASSIFY_CACHE_PHASH = int(_PHASH) if _PHASH.strip() else None
+
+FIELDS = ("hs_code", "commercial_name", "confidence", "reason", "linkCotizador")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS classifications (
+    space TEXT NOT NULL,
+    sha1 TEXT NOT NULL,
+    phash TEXT,
+    hs_code TEXT,
+    commercial_name TEXT,
+    confidence REAL,
+    reason TEXT,
+    link_cotizador TEXT,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (space, sha1)
+);
+CREATE INDEX IF NOT EXISTS classifications_lru ON classifications (last_used);
+"""
+
+
+def cacheable(result: dict) -> bool:
+    """Solo se guardan clasificaciones reales (no errores de red / cuota ni respuestas vacías)."""
+    return bool(result) and bool(result.get("hs_code") or result.get("commercial_name"))
+
+
+class ClassificationCache:
+    def __init__(
+        self,
+        space: str,
+        path: str = CLASSIFY_CACHE_PATH,
+        ttl_days: float = CLASSIFY_CACHE_TTL_DAYS,
+        max_entries: int = CLASSIFY_CACHE_MAX,
+        phash_distance: int | None = CLASSIFY_CACHE_PHASH,
+    ):
+        self.space = space
+        self.path = path
+        self.ttl = ttl_days * 86400.0
+        self.max_entries = max_entries
+        self.phash_distance = phash_distance
+        self.stats = Counter()  # hits, phash_hits, misses, stores, expired, evicted
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._phashes = None  # (sha1s, np.uint64[]) del espacio, cargados con la primera búsqueda
+        self._prune()
+
+    # ------------------------------ lectura ------------------------------
+    def get(self, sha1: str, phash: str | None = None) -> dict | None:
+        """Clasificación guardada para la imagen (sha1 exacto o, si se pide, dHash cercano)."""
+        with self._lock:
+            row = self._row(sha1)
+            if row is not None:
+                self.stats["hits"] += 1
+            elif phash and self.phash_distance is not None:
+                near = self._near(phash)
+                row = self._row(near) if near else None
+                if row is not None:
+                    self.stats["phash_hits"] += 1
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self._db.execute(
+                "UPDATE classifications SET last_used = ?, hits = hits + 1 WHERE space = ? AND sha1 = ?",
+                (time.time(), self.space, row[0]),
+            )
+            self._db.commit()
+        out = dict(zip(FIELDS, row[1:]))
+        if out["linkCotizador"] is None:
+            del out["linkCotizador"]  # el clasificador de este espacio no lo devuelve
+        out["confidence"] = float(out["confidence"] or 0)
+        return out
+
+    def _row(self, sha1: str):
+        row = self._db.execute(
+            "SELECT sha1, hs_code, commercial_name, confidence, reason, link_cotizador, created_at "
+            "FROM classifications WHERE space = ? AND sha1 = ?",
+            (self.space, sha1),
+        ).fetchone()
+        if row is None or time.time() - row[-1] > self.ttl:
+            return None
+        return row[:-1]
+
+    def _near(self, phash: str) -> str | None:
+        """sha1 de la entrada con el dHash más cercano, si está a <= phash_distance bits."""
+        if self._phashes is None:
+            rows = self._db.execute(
+                "SELECT sha1, phash FROM classifications WHERE space = ? AND phash IS NOT NULL", (self.space,),
+            ).fetchall()
+            self._phashes = ([r[0] for r in rows], np.array([int(r[1], 16) for r in rows], dtype=np.uint64))
+        names, hashes = self._phashes
+        if not names:
+            return None
+        xor = hashes ^ np.uint64(int(phash, 16))
+        dist = np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+        k = int(dist.argmin())
+        return names[k] if dist[k] <= self.phash_distance else None
+
+    # ------------------------------ escritura ------------------------------
+    def put(self, sha1: str, result: dict, phash: str | None = None) -> bool:
+        """Guarda la clasificación (si es cacheable) y aplica el tope de tamaño."""
+        if not cacheable(result):
+            return False
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO classifications "
+                "(space, sha1, phash, hs_code, commercial_name, confidence, reason, link_cotizador, "
+                " created_at, last_used, hits) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                (
+                    self.space, sha1, phash,
+                    str(result.get("hs_code") or ""), str(result.get("commercial_name") or ""),
+                    float(result.get("confidence") or 0), str(result.get("reason") or ""),
+                    result.get("linkCotizador"), now, now,
+                ),
+            )
+            self.stats["stores"] += 1
+            if self._phashes is not None and phash:
+                names, hashes = self._phashes
+                self._phashes = (names + [sha1], np.append(hashes, np.uint64(int(phash, 16))))
+            self._evict()
+            self._db.commit()
+        return True
+
+    def _prune(self) -> None:
+        with self._lock:
+            cur = self._db.execute("DELETE FROM classifications WHERE created_at < ?", (time.time() - self.ttl,))
+            self.stats["expired"] += cur.rowcount
+            self._evict()
+            self._db.commit()
+
+    def _evict(self) -> None:
+        """LRU: si hay más de max_entries (todos los espacios), fuera las menos usadas recientemente."""
+        (count,) = self._db.execute("SELECT COUNT(*) FROM classifications").fetchone()
+        extra = count - self.max_entries
+        if extra > 0:
+            self._db.execute(
+                "DELETE FROM classifications WHERE rowid IN "
+                "(SELECT rowid FROM classifications ORDER BY last_used LIMIT ?)",
+                (extra,),
+            )
+            self.stats["evicted"] += extra
+            self._phashes = None
+
+    # ------------------------------ reporte ------------------------------
+    def report(self) -> dict:
+        s = self.stats
+        lookups = s["hits"] + s["phash_hits"] + s["misses"]
+        (entries,) = self._db.execute(
+            "SELECT COUNT(*) FROM classifications WHERE space = ?", (self.space,),
+        ).fetchone()
+        return {
+            "hits": s["hits"],
+            "phash_hits": s["phash_hits"],
+            "misses": s["misses"],
+            "hit_rate": round((s["hits"] + s["phash_hits"]) / lookups, 3) if lookups else None,
+            "stores": s["stores"],
+            "expired": s["expired"],
+            "evicted": s["evicted"],
+            "entries": entries,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_cache(space: str) -> ClassificationCache | None:
+    """Caché del espacio, o None si está desactivada o no se puede abrir (se sigue sin caché)."""
+    if not CLASSIFY_CACHE:
+        return None
+    try:
+        return ClassificationCache(space)
+    except Exception as e:
+        print(f"[WARN] Caché de clasificación no disponible: {e}", file=sys.stderr)
+        return None
+
+
+if __name__ == "__main__":
+    db = sqlite3.connect(CLASSIFY_CACHE_PATH)
+    db.executescript(_SCHEMA)
+    spaces = db.execute(
+        "SELECT space, COUNT(*), SUM(hits), MIN(created_at), MAX(last_used) FROM classifications GROUP BY space"
+    ).fetchall()
+    print(json.dumps({
+        "path": CLASSIFY_CACHE_PATH,
+        "ttl_days": CLASSIFY_CACHE_TTL_DAYS,
+        "max_entries": CLASSIFY_CACHE_MAX,
+        "phash_distance": CLASSIFY_CACHE_PHASH,
+        "spaces": {s: {"entries": n, "hits": h or 0, "oldest": t0, "last_used": t1} for s, n, h, t0, t1 in spaces},
+    }, ensure_ascii=False))
@@ -0,0 +1,199 @@
+# scripts/cliente_http.py
+"""
+Cliente HTTP compartido para las llamadas a OpenAI (clasificadores y parser con IA).
+
+Una sola requests.Session por proceso con pool de conexiones keep-alive: el handshake
+TLS se paga una vez por conexión y no una vez por imagen. Los 429, 408/409, 5xx y
+errores de red (conexión / timeout) se reintentan con backoff exponencial + jitter,
+respetando Retry-After / retry-after-ms si el proveedor los manda. Cada llamada tiene
+un plazo total (deadline) que incluye los reintentos: agotado el plazo se devuelve la
+última respuesta (o se levanta el último error) y el que llama decide.
+
+report() resume los contadores (intentos, reintentos, 429, 5xx, errores de red,
+plazos agotados) y la latencia por intento.
+
+Uso: python scripts/cliente_http.py   -> configuración efectiva en JSON
+"""
+
+import os, sys, json, time, random, threading
+from collections import Counter
+from contextlib import nullcontext
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+
+# Conexiones keep-alive por host (con más hilos que conexiones, los hilos esperan turno)
+HTTP_POOL_SIZE = max(1, int(os.getenv("HTTP_POOL_SIZE", "16")))
+# Reintentos por llamada (además del primer intento)
+HTTP_RETRIES = max(0, int(os.getenv("HTTP_RETRIES", "4")))
+# Timeout de conexión por intento; el de lectura lo pasa cada llamada
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+# Plazo total por llamada (intentos + esperas), en segundos
+HTTP_DEADLINE = float(os.getenv("HTTP_DEADLINE", "300"))
+# Tope de una espera entre intentos
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "30"))
+
+RETRY_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+
+def retry_after(r: requests.Response | None, attempt: int) -> float:
+    """Segundos a esperar: Retry-After(-ms) del proveedor o backoff exponencial con jitter."""
+    h = r.headers if r is not None else {}
+    try:
+        if h.get("retry-after-ms"):
+            return float(h["retry-after-ms"]) / 1000.0
+        if h.get("retry-after"):
+            return float(h["retry-after"])
+    except ValueError:
+        pass
+    return min(HTTP_BACKOFF_MAX, 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+class HttpClient:
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE, retries: int = HTTP_RETRIES):
+        self.pool_size = pool_size
+        self.retries = retries
+        # La Session se comparte entre hilos: el adapter reparte las conexiones del pool
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.stats = Counter()  # attempts, ok, retries, rate_limited, server_errors, network_errors, deadline, failed
+        self._latency: list[float] = []  # segundos por intento
+        self._lock = threading.Lock()
+
+    def _count(self, key: str, stats: Counter | None = None) -> None:
+        with self._lock:
+            self.stats[key] += 1
+            if stats is not None:
+                stats[key] += 1
+
+    def post(
+        self,
+        url: str,
+        *,
+        json: dict | None = None,
+        headers: dict | None = None,
+        timeout: float = 120,
+        deadline: float | None = None,
+        retries: int | None = None,
+        stream: bool = False,
+        slot=None,
+        on_throttle=None,
+        stats: Counter | None = None,
+    ) -> requests.Response:
+        """
+        POST con reintentos. timeout es de lectura por intento; deadline, el plazo total.
+        slot (opcional) es un context manager que se toma durante cada intento (p. ej.
+        ClassifyLimiter); on_throttle(espera) se llama ante cada 429. En stats (opcional)
+        se cuentan también los intentos y reintentos de quien llama.
+        """
+        retries = self.retries if retries is None else retries
+        limit = time.monotonic() + (HTTP_DEADLINE if deadline is None else deadline)
+        r, err = None, None
+        for attempt in range(retries + 1):
+            left = limit - time.monotonic()
+            if left <= 0:
+                self._count("deadline")
+                break
+            if r is not None:
+                r.close()
+            r, err = None, None
+            t0 = time.perf_counter()
+            try:
+                with slot if slot is not None else nullcontext():
+                    self._count("attempts", stats)
+                    r = self.session.post(
+                        url, json=json, headers=headers, stream=stream,
+                        timeout=(min(HTTP_CONNECT_TIMEOUT, left), min(timeout, left)),
+                    )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                err = e
+                self._count("network_errors")
+            finally:
+                with self._lock:
+                    self._latency.append(time.perf_counter() - t0)
+
+            if r is not None:
+                if r.status_code not in RETRY_STATUS:
+                    self._count("ok")
+                    return r
+                self._count("rate_limited" if r.status_code == 429 else "server_errors")
+
+            wait = retry_after(r, attempt)
+            if r is not None and r.status_code == 429 and on_throttle is not None:
+                on_throttle(wait)
+            if attempt == retries:
+                break
+            if time.monotonic() + wait >= limit:
+                self._count("deadline")
+                break
+            what = f"HTTP {r.status_code}" if r is not None else type(err).__name__
+            print(f"[WARN] {what} en {url}; reintento {attempt + 1} en {wait:.1f}s", file=sys.stderr)
+            self._count("retries", stats)
+            time.sleep(wait)
+
+        self._count("failed")
+        if r is not None:
+            return r  # la última respuesta (429 / 5xx): raise_for_status() del que llama
+        if err is not None:
+            raise err
+        raise requests.Timeout(f"Plazo agotado para {url}")
+
+    def chat(self, api_key: str, payload: dict, **kwargs) -> requests.Response:
+        """POST a chat/completions de OpenAI (mismos argumentos que post)."""
+        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        return self.post(OPENAI_CHAT_URL, json=payload, headers=headers, **kwargs)
+
+    def report(self) -> dict:
+        with self._lock:
+            s = dict(self.stats)
+            lat = sorted(self._latency)
+
+        def pct(p: float) -> float | None:
+            return round(lat[min(len(lat) - 1, int(p * len(lat)))], 3) if lat else None
+
+        return {
+            "pool_size": self.pool_size,
+            "attempts": s.get("attempts", 0),
+            "ok": s.get("ok", 0),
+            "retries": s.get("retries", 0),
+            "rate_limited": s.get("rate_limited", 0),
+            "server_errors": s.get("server_errors", 0),
+            "network_errors": s.get("network_errors", 0),
+            "deadline_exceeded": s.get("deadline", 0),
+            "failed": s.get("failed", 0),
+            "latency_s": {
+                "mean": round(sum(lat) / len(lat), 3) if lat else None,
+                "p50": pct(0.5),
+                "p95": pct(0.95),
+                "max": round(lat[-1], 3) if lat else None,
+            },
+        }
+
+
+_CLIENT: HttpClient | None = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    """Cliente del proceso (se crea una vez; todos los hilos comparten su pool)."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = HttpClient()
+        return _CLIENT
+
+
+if __name__ == "__main__":
+    print(json.dumps({
+        "pool_size": HTTP_POOL_SIZE,
+        "retries": HTTP_RETRIES,
+        "connect_timeout_s": HTTP_CONNECT_TIMEOUT,
+        "deadline_s": HTTP_DEADLINE,
+        "backoff_max_s": HTTP_BACKOFF_MAX,
+        "retry_status": sorted(RETRY_STATUS),
+    }))
@@ -1,4 +1,4 @@
-import sys, os, json, base64, mimetypes, traceback, tempfile, time, subprocess
+import sys, os, json, base64, hashlib, mimetypes, traceback, tempfile, time, subprocess
 from concurrent.futures import ThreadPoolExecutor
 from autenticacion import get_service
 from googleapiclient.http import MediaFileUpload
@@ -266,14 +266,34 @@ def main():
         start_row = 3
         end_row = start_row + n - 1
 
-        def build_row(idx_item):
+        # Cada imagen distinta se sube una sola vez; las repetidas (logos, misma foto
+        # en varias filas) reutilizan la URL de la primera.
+        def _b64_key(b64):
+            return hashlib.sha1(b64.encode("ascii", errors="ignore")).hexdigest()
+
+        unique = {}  # sha1 -> (name, b64)
+        for i, it in enumerate(items, 1):
+            b64 = it.get("b64") or it.get("_b64")
+            if b64:
+                unique.setdefault(_b64_key(b64), (it.get("name") or f"image_{i:03d}.png", b64))
+
+        def upload_unique(key_item):
             from autenticacion import get_service
             local_drive = get_service("drive")
 
+            key, (name, b64) = key_item
+            return key, _upload_b64_to_drive(b64, name, fotos_folder_id, local_drive)
+
+        url_by_key = {}
+        if unique:
+            with ThreadPoolExecutor(max_workers=6) as pool:
+                url_by_key = dict(pool.map(upload_unique, unique.items()))
+        print(f"[INFO] Imágenes subidas: {len(unique)} únicas para {n} filas")
+
+        def build_row(idx_item):
             i, it = idx_item
-            name = it.get("name") or f"image_{i:03d}.png"
             b64 = it.get("b64") or it.get("_b64")
-            url = _upload_b64_to_drive(b64, name, fotos_folder_id, local_drive) if b64 else it.get("url", "")
+            url = url_by_key[_b64_key(b64)] if b64 else it.get("url", "")
             com = it.get("commercial_name") or it.get("commercialName") or ""
             modelo = it.get("model") or it.get("modelo") or ""
             hs = str(it.get("hs_code") or it.get("hsCode") or "")
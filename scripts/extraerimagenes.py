@@ -1,7 +1,520 @@
 #scripts/extraerimagenes.py
 import fitz  # PyMuPDF
 import os
-from math import inf
+import io
+import json
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None  # sin Pillow no hay hash perceptual (solo sha1)
+
+# Procesos para renderizar (1 = serial, 0 = todos los núcleos).
+# Se puede fijar por entorno: EXTRACT_WORKERS=4
+DEFAULT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "1") or 1)
+
+# Formatos embebidos que se pueden copiar tal cual (ext de extract_image -> extensión de archivo)
+PASSTHROUGH_EXT = {"jpeg": "jpg", "png": "png"}
+
+# Índice de imágenes extraídas (hashes + duplicados) junto a los archivos
+MANIFEST_NAME = "manifest.json"
+
+# Variante para el clasificador (la resolución completa sigue yendo a Drive)
+CLASSIFY_MAX_EDGE = int(os.getenv("CLASSIFY_MAX_EDGE", "768") or 768)        # px del lado mayor
+CLASSIFY_FORMAT = (os.getenv("CLASSIFY_FORMAT", "jpeg") or "jpeg").lower()    # jpeg | webp
+CLASSIFY_MAX_BYTES = int(os.getenv("CLASSIFY_MAX_BYTES", "150000") or 150000)  # presupuesto por imagen
+
+# Pre-filtro de imágenes que no son producto (viñetas, logos, sellos, firmas, QR)
+MIN_PRODUCT_SIDE_PT = 36.0     # lado menor del placement en la página (media pulgada)
+MAX_PRODUCT_ASPECT = 4.0       # más alargadas = banners, líneas, firmas
+MIN_REPEAT_PAGES = 2           # misma imagen en el mismo lugar en 2+ páginas = logo / sello de página...
+MAX_LOGO_SIDE_PT = 72.0        # ...si además es chica (lado menor <= 1 pulgada)
+REPEAT_PLACEMENT_TOL_PT = 6.0  # tolerancia (pt) para "el mismo lugar"
+# Entropía mínima (bits, solo píxeles que no son fondo) para ser producto; 0 = regla apagada.
+# Fotos reales de catálogo (producto plano o plateado sobre blanco) pueden quedar por
+# debajo de 1 bit: calibrar con proformas reales antes de activarla
+MIN_PRODUCT_ENTROPY = float(os.getenv("MIN_PRODUCT_ENTROPY", "0") or 0)
+# Por defecto las que no son producto NO se clasifican (CLASSIFY_NON_PRODUCT=1 para forzar)
+CLASSIFY_NON_PRODUCT = os.getenv("CLASSIFY_NON_PRODUCT", "0") == "1"
+
+
+def _resolve_workers(workers: int | None) -> int:
+    if workers is None:
+        workers = DEFAULT_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, workers)
+
+
+def _page_placements(
+    page,
+    row_tol_ratio: float,
+    row_tol_px: float | None,
+    invert_y: bool,
+):
+    """
+    Devuelve [(xref, rect, matrix), ...] de la página en ORDEN VISUAL
+    (fila arriba->abajo, luego X izq->der). `matrix` es la transformación del placement.
+
+    Una sola pasada con get_image_info(xrefs=True) (bbox + transform de cada instancia)
+    y el agrupado por filas / orden se hace con arrays. Mismo conteo que el recorrido
+    anterior: una instancia por nombre de recurso (get_image_bbox), así que un nombre
+    dibujado varias veces (logo repetido) da un solo placement.
+    """
+    # Recolectar TODAS las instancias de cada imagen (xref 0 = imagen inline, se ignora)
+    infos = [info for info in page.get_image_info(xrefs=True) if info.get("xref", 0) > 0]
+    if not infos:
+        return []
+
+    metas = page.get_images(full=True)
+    names = {}
+    for meta in metas:
+        names.setdefault(meta[0], []).append(meta[7] if len(meta) > 7 else None)
+    drawn = {}
+    for info in infos:
+        drawn[info["xref"]] = drawn.get(info["xref"], 0) + 1
+    # Xrefs con más instancias que nombres: bbox por nombre (aplica CTM), como antes;
+    # si no hay bbox por nombre quedan todas las instancias (el fallback get_image_rects)
+    over = [x for x, n in drawn.items() if n > len(names.get(x, ()))]
+    if over:
+        infos = [info for info in infos if info["xref"] not in over] + [
+            info for xref in over for info in _named_instances(page, xref, names.get(xref, ()), infos)
+        ]
+
+    page_h = float(page.rect.height)
+    tol = float(max(8.0, (row_tol_px if row_tol_px is not None else page_h * row_tol_ratio)))
+
+    boxes = np.array([info["bbox"] for info in infos], dtype=float)
+    keep = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+
+    # Coordenadas “visuales”
+    # y aumenta hacia abajo en PyMuPDF; usamos el centro vertical para clusterizar filas
+    y_center = (boxes[:, 1] + boxes[:, 3]) / 2.0
+    if invert_y:
+        y_center = page_h - y_center  # por si tu pipeline invierte eje Y (no debería)
+    x_left = np.minimum(boxes[:, 0], boxes[:, 2])
+
+    # Bucket de fila por tolerancia (np.round redondea igual que round(): mitad al par)
+    row_key = np.round(y_center / tol)
+
+    # Desempates como siempre: orden de xrefs de get_images() y luego orden de aparición
+    xref_rank = {}
+    for meta in metas:
+        xref_rank.setdefault(meta[0], len(xref_rank))
+    rank = np.array([xref_rank.get(info["xref"], len(xref_rank)) for info in infos])
+
+    # Orden final: fila (arriba->abajo) y luego X (izq->der); lexsort usa la última clave como principal
+    order = np.lexsort((np.arange(len(infos)), rank, x_left, row_key))
+    return [
+        (infos[k]["xref"], fitz.Rect(infos[k]["bbox"]),
+         fitz.Matrix(infos[k]["transform"]) if infos[k]["transform"] is not None else None)
+        for k in order
+        if keep[k]
+    ]
+
+
+def _named_instances(page, xref: int, names, infos) -> list[dict]:
+    """Una instancia {xref, bbox, transform} por nombre de recurso; todas si ningún nombre da bbox."""
+    mine = [info for info in infos if info["xref"] == xref]
+    out = []
+    for name in names:
+        if not name:
+            continue
+        try:
+            rect = page.get_image_bbox(name)  # transform=True devuelve el bbox del xref, no el del nombre
+        except Exception:
+            continue
+        if rect and not rect.is_empty:
+            # transform de la instancia con ese bbox; sin ella se renderiza (ver _is_plain_placement)
+            same = [info for info in mine if max(abs(a - b) for a, b in zip(info["bbox"], rect)) < 0.01]
+            out.append({"xref": xref, "bbox": tuple(rect), "transform": same[0]["transform"] if same else None})
+    return out or mine
+
+
+def _is_plain_placement(page, rect, matrix) -> bool:
+    """True si el placement es solo escala/traslación y cae completo dentro de la página."""
+    if matrix is None:
+        return False
+    m = fitz.Matrix(matrix)
+    # Rotado / volteado / inclinado -> render (lo que se ve no es el stream original)
+    if abs(m.b) > 1e-6 or abs(m.c) > 1e-6 or m.a <= 0 or m.d <= 0:
+        return False
+    # Recortado por el borde de la página -> render
+    return page.rect.contains(rect)
+
+
+def _raw_image(doc, xref: int):
+    """
+    Devuelve (extensión, bytes) del stream embebido si se puede usar tal cual
+    (JPEG o PNG directo, gris/RGB, sin máscaras), o None si hay que renderizar.
+    """
+    if xref <= 0:
+        return None
+    for key in ("SMask", "Mask", "Decode"):
+        if doc.xref_get_key(xref, key)[0] != "null":
+            return None
+    if doc.xref_get_key(xref, "ImageMask")[1] == "true":
+        return None
+
+    info = doc.extract_image(xref)
+    if not info or info.get("smask"):
+        return None
+    ext = PASSTHROUGH_EXT.get(info.get("ext", ""))
+    # Solo gris / RGB: CMYK u otros espacios no se ven bien fuera del PDF
+    if not ext or info.get("colorspace") not in (1, 3):
+        return None
+    return ext, info["image"]
+
+
+def image_hashes(data: bytes, perceptual: bool = False) -> tuple[str, str | None]:
+    """
+    (sha1 del contenido, dHash perceptual de 64 bits en hex o None).
+    El dHash tolera re-escalados / recompresión: sirve para repeticiones “casi iguales”.
+    """
+    sha1 = hashlib.sha1(data).hexdigest()
+    if not perceptual or Image is None:
+        return sha1, None
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            g = im.convert("L").resize((9, 8), Image.LANCZOS)
+            px = list(g.getdata())
+        bits = 0
+        for y in range(8):
+            for x in range(8):
+                bits = (bits << 1) | (px[y * 9 + x] > px[y * 9 + x + 1])
+        return sha1, f"{bits:016x}"
+    except Exception:
+        return sha1, None
+
+
+def image_ext(data: bytes) -> str:
+    """Extensión según la firma de los bytes (el extractor solo produce JPEG o PNG)."""
+    return "jpg" if data[:3] == b"\xff\xd8\xff" else "png"
+
+
+def image_mime(data: bytes) -> str:
+    return "image/jpeg" if image_ext(data) == "jpg" else "image/png"
+
+
+def classifier_variant(
+    data: bytes,
+    max_edge: int | None = None,
+    fmt: str | None = None,
+    max_bytes: int | None = None,
+) -> tuple[bytes, str]:
+    """
+    Versión reducida de una imagen para el modelo de visión: lado mayor <= max_edge,
+    JPEG/WebP, y bajando calidad (luego tamaño) hasta entrar en max_bytes.
+    Devuelve (bytes, mime). Si no hay Pillow, falla la decodificación o no se gana
+    nada, devuelve la original.
+    """
+    max_edge = max_edge or CLASSIFY_MAX_EDGE
+    fmt = (fmt or CLASSIFY_FORMAT).lower()
+    max_bytes = max_bytes or CLASSIFY_MAX_BYTES
+    if Image is None:
+        return data, image_mime(data)
+
+    pil_fmt, mime = ("WEBP", "image/webp") if fmt == "webp" else ("JPEG", "image/jpeg")
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            im.load()
+            # JPEG/WebP sin alfa: transparencias sobre blanco
+            if im.mode in ("RGBA", "LA", "P"):
+                im = im.convert("RGBA")
+                bg = Image.new("RGB", im.size, (255, 255, 255))
+                bg.paste(im, mask=im.split()[-1])
+                im = bg
+            elif im.mode not in ("RGB", "L"):
+                im = im.convert("RGB")
+            if max(im.size) > max_edge:
+                im.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+            quality = 85
+            while True:
+                buf = io.BytesIO()
+                im.save(buf, pil_fmt, quality=quality)
+                out = buf.getvalue()
+                if len(out) <= max_bytes or max(im.size) <= 256:
+                    break
+                if quality > 55:
+                    quality -= 15
+                else:
+                    im.thumbnail((int(im.width * 0.75), int(im.height * 0.75)), Image.LANCZOS)
+    except Exception as e:
+        print(f"[extract] variante clasificador no disponible ({e}); se usa la original")
+        return data, image_mime(data)
+
+    if len(out) >= len(data) and len(data) <= max_bytes:
+        return data, image_mime(data)
+    return out, mime
+
+
+def color_entropy(data: bytes, ignore_background: bool = True) -> float | None:
+    """
+    Entropía (bits) del histograma de color cuantizado a 4 niveles por canal (64 cubetas).
+    Con ignore_background se descarta el color de fondo (la cubeta que domina el borde
+    de la imagen): en una foto de catálogo el fondo blanco aplasta el histograma y lo
+    que interesa es el producto. Imagen casi toda fondo -> 0.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            im.draft("RGB", (128, 128))  # JPEG: decodifica ya reducido
+            px = np.asarray(im.convert("RGB").resize((64, 64)), dtype=np.uint8)
+    except Exception:
+        return None
+    q = ((px[..., 0] >> 6).astype(np.int32) << 4) | ((px[..., 1] >> 6) << 2) | (px[..., 2] >> 6)
+    if ignore_background:
+        border = np.concatenate([q[:2].ravel(), q[-2:].ravel(), q[:, :2].ravel(), q[:, -2:].ravel()])
+        counts = np.bincount(border, minlength=64)
+        bg = int(counts.argmax())
+        if counts[bg] >= 0.5 * border.size:
+            q = q[q != bg]
+            if q.size < 0.05 * px.shape[0] * px.shape[1]:
+                return 0.0
+    hist = np.bincount(q.ravel(), minlength=64)
+    p = hist[hist > 0] / float(q.size)
+    return max(0.0, float(-(p * np.log2(p)).sum()))
+
+
+def repeat_pages(records: list[dict]) -> dict[str, int]:
+    """
+    sha1 -> en cuántas páginas aparece la imagen, si aparece SIEMPRE en el mismo lugar
+    (logo de encabezado, sello, pie); 1 si además aparece en otro lugar. Una foto de
+    producto repetida en varias filas (variantes de color / modelo) cambia de lugar y
+    no cuenta, aunque alguna coincida en la misma posición en dos páginas.
+    """
+    tol = REPEAT_PLACEMENT_TOL_PT
+    spots: dict[str, set] = {}
+    pages: dict[str, set] = {}
+    for rec in records:
+        spots.setdefault(rec["sha1"], set()).add(tuple(round(v / tol) for v in rec["rect"]))
+        pages.setdefault(rec["sha1"], set()).add(rec["page"])
+    return {sha1: len(pages[sha1]) if len(spot) == 1 else 1 for sha1, spot in spots.items()}
+
+
+def product_check(data: bytes, rect, same_place_pages: int = 1) -> tuple[bool, str]:
+    """
+    Pre-filtro local y barato: (es_producto, motivo). Usa tamaño del placement en la
+    página, proporción, si es chica y se repite en el mismo lugar en varias páginas
+    (repeat_pages) y, si MIN_PRODUCT_ENTROPY > 0, la entropía de color sin el fondo.
+    """
+    r = fitz.Rect(rect)
+    side, longest = min(r.width, r.height), max(r.width, r.height)
+    if side < MIN_PRODUCT_SIDE_PT:
+        return False, f"pequeña ({side:.0f} pt)"
+    if side and longest / side > MAX_PRODUCT_ASPECT:
+        return False, f"alargada ({longest / side:.1f}:1)"
+    if same_place_pages >= MIN_REPEAT_PAGES and side <= MAX_LOGO_SIDE_PT:
+        return False, f"mismo lugar en {same_place_pages} páginas"
+    if MIN_PRODUCT_ENTROPY > 0:
+        ent = color_entropy(data)
+        if ent is not None and ent < MIN_PRODUCT_ENTROPY:
+            return False, f"pocos colores (entropía {ent:.1f})"
+    return True, ""
+
+
+def image_record(index: int, page: int, rect, data: bytes, perceptual: bool = False) -> dict:
+    """Record de una imagen extraída (lo que va al manifest): index, name, page, rect, sha1, phash."""
+    sha1, phash = image_hashes(data, perceptual)
+    return {
+        "index": index,
+        "name": f"image_{index:03d}.{image_ext(data)}",
+        "page": page,
+        "rect": [round(v, 2) for v in rect],
+        "sha1": sha1,
+        "phash": phash,
+    }
+
+
+def new_duplicate_index() -> dict:
+    """Estado para find_duplicate: sha1 -> nombre, y dHash de las imágenes únicas."""
+    return {"sha1": {}, "phash": []}
+
+
+def find_duplicate(record: dict, seen: dict, phash_distance: int | None = None) -> str | None:
+    """
+    Versión incremental (para consumir el stream): devuelve el nombre de la PRIMERA
+    imagen igual ya vista (mismo sha1, o dHash a <= phash_distance bits), o None y la
+    registra como única. Deja también record["duplicate_of"].
+    """
+    original = seen["sha1"].get(record["sha1"])
+    if original is None and phash_distance is not None and record.get("phash"):
+        h = int(record["phash"], 16)
+        for uh, uname in seen["phash"]:
+            if bin(h ^ uh).count("1") <= phash_distance:
+                original = uname
+                break
+    record["duplicate_of"] = original
+    if original is None:
+        seen["sha1"][record["sha1"]] = record["name"]
+        if record.get("phash"):
+            seen["phash"].append((int(record["phash"], 16), record["name"]))
+    return original
+
+
+def mark_duplicates(records: list[dict], phash_distance: int | None = None) -> int:
+    """
+    Marca record["duplicate_of"] = nombre de la PRIMERA imagen igual (mismo sha1, o
+    dHash a <= phash_distance bits si se pide). Los duplicados conservan su lugar/fila.
+    Devuelve cuántos duplicados hubo.
+    """
+    seen = new_duplicate_index()
+    return sum(find_duplicate(rec, seen, phash_distance) is not None for rec in records)
+
+
+def load_manifest(folder: str) -> dict[str, dict]:
+    """Lee el manifest.json que deja el extractor: {nombre_archivo: record}. Vacío si no hay."""
+    path = os.path.join(folder, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {rec["name"]: rec for rec in json.load(f).get("images", [])}
+    except Exception as e:
+        print(f"[extract] manifest ilegible ({e}); se ignora")
+        return {}
+
+
+def _render_placements(
+    page,
+    placements,
+    start_index: int,
+    zoom: float,
+    alpha: bool,
+    displaylist: bool = True,
+    passthrough: bool = True,
+    get_displaylist=None,
+) -> list[tuple]:
+    """
+    Bytes de cada placement, numerados desde start_index: [(index, page, rect, bytes), ...].
+    Con passthrough, los JPEG/PNG sin rotación ni máscara se copian del PDF sin re-renderizar;
+    el resto se renderiza a PNG. get_displaylist() (opcional) entrega el display list ya
+    construido de la página, p. ej. el de una PdfSession compartida.
+    """
+    out = []
+    mat = fitz.Matrix(zoom, zoom)
+    # page.get_pixmap() arma un display list nuevo en cada llamada (reinterpreta la página);
+    # con uno solo por página, todos los clips salen del mismo contenido ya interpretado.
+    dl = None
+    raw_cache = {}  # xref -> (ext, bytes) | None
+    for offset, (xref, rect, matrix) in enumerate(placements):
+        try:
+            raw = None
+            if passthrough and _is_plain_placement(page, rect, matrix):
+                if xref not in raw_cache:
+                    raw_cache[xref] = _raw_image(page.parent, xref)
+                raw = raw_cache[xref]
+
+            if raw:
+                data = raw[1]
+            else:
+                if displaylist and dl is None:
+                    dl = get_displaylist() if get_displaylist else page.get_displaylist()
+                # Render del “placement” (clip al rect para respetar rotación/flip/escala)
+                if dl is not None:
+                    pix = dl.get_pixmap(matrix=mat, colorspace=fitz.csRGB, alpha=alpha, clip=rect)
+                else:
+                    pix = page.get_pixmap(matrix=mat, clip=rect, alpha=alpha)
+                data = pix.tobytes("png")
+            out.append((start_index + offset, page.number + 1, tuple(rect), data))
+        except Exception as e:
+            print(f"[extract] xref {xref} error: {e}")
+    return out
+
+
+# Documento abierto por cada proceso del pool (se reutiliza entre páginas)
+_WORKER_DOC = {"path": None, "doc": None}
+
+
+def _render_page_job(args) -> list[tuple]:
+    """
+    Worker del pool: renderiza una página con su propio fitz.Document.
+    args = (pdf_path, pno, start_index, [(xref, (x0, y0, x1, y1), (a, b, c, d, e, f)), ...], render_opts)
+    """
+    pdf_path, pno, start_index, placements, render_opts = args
+    if _WORKER_DOC["path"] != pdf_path:
+        if _WORKER_DOC["doc"] is not None:
+            _WORKER_DOC["doc"].close()
+        _WORKER_DOC.update(path=pdf_path, doc=fitz.open(pdf_path))
+    page = _WORKER_DOC["doc"].load_page(pno - 1)
+    placements = [(xref, fitz.Rect(r), fitz.Matrix(m) if m else None) for xref, r, m in placements]
+    return _render_placements(page, placements, start_index, **render_opts)
+
+
+def iter_images_from_pdf(
+    pdf_path: str,
+    zoom: float = 2.0,
+    alpha: bool = False,
+    row_tol_ratio: float = 0.018,   # ~1.8% del alto de página (tolerancia de fila)
+    row_tol_px: float | None = None,
+    invert_y: bool = False,         # deja False: PyMuPDF usa origen arriba-izquierda
+    workers: int | None = None,     # None = EXTRACT_WORKERS, 0 = todos los núcleos
+    displaylist: bool = True,       # un display list por página para todos los clips
+    passthrough: bool = True,       # copiar JPEG/PNG sin rotación ni máscara tal cual
+    session=None,                   # PdfSession compartida (sesion_pdf.py)
+):
+    """
+    Igual que extract_images_from_pdf pero SIN archivos: genera (index, page, rect, bytes)
+    en ORDEN VISUAL, con index global desde 1 (el NNN de image_NNN). Los bytes son JPEG
+    (passthrough) o PNG; image_ext()/image_mime() dicen cuál.
+
+    En serie, cada página se entrega apenas se renderiza. Con workers > 1 se descubren
+    primero los placements (numeración global) y las páginas se renderizan en un pool de
+    procesos, entregándose en orden a medida que terminan.
+
+    Con session, las páginas y sus display lists salen de la PdfSession (el PDF no se
+    vuelve a abrir y la página no se reinterpreta si otra etapa ya lo hizo). Los procesos
+    del pool abren su propia copia, así que con session el render es en serie salvo
+    que se pida workers explícitamente.
+    """
+    if session is not None:
+        pdf_path = pdf_path or session.path
+        workers = _resolve_workers(workers) if workers is not None and pdf_path else 1
+    else:
+        workers = _resolve_workers(workers)
+    render_opts = {"zoom": zoom, "alpha": alpha, "displaylist": displaylist, "passthrough": passthrough}
+    doc = session.doc if session is not None else fitz.open(pdf_path)
+    img_count = 0
+    jobs = []  # (pdf_path, pno, start_index, placements, render_opts)
+
+    try:
+        for pno in range(1, len(doc) + 1):
+            page = session.page(pno - 1) if session is not None else doc.load_page(pno - 1)
+            print(f"[extract] Página {pno}")
+            placements = _page_placements(page, row_tol_ratio, row_tol_px, invert_y)
+            if not placements:
+                continue
+
+            if workers == 1:
+                # Render respetando ese orden
+                get_dl = (lambda i=pno - 1: session.displaylist(i)) if session is not None else None
+                yield from _render_placements(page, placements, img_count + 1, get_displaylist=get_dl, **render_opts)
+            else:
+                jobs.append((
+                    pdf_path,
+                    pno,
+                    img_count + 1,
+                    [(xref, tuple(rect), tuple(m) if m else None) for xref, rect, m in placements],
+                    render_opts,
+                ))
+            img_count += len(placements)
+    finally:
+        if session is None:
+            doc.close()
+
+    if jobs:
+        n = min(workers, len(jobs))
+        print(f"[extract] Render paralelo: {n} proceso(s), {len(jobs)} página(s)")
+        with ProcessPoolExecutor(max_workers=n) as pool:
+            # Tramos contiguos por proceso: menos ida y vuelta, el orden lo conserva map()
+            for page_images in pool.map(_render_page_job, jobs, chunksize=max(1, len(jobs) // (n * 4))):
+                yield from page_images
+
 
 def extract_images_from_pdf(
     pdf_path: str,
@@ -11,80 +524,55 @@ def extract_images_from_pdf(
     row_tol_ratio: float = 0.018,   # ~1.8% del alto de página (tolerancia de fila)
     row_tol_px: float | None = None,
     invert_y: bool = False,         # deja False: PyMuPDF usa origen arriba-izquierda
+    workers: int | None = None,     # None = EXTRACT_WORKERS, 0 = todos los núcleos
+    displaylist: bool = True,       # un display list por página para todos los clips
+    passthrough: bool = True,       # copiar JPEG/PNG sin rotación ni máscara tal cual
+    phash_distance: int | None = None,  # None = solo duplicados exactos (sha1)
 ):
     """
     Extrae en ORDEN VISUAL: de arriba hacia abajo, y dentro de cada fila de izquierda a derecha.
-    Respeta rotaciones/flip de colocación usando rectángulos reales (bbox/rects).
-    Guarda como image_001.png, image_002.png, ... para que el orden quede fijado.
+    Respeta rotaciones/flip de colocación usando el bbox real de cada instancia.
+    Guarda como image_001.png, image_002.jpg, ... para que el orden quede fijado.
+
+    Con passthrough, los placements que son solo escala/traslación de un JPEG o PNG
+    sin máscara se guardan con los bytes embebidos (image_NNN.jpg / .png); el resto
+    (rotados, volteados, con máscara/SMask, CMYK...) se renderiza a PNG como siempre.
+
+    Deja además manifest.json con el sha1 (y dHash si phash_distance no es None) de
+    cada imagen y "duplicate_of" apuntando a la primera igual, para que la subida a
+    Drive y la clasificación se hagan una sola vez por imagen distinta.
+
+    Con workers > 1 el render se reparte por rangos de páginas en un pool de procesos
+    (cada uno abre su propio fitz.Document); la numeración global se calcula antes,
+    así que el resultado es idéntico al modo serial. Ver iter_images_from_pdf.
     """
     print(f"[extract] Archivo: {pdf_path}")
     os.makedirs(output_folder, exist_ok=True)
 
-    doc = fitz.open(pdf_path)
-    img_count = 0
-
-    for pno, page in enumerate(doc, start=1):
-        print(f"[extract] Página {pno}")
-        items = []  # (row_key, x_left, xref, rect)
-
-        page_h = float(page.rect.height)
-        tol = float(max(8.0, (row_tol_px if row_tol_px is not None else page_h * row_tol_ratio)))
-
-        # Recolectar TODAS las instancias de cada imagen
-        # (get_images da los xrefs únicos; get_image_rects da cada instancia/rect)
-        for meta in page.get_images(full=True):
-            xref = meta[0]
-            # nombre de recurso, puede ayudar con bbox transformado
-            imname = meta[7] if len(meta) > 7 else None
-
-            rect_list = []
-            # Preferir bbox por nombre (aplica CTM)
-            if imname:
-                try:
-                    r = page.get_image_bbox(imname)
-                    if r and not r.is_empty:
-                        rect_list.append(r)
-                except Exception:
-                    pass
-            # Fallback: todas las ocurrencias del xref
-            if not rect_list:
-                rect_list = page.get_image_rects(xref) or []
-
-            for rect in rect_list:
-                if not rect or rect.is_empty:
-                    continue
-
-                # Coordenadas “visuales”
-                # y aumenta hacia abajo en PyMuPDF; usamos el centro vertical para clusterizar filas
-                y_center = (rect.y0 + rect.y1) / 2.0
-                if invert_y:
-                    y_center = page_h - y_center  # por si tu pipeline invierte eje Y (no debería)
-
-                x_left = min(rect.x0, rect.x1)
-
-                # Bucket de fila por tolerancia
-                row_key = round(y_center / tol)
-
-                items.append((row_key, x_left, xref, rect))
-
-        if not items:
-            continue
+    records = []
+    for index, pno, rect, data in iter_images_from_pdf(
+        pdf_path,
+        zoom=zoom,
+        alpha=alpha,
+        row_tol_ratio=row_tol_ratio,
+        row_tol_px=row_tol_px,
+        invert_y=invert_y,
+        workers=workers,
+        displaylist=displaylist,
+        passthrough=passthrough,
+    ):
+        rec = image_record(index, pno, rect, data, perceptual=phash_distance is not None)
+        out_path = os.path.join(output_folder, rec["name"])
+        with open(out_path, "wb") as f:
+            f.write(data)
+        records.append(rec)
+        print(f"[extract]  -> {out_path}")
 
-        # Orden final: fila (arriba->abajo) y luego X (izq->der)
-        items.sort(key=lambda t: (t[0], t[1]))
+    # Duplicados (logos, sellos, fotos repetidas) en orden global
+    dups = mark_duplicates(records, phash_distance)
+    with open(os.path.join(output_folder, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump({"images": records}, f, ensure_ascii=False)
+    print(f"[extract] Duplicados: {dups} (únicas: {len(records) - dups})")
 
-        # Render / guardado respetando ese orden
-        for _, __, xref, rect in items:
-            try:
-                img_count += 1
-                out_path = os.path.join(output_folder, f"image_{img_count:03d}.png")
-                # Render del “placement” (clip al rect para respetar rotación/flip/escala)
-                mat = fitz.Matrix(zoom, zoom)
-                pix = page.get_pixmap(matrix=mat, clip=rect, alpha=alpha)
-                pix.save(out_path)
-                print(f"[extract]  -> {out_path}")
-            except Exception as e:
-                print(f"[extract] xref {xref} error: {e}")
-
-    print(f"[extract] Total de imágenes: {img_count}")
-    return img_count
+    print(f"[extract] Total de imágenes: {len(records)}")
+    return len(records)
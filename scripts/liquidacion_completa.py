@@ -2,18 +2,27 @@
 import os
 import sys
 import json
-import tempfile
+import time
+import base64
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import List, Dict, Any
-import requests
 import re
 
 # ====== REDIRECCIÓN: todo print() va a STDERR; stdout queda limpio para JSON ======
 _REAL_STDOUT = sys.stdout
 sys.stdout = sys.stderr  # desde aquí, cualquier print va a stderr
 
-from extraerimagenes import extract_images_from_pdf
-from subirfotos import upload_images_to_drive
+from extraerimagenes import (
+    iter_images_from_pdf, image_record, new_duplicate_index, find_duplicate, classifier_variant,
+    product_check, CLASSIFY_NON_PRODUCT,
+)
+from collections import Counter
+from subirfotos import upload_image_bytes
 from autenticacion import get_service
+from cliente_http import get_client
+from cache_clasificacion import open_cache
+import lote_clasificacion
 
 # ===================== Helpers URL =====================
 
@@ -38,6 +47,9 @@ def _public_img_url(file_id: str, prefer: str = "lh3") -> str:
 
 # ------------------------------ OpenAI ------------------------------
 
+# Plazo total por llamada al clasificador, reintentos incluidos (cliente_http)
+CLASSIFY_DEADLINE = float(os.getenv("CLASSIFY_DEADLINE", "300"))
+
 def _mime_for_path(p: str) -> str:
     ext = os.path.splitext(p)[1].lower()
     if ext in [".jpg", ".jpeg"]:
@@ -54,22 +66,30 @@ def classify_image_with_openai_base64(image_path: str, openai_api_key: str) -> D
     """
     Clasifica usando DATA URL base64 + chat/completions.
     """
-    import base64
-
     with open(image_path, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode("utf-8")
-    mime = _mime_for_path(image_path)
+        data = f.read()
+    return classify_image_bytes(data, _mime_for_path(image_path), openai_api_key)
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai_api_key}",
-    }
 
-    SYSTEM_PROMPT = (
-        "Eres un especialista en clasificación arancelaria (Ecuador / SENAE, NANDINA). "
-        'Devuelve SOLO JSON con: {"hs_code":"xxxxxx","commercial_name":"texto","confidence":0-1,"reason":"texto"}. '
-        "Si la imagen no es suficiente, devuelve hs_code vacío y explica brevemente en reason."
-    )
+_SYSTEM_PROMPT = (
+    "Eres un especialista en clasificación arancelaria (Ecuador / SENAE, NANDINA). "
+    'Devuelve SOLO JSON con: {"hs_code":"xxxxxx","commercial_name":"texto","confidence":0-1,"reason":"texto"}. '
+    "Si la imagen no es suficiente, devuelve hs_code vacío y explica brevemente en reason."
+)
+# Lote: el prompt viaja una vez por K imágenes; cada imagen va precedida de su id
+_BATCH_PROMPT = (
+    "Eres un especialista en clasificación arancelaria (Ecuador / SENAE, NANDINA). "
+    "Recibirás varias imágenes, cada una precedida por su id. Devuelve SOLO JSON con: "
+    '{"results":[{"id":"img1","hs_code":"xxxxxx","commercial_name":"texto","confidence":0-1,"reason":"texto"}]}, '
+    "un elemento por imagen. Si una imagen no es suficiente, devuelve hs_code vacío y explica brevemente en reason."
+)
+
+
+def classify_image_bytes(data: bytes, mime: str, openai_api_key: str, usage: Counter | None = None) -> Dict[str, Any]:
+    """
+    Igual que classify_image_with_openai_base64, pero desde bytes en memoria.
+    """
+    b64 = base64.b64encode(data).decode("utf-8")
 
     payload = {
         "model": "gpt-4o-mini",
@@ -77,7 +97,7 @@ def classify_image_with_openai_base64(image_path: str, openai_api_key: str) -> D
         "response_format": {"type": "json_object"},
         "max_tokens": 300,
         "messages": [
-            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "system", "content": _SYSTEM_PROMPT},
             {
                 "role": "user",
                 "content": [
@@ -89,7 +109,8 @@ def classify_image_with_openai_base64(image_path: str, openai_api_key: str) -> D
     }
 
     try:
-        r = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload, timeout=90)
+        r = get_client().chat(openai_api_key, payload, timeout=90, deadline=CLASSIFY_DEADLINE)
+        _count_usage(usage, r)
         if r.status_code != 200:
             return {
                 "hs_code": "",
@@ -103,12 +124,7 @@ def classify_image_with_openai_base64(image_path: str, openai_api_key: str) -> D
             data = json.loads(raw)
         except Exception:
             data = {}
-        return {
-            "hs_code": str(data.get("hs_code", "")),
-            "commercial_name": str(data.get("commercial_name", "")),
-            "confidence": float(data.get("confidence", 0) or 0),
-            "reason": str(data.get("reason", "")),
-        }
+        return _classification(data)
     except Exception as e:
         return {
             "hs_code": "",
@@ -117,6 +133,72 @@ def classify_image_with_openai_base64(image_path: str, openai_api_key: str) -> D
             "reason": f"Error en clasificación: {e}",
         }
 
+
+def _classification(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "hs_code": str(data.get("hs_code", "")),
+        "commercial_name": str(data.get("commercial_name", "")),
+        "confidence": float(data.get("confidence", 0) or 0),
+        "reason": str(data.get("reason", "")),
+    }
+
+
+_USAGE_LOCK = threading.Lock()
+
+
+def _count_usage(usage: Counter | None, r) -> None:
+    """Pedidos y tokens facturados (para comparar costo por imagen entre modos)."""
+    if usage is None:
+        return
+    tokens = {}
+    if r.status_code == 200:
+        try:
+            tokens = r.json().get("usage") or {}
+        except Exception:
+            pass
+    with _USAGE_LOCK:
+        usage["requests"] += 1
+        usage["prompt_tokens"] += int(tokens.get("prompt_tokens") or 0)
+        usage["completion_tokens"] += int(tokens.get("completion_tokens") or 0)
+
+
+def classify_images_batch(
+    items: List[tuple], openai_api_key: str, usage: Counter | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    Clasifica varias imágenes [(bytes, mime), ...] en UNA llamada (ver
+    lote_clasificacion); las que el lote no resuelva van de a una.
+    """
+    def send(messages: List[Dict[str, Any]]) -> str:
+        payload = {
+            "model": "gpt-4o-mini",
+            "temperature": 0.1,
+            "response_format": {"type": "json_object"},
+            "max_tokens": 300 * len(items),
+            "messages": messages,
+        }
+        r = get_client().chat(openai_api_key, payload, timeout=90 + 30 * len(items), deadline=CLASSIFY_DEADLINE)
+        _count_usage(usage, r)
+        r.raise_for_status()
+        return r.json()["choices"][0]["message"]["content"]
+
+    def fallback() -> None:
+        if usage is not None:
+            with _USAGE_LOCK:
+                usage["batch_fallbacks"] += 1
+
+    found = lote_clasificacion.classify_batch(
+        [(n, base64.b64encode(data).decode("utf-8"), mime) for n, (data, mime) in enumerate(items)],
+        system_prompt=_BATCH_PROMPT,
+        request_text=f"Clasifica estos {len(items)} productos según el sistema arancelario ecuatoriano:",
+        fields=("hs_code", "commercial_name"),
+        parse=_classification,
+        send=send,
+        single=lambda n, _b64, mime: classify_image_bytes(items[n][0], mime, openai_api_key, usage),
+        on_fallback=fallback,
+    )
+    return [found[n] for n in range(len(items))]
+
 # ------------------------------ Google Sheets ------------------------------
 
 def create_liquidacion_sheet(image_data: List[Dict], doc_name: str, folder_id: str) -> str:
@@ -194,42 +276,295 @@ def create_liquidacion_sheet(image_data: List[Dict], doc_name: str, folder_id: s
 
 # ------------------------------ Pipeline ------------------------------
 
-def process_liquidacion_completa(pdf_path: str, doc_name: str, folder_id: str, openai_api_key: str) -> Dict[str, Any]:
+# Imágenes en vuelo (extraídas y aún sin subir / clasificar). Con la cola llena la
+# extracción espera: la memoria no crece con el documento (backpressure)
+PIPELINE_DEPTH = max(1, int(os.getenv("PIPELINE_DEPTH", "8")))
+# Hilos por etapa; las dos etapas esperan red, no CPU
+UPLOAD_WORKERS = max(1, int(os.getenv("UPLOAD_WORKERS", "3")))
+CLASSIFY_WORKERS = max(1, int(os.getenv("CLASSIFY_WORKERS", "4")))
+# Imágenes por llamada al clasificador (1 = una por llamada); no más que PIPELINE_DEPTH
+CLASSIFY_BATCH = max(1, min(PIPELINE_DEPTH, int(os.getenv("CLASSIFY_BATCH", "1"))))
+
+# Cliente de Drive por hilo (los de googleapiclient no son seguros entre hilos)
+_DRIVE = threading.local()
+
+
+def _thread_drive():
+    if getattr(_DRIVE, "service", None) is None:
+        _DRIVE.service = get_service("drive")
+    return _DRIVE.service
+
+
+class StageClock:
+    """Tiempo ocupado y ventana (primer inicio -> último fin) de cada etapa del pipeline."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.busy: Counter = Counter()
+        self.tasks: Counter = Counter()
+        self.spans: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, start: float, end: float) -> None:
+        with self._lock:
+            self.busy[stage] += end - start
+            self.tasks[stage] += 1
+            span = self.spans.setdefault(stage, [start, end])
+            span[0], span[1] = min(span[0], start), max(span[1], end)
+
+    def run(self, stage: str, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.add(stage, start, time.perf_counter())
+
+    def report(self, workers: Dict[str, int]) -> Dict[str, Any]:
+        """
+        Por etapa: tareas, tiempo ocupado, ventana y tiempo efectivo (ocupado / hilos).
+        bottleneck_s es la etapa efectiva más lenta y serial_s la suma de lo ocupado en
+        todas (lo que tardaría hacer cada imagen entera antes de la siguiente): con las
+        etapas solapadas total_s queda cerca de bottleneck_s, lejos de serial_s.
+        """
+        stages = {}
+        for stage in ("extract", "upload", "classify"):
+            busy = self.busy.get(stage, 0.0)
+            span = self.spans.get(stage, [self.t0, self.t0])
+            stages[stage] = {
+                "tasks": self.tasks.get(stage, 0),
+                "busy_s": round(busy, 3),
+                "wall_s": round(span[1] - span[0], 3),
+                "effective_s": round(busy / workers.get(stage, 1), 3),
+            }
+        total = time.perf_counter() - self.t0
+        bottleneck = max(st["effective_s"] for st in stages.values())
+        serial = sum(self.busy.values())
+        return {
+            "total_s": round(total, 3),
+            "bottleneck_s": bottleneck,
+            "serial_s": round(serial, 3),
+            # total / serial: < 1 es lo que ahorra el solape; total / etapa más lenta: ~1 es lo mejor posible
+            "vs_serial": round(total / serial, 3) if serial else None,
+            "vs_bottleneck": round(total / bottleneck, 3) if bottleneck else None,
+            "stages": stages,
+            "workers": workers,
+            "depth": PIPELINE_DEPTH,
+        }
+
+
+def _done(value) -> Future:
+    f: Future = Future()
+    f.set_result(value)
+    return f
+
+
+class ClassifyBatcher:
     """
-    Procesa un PDF completo para liquidación arancelaria
+    Junta imágenes hasta tener `size` y las manda en una sola llamada
+    (classify_images_batch); cada imagen recibe su propio Future al entrar.
     """
-    try:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            extraction_folder = os.path.join(temp_dir, "imagenes_extraidas")
-            os.makedirs(extraction_folder, exist_ok=True)
 
-            print("Extrayendo imágenes del PDF...")
-            extract_images_from_pdf(pdf_path, extraction_folder)
+    def __init__(self, pool: ThreadPoolExecutor, clock: StageClock, api_key: str, size: int, usage: Counter):
+        self.pool, self.clock, self.api_key, self.size, self.usage = pool, clock, api_key, size, usage
+        self.group: List[tuple] = []  # (bytes, mime, Future)
+
+    def submit(self, data: bytes, mime: str) -> Future:
+        fut: Future = Future()
+        self.group.append((data, mime, fut))
+        if len(self.group) >= self.size:
+            self.flush()
+        return fut
+
+    def flush(self) -> None:
+        if not self.group:
+            return
+        group, self.group = self.group, []
+        job = self.pool.submit(
+            self.clock.run, "classify", classify_images_batch,
+            [(data, mime) for data, mime, _ in group], self.api_key, self.usage,
+        )
+
+        def _resolve(job: Future) -> None:
+            try:
+                results = job.result()
+            except Exception as e:
+                results = [{"hs_code": "", "commercial_name": "", "confidence": 0.0,
+                            "reason": f"Error en clasificación: {e}"}] * len(group)
+            for (_, _, fut), res in zip(group, results):
+                fut.set_result(res)
+        job.add_done_callback(_resolve)
+
+
+def _upload_url(data: bytes, name: str, folder_id: str) -> str:
+    uploaded = upload_image_bytes(data, name, folder_id, _thread_drive())
+    return uploaded[0] if uploaded else ""
 
-            print("Subiendo imágenes a Google Drive...")
-            image_urls, image_names, image_ids = upload_images_to_drive(extraction_folder, folder_id)
 
-            print("Clasificando imágenes con OpenAI...")
+def process_liquidacion_completa(pdf_path: str, doc_name: str, folder_id: str, openai_api_key: str) -> Dict[str, Any]:
+    """
+    Procesa un PDF completo para liquidación arancelaria.
+
+    Pipeline: cada imagen sale de la extracción y entra a la vez a la cola de subida
+    (UPLOAD_WORKERS hilos) y a la de clasificación (CLASSIFY_WORKERS hilos, de a
+    CLASSIFY_BATCH imágenes por llamada); con PIPELINE_DEPTH imágenes en vuelo la
+    extracción espera. El resultado conserva el orden de extracción.
+    """
+    clock = StageClock()
+    # Hilos que de verdad pueden estar ocupados: con PIPELINE_DEPTH imágenes en vuelo no hay
+    # más de PIPELINE_DEPTH subidas ni más de PIPELINE_DEPTH // CLASSIFY_BATCH lotes a la vez
+    workers = {
+        "extract": 1,
+        "upload": min(UPLOAD_WORKERS, PIPELINE_DEPTH),
+        "classify": min(CLASSIFY_WORKERS, max(1, PIPELINE_DEPTH // CLASSIFY_BATCH)),
+    }
+    cache = open_cache("liquidacion_completa")
+    try:
+        pending: List[Dict[str, Any]] = []     # por imagen, en orden: futures de url y clasificación
+        done: Dict[str, Dict[str, Future]] = {}  # nombre -> futures (duplicadas los reutilizan)
+        seen = new_duplicate_index()
+        # Bytes que realmente viajan al clasificador vs la imagen completa (que va a Drive)
+        # y llamadas evitadas por duplicado / por no ser producto / por estar en caché
+        sent = {
+            "images": 0, "original_bytes": 0, "sent_bytes": 0,
+            "skipped_duplicates": 0, "skipped_non_product": 0, "cached": 0,
+        }
+        perceptual = cache is not None and cache.phash_distance is not None
+        usage: Counter = Counter()  # pedidos, tokens y reintentos de lotes al clasificador
+        slots = threading.BoundedSemaphore(PIPELINE_DEPTH)
+
+        def _release_after(*futures: Future) -> None:
+            left = [len(futures)]
+            lock = threading.Lock()
+
+            def _one(_):
+                with lock:
+                    left[0] -= 1
+                    last = left[0] == 0
+                if last:
+                    slots.release()
+            for f in futures:
+                f.add_done_callback(_one)
+
+        # Extracción en memoria (orden visual); cada imagen se sube y clasifica al salir
+        print("Extrayendo, subiendo y clasificando imágenes...")
+        with ThreadPoolExecutor(UPLOAD_WORKERS, thread_name_prefix="upload") as uploads, \
+                ThreadPoolExecutor(CLASSIFY_WORKERS, thread_name_prefix="classify") as classifier:
+            batcher = ClassifyBatcher(classifier, clock, openai_api_key, CLASSIFY_BATCH, usage)
+            images = iter_images_from_pdf(pdf_path)
+            while True:
+                start = time.perf_counter()
+                item = next(images, None)
+                if item is None:
+                    break
+                index, page, rect, data = item
+                rec = image_record(index, page, rect, data, perceptual)
+                name = rec["name"]
+                original = find_duplicate(rec, seen)
+                # En streaming no se sabe si la imagen vuelve en otras páginas: sin la regla de
+                # logos repetidos (prep_liquidacion la aplica sobre el documento completo)
+                is_product, why = product_check(data, rect)
+                clock.add("extract", start, time.perf_counter())
+
+                if original in done:
+                    futures = done[original]
+                    sent["skipped_duplicates"] += 1
+                elif not is_product and not CLASSIFY_NON_PRODUCT:
+                    # Viñeta / logo / sello / QR: ni subida ni clasificación
+                    futures = {"url": _done(""), "classification": _done({
+                        "hs_code": "",
+                        "commercial_name": "",
+                        "confidence": 0.0,
+                        "reason": f"No clasificada: no parece producto ({why})",
+                    })}
+                    sent["skipped_non_product"] += 1
+                elif cache is not None and (hit := cache.get(rec["sha1"], rec["phash"])) is not None:
+                    # Ya clasificada en otra corrida: solo falta subirla
+                    slots.acquire()
+                    futures = {
+                        "url": uploads.submit(clock.run, "upload", _upload_url, data, name, folder_id),
+                        "classification": _done(hit),
+                    }
+                    _release_after(futures["url"])
+                    sent["cached"] += 1
+                else:
+                    small, small_mime = classifier_variant(data)
+                    sent["images"] += 1
+                    sent["original_bytes"] += len(data)
+                    sent["sent_bytes"] += len(small)
+                    slots.acquire()  # backpressure: espera a que se libere un lugar
+                    futures = {
+                        "url": uploads.submit(clock.run, "upload", _upload_url, data, name, folder_id),
+                        "classification": batcher.submit(small, small_mime),
+                    }
+                    _release_after(futures["url"], futures["classification"])
+                    futures["fresh"] = True  # clasificación nueva: se guarda en la caché
+                done[name] = futures
+                pending.append({
+                    "name": name, "duplicate_of": original, "is_product": is_product,
+                    "sha1": rec["sha1"], "phash": rec["phash"], **futures,
+                })
+            batcher.flush()  # último lote incompleto
+
             image_data: List[Dict[str, Any]] = []
-            for i, (url, name) in enumerate(zip(image_urls, image_names)):
-                img_path = os.path.join(extraction_folder, name)
-                classification = classify_image_with_openai_base64(img_path, openai_api_key)
+            for i, p in enumerate(pending):
+                url = p["url"].result()
+                classification = p["classification"].result()
+                if cache is not None and p.get("fresh") and p["duplicate_of"] is None:
+                    cache.put(p["sha1"], classification, p["phash"])
                 # Normalizamos aquí también por si luego reutilizas image_data
                 fid = _extract_drive_id(url or "")
                 direct_url = _public_img_url(fid, prefer="lh3") if fid else url
-                image_data.append({"name": name, "url": direct_url, "classification": classification})
-                print(f"Procesada imagen {i+1}/{len(image_names)}: {name}")
+                image_data.append({
+                    "name": p["name"],
+                    "url": direct_url,
+                    "classification": classification,
+                    "duplicate_of": p["duplicate_of"],
+                    "is_product": p["is_product"],
+                })
+                print(f"Procesada imagen {i+1}: {p['name']}")
+
+        timings = clock.report(workers)
+        sent["saved_bytes"] = sent["original_bytes"] - sent["sent_bytes"]
+        sent["api_calls_avoided"] = sent["skipped_duplicates"] + sent["skipped_non_product"] + sent["cached"]
+        if cache is not None:
+            sent["cache"] = cache.report()
+        sent["batch_size"] = CLASSIFY_BATCH
+        sent["api_requests"] = usage["requests"]
+        sent["batch_fallbacks"] = usage["batch_fallbacks"]
+        sent["prompt_tokens"] = usage["prompt_tokens"]
+        sent["completion_tokens"] = usage["completion_tokens"]
+        if sent["images"]:
+            sent["tokens_per_image"] = round((usage["prompt_tokens"] + usage["completion_tokens"]) / sent["images"], 1)
+        sent["http"] = get_client().report()
+        print(
+            f"Clasificador: {sent['images']} imágenes en {sent['api_requests']} llamadas, "
+            f"{sent['sent_bytes'] // 1024} KB enviados, ahorro {sent['saved_bytes'] // 1024} KB"
+        )
+        print(
+            f"Llamadas evitadas: {sent['api_calls_avoided']} "
+            f"({sent['skipped_duplicates']} duplicadas, {sent['skipped_non_product']} no-producto, "
+            f"{sent['cached']} en caché)"
+        )
+        print(
+            "Etapas: " + ", ".join(f"{k} {v['effective_s']}s" for k, v in timings["stages"].items())
+            + f" -> total {timings['total_s']}s (etapa más lenta {timings['bottleneck_s']}s, "
+            f"en serie {timings['serial_s']}s)"
+        )
+
+        print("Creando hoja de Google Sheets...")
+        start = time.perf_counter()
+        sheet_url = create_liquidacion_sheet(image_data, doc_name, folder_id)
+        timings["sheet_s"] = round(time.perf_counter() - start, 3)
 
-            print("Creando hoja de Google Sheets...")
-            sheet_url = create_liquidacion_sheet(image_data, doc_name, folder_id)
-
-            return {
-                "success": True,
-                "sheet_url": sheet_url,
-                "folder_url": f"https://drive.google.com/drive/folders/{folder_id}",
-                "total_images": len(image_data),
-                "image_data": image_data,
-            }
+        return {
+            "success": True,
+            "sheet_url": sheet_url,
+            "folder_url": f"https://drive.google.com/drive/folders/{folder_id}",
+            "total_images": len(image_data),
+            "image_data": image_data,
+            "classifier_stats": sent,
+            "timings": timings,
+        }
 
     except Exception as e:
         return {
@@ -238,6 +573,9 @@ def process_liquidacion_completa(pdf_path: str, doc_name: str, folder_id: str, o
             "total_images": 0,
             "image_data": [],
         }
+    finally:
+        if cache is not None:
+            cache.close()
 
 # ------------------------------ Main ------------------------------
 
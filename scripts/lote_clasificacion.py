@@ -0,0 +1,71 @@
+# scripts/lote_clasificacion.py
+"""
+Clasificación en lote compartida por prep_liquidacion y liquidacion_completa: K
+imágenes en UNA llamada a chat/completions (el prompt de sistema viaja una vez),
+cada imagen precedida por su id. El modelo devuelve {"results": [...]} con un
+elemento por id; los que falten, vengan repetidos o mal formados (y todos si la
+llamada falla) se clasifican de a una.
+
+Cada pipeline pone lo suyo: prompt, texto de la petición, campos de su esquema,
+cómo convertir un elemento en clasificación y cómo mandar la llamada.
+"""
+
+import sys, json
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+
+def classify_batch(
+    items: List[Tuple[Hashable, str, str]],
+    *,
+    system_prompt: str,
+    request_text: str,
+    fields: Tuple[str, ...],
+    parse: Callable[[Dict[str, Any]], Dict[str, Any]],
+    send: Callable[[List[Dict[str, Any]]], str],
+    single: Callable[[Hashable, str, str], Dict[str, Any]],
+    on_fallback: Callable[[], None] | None = None,
+) -> Dict[Hashable, Dict[str, Any]]:
+    """
+    items: [(clave, b64, mime), ...] -> {clave: clasificación}.
+
+    send(messages) manda la llamada y devuelve el texto JSON del modelo (levanta si
+    falla); parse(elemento) -> clasificación (TypeError / ValueError = mal formado);
+    un elemento sin ninguno de `fields` se descarta. single(clave, b64, mime)
+    clasifica de a una; on_fallback() se llama antes de cada una de esas.
+    """
+    if len(items) == 1:
+        return {items[0][0]: single(*items[0])}
+
+    ids = {f"img{n}": key for n, (key, _, _) in enumerate(items, 1)}
+    content: List[Dict[str, Any]] = [{"type": "text", "text": request_text}]
+    for img_id, (_, b64, mime) in zip(ids, items):
+        content.append({"type": "text", "text": f"id: {img_id}"})
+        content.append({"type": "image_url", "image_url": {"url": f"data:{mime};base64,{b64}"}})
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": content},
+    ]
+
+    out: Dict[Hashable, Dict[str, Any]] = {}
+    try:
+        data = json.loads(send(messages) or "{}")
+        results = data.get("results") if isinstance(data, dict) else None
+        for item in results if isinstance(results, list) else []:
+            if not isinstance(item, dict) or not any(f in item for f in fields):
+                continue
+            key = ids.get(str(item.get("id", "")).strip())
+            if key is None or key in out:
+                continue
+            try:
+                out[key] = parse(item)
+            except (TypeError, ValueError):
+                continue  # p. ej. confidence no numérica: se reintenta sola
+    except Exception as e:
+        print(f"[WARN] Clasificador: lote de {len(items)} falló ({e}); se clasifican de a una", file=sys.stderr)
+
+    for key, b64, mime in items:
+        if key not in out:
+            if on_fallback is not None:
+                on_fallback()
+            out[key] = single(key, b64, mime)
+    return out
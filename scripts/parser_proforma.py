@@ -1,23 +1,81 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Parser Proforma híbrido (pdfplumber + OCR)
+Parser Proforma híbrido (PyMuPDF / pdfplumber + OCR; Excel / CSV por partes)
 Versión 2025-10-22 (Fix columnas duplicadas + logs)
+Versión 2026-10-17 (pre-vuelo por página, OCR por lotes / regiones con caché,
+                    packing lists Excel / CSV, --workers / --engine / --format)
+
+Uso: python parser_proforma.py <archivo> [content_type] [--workers N] [--engine E]
+                                [--format rows|columnar|ndjson]
+  --workers  procesos para extract_tables (0 = todos los núcleos; TABLE_WORKERS)
+  --engine   motor de tablas (TABLE_ENGINE; pdfplumber por defecto)
+  --format   rows (por defecto): el mismo JSON de siempre, sin cambios para
+             app/api/proforma/route.ts:
+               {"meta": {"currency": "USD"}, "columns": [...], "rows": [{...}], "warnings": []}
+             columnar: "rows" como arreglos en el orden de "columns" y meta.format = "columnar"
+             ndjson: una línea {"type": "rows", "page"|"chunk": n, "rows": [...]} por parte,
+               apenas está lista, y al final {"type": "summary", "total_rows": ..., "warnings": [...]}
+Si falta una dependencia opcional (openpyxl / xlrd para Excel) la salida es la vacía
+con el aviso en "warnings" (en ndjson, solo el resumen); el código de salida es 0.
+Importable (sin tocar stdout): parse_proforma, parse_proforma_df, iter_proforma.
 """
 
-import sys, io, json, mimetypes, re, math
+import os, sys, io, csv, json, argparse, mimetypes, re, math, threading, importlib.util, tempfile, contextlib, time
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+from functools import lru_cache
 from typing import Optional
 import pandas as pd
 import numpy as np
-from PIL import Image
-import pdfplumber
 
-# OCR (opcional)
-try:
-    from paddleocr import PaddleOCR
-    OCR_AVAILABLE = True
-except Exception:
-    OCR_AVAILABLE = False
+# PyMuPDF avisa por stdout al importarse: ese aviso va a stderr sin tocar el stdout
+# de quien importa este módulo (la redirección del CLI la hace main())
+with contextlib.redirect_stdout(sys.stderr):
+    from sesion_pdf import PdfSession, PREFLIGHT_MIN_TEXT
+
+# stdout real del CLI (main() lo fija; todo lo demás va a stderr mientras corre)
+_REAL_STDOUT = None
+
+# OCR (opcional). Solo se comprueba que esté instalado: importar paddle y cargar los
+# modelos cuesta segundos, así que se hace recién con la primera página que lo necesita.
+OCR_AVAILABLE = importlib.util.find_spec("paddleocr") is not None
+
+# Motor OCR único por proceso (un worker de larga vida lo reutiliza entre documentos)
+_OCR_ENGINE = None
+_OCR_LOCK = threading.Lock()
+
+
+def get_ocr():
+    """PaddleOCR del proceso, creado la primera vez que se pide. None si no hay OCR."""
+    global _OCR_ENGINE, OCR_AVAILABLE
+    if _OCR_ENGINE is None and OCR_AVAILABLE:
+        with _OCR_LOCK:
+            if _OCR_ENGINE is None:
+                try:
+                    from paddleocr import PaddleOCR
+                    print("[OCR] Cargando PaddleOCR...", file=sys.stderr)
+                    _OCR_ENGINE = PaddleOCR(use_angle_cls=True, lang='en')
+                except Exception as e:
+                    print(f"[WARN] PaddleOCR no se pudo cargar: {e}", file=sys.stderr)
+                    OCR_AVAILABLE = False
+    return _OCR_ENGINE
+
+
+def warm_ocr() -> bool:
+    """
+    Hook de calentamiento: carga el motor y corre una inferencia sobre una imagen en
+    blanco (el primer ocr() inicializa predictores perezosos). Para llamarlo al levantar
+    un worker, antes de la primera solicitud real. True si quedó listo.
+    """
+    ocr = get_ocr()
+    if ocr is None:
+        return False
+    try:
+        ocr.ocr(np.full((64, 256, 3), 255, dtype=np.uint8), cls=True)
+    except Exception as e:
+        print(f"[WARN] Calentamiento OCR falló: {e}", file=sys.stderr)
+    return True
 
 TARGET_COLUMNS = [
     "item_no", "commercial_name", "model", "qty",
@@ -54,16 +112,63 @@ def clean_nans(obj):
     return obj
 
 
-def best_header_match(name: str) -> Optional[str]:
-    n = name.strip().lower()
+# Claves de alias en su orden de prioridad (la primera contenida en el encabezado gana)
+_ALIAS_KEYS = tuple(HEADER_ALIASES)
+
+
+@lru_cache(maxsize=4096)
+def _header_match(n: str) -> Optional[str]:
     if n in HEADER_ALIASES:
         return HEADER_ALIASES[n]
-    for k in HEADER_ALIASES:
+    for k in _ALIAS_KEYS:
         if k in n:
             return HEADER_ALIASES[k]
     return None
 
 
+def best_header_match(name: str) -> Optional[str]:
+    """Columna destino para un encabezado (memoizado: los encabezados se repiten en cada página)."""
+    return _header_match(name.strip().lower())
+
+
+NUMERIC_COLUMNS = ["qty", "package", "unit_price", "total_amount"]
+# Separadores de miles y símbolo de moneda fuera, luego el primer número del texto
+_NUM_STRIP = r"[,$]"
+_NUM_PATTERN = re.compile(r"[-+]?\d*\.?\d+")
+_NUM_GROUP = f"({_NUM_PATTERN.pattern})"  # str.extract necesita un grupo
+
+EXCLUDE_MODELS = frozenset([
+    "structure", "size", "weight", "efficiency", "rotating", "speed",
+    "depth", "type", "shaft", "width", "number", "overall", "guage", "track"
+])
+
+
+def _numeric_column(col: pd.Series) -> pd.Series:
+    """Número del texto de cada celda (NaN si no hay); si algo no convierte, queda el texto."""
+    # Operaciones de columna (.str) sobre los valores DISTINTOS (cantidades, cajas y precios
+    # se repiten mucho) y de vuelta a cada celda con los códigos de factorize: sin bucles
+    codes, values = pd.factorize(col.astype(str))
+    found = (
+        pd.Series(values, dtype=object)
+        .str.replace(_NUM_STRIP, "", regex=True)
+        .str.extract(_NUM_GROUP, expand=False)
+        .to_numpy(dtype=object)
+    )
+    extracted = pd.Series(found[codes], index=col.index)
+    try:
+        return pd.to_numeric(extracted)
+    except (ValueError, TypeError):
+        return extracted
+
+
+def _has_value(col: pd.Series) -> pd.Series:
+    """Máscara: celda con dato (no nulo y, si es texto, no vacío)."""
+    mask = col.notna()
+    if col.dtype == object:
+        mask &= col.astype(str).str.strip().ne("")
+    return mask
+
+
 def normalize_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     print(f"[DEBUG] Normalizando dataframe ({len(df)} filas)", file=sys.stderr)
     new_cols = {}
@@ -79,91 +184,623 @@ def normalize_dataframe(df: pd.DataFrame) -> pd.DataFrame:
             df[col] = None
     df = df.reindex(columns=TARGET_COLUMNS, fill_value=None)
 
-    # Conversión numérica tolerante
-    for c in ["qty", "package", "unit_price", "total_amount"]:
-        df[c] = (
-            df[c].astype(str)
-            .str.replace(",", "", regex=False)
-            .str.replace("$", "", regex=False)
-            .str.extract(r"([-+]?\d*\.?\d+)")[0]
-        )
-        df[c] = pd.to_numeric(df[c], errors="ignore")
+    # Conversión numérica tolerante (un replace + un extract por columna)
+    for c in NUMERIC_COLUMNS:
+        df[c] = _numeric_column(df[c])
 
     # 🧹 Filtro 1: eliminar filas completamente vacías
     df = df.dropna(how="all")
 
     # 🧹 Filtro 2: eliminar filas sin cantidad ni precio
-    df = df[
-        df[["qty", "unit_price", "total_amount"]]
-        .apply(lambda r: any(pd.notna(x) and str(x).strip() != "" for x in r), axis=1)
-    ]
+    keep = _has_value(df["qty"]) | _has_value(df["unit_price"]) | _has_value(df["total_amount"])
 
     # 🧹 Filtro 3: eliminar descripciones irrelevantes (tipo “Weight”, “Size”, “Speed”)
-    exclude_words = [
-        "structure", "size", "weight", "efficiency", "rotating", "speed",
-        "depth", "type", "shaft", "width", "number", "overall", "guage", "track"
-    ]
-    df = df[
-        ~df["model"].astype(str).str.lower().isin(exclude_words)
-    ]
+    keep &= ~df["model"].astype(str).str.lower().isin(EXCLUDE_MODELS)
+    df = df[keep]
 
     df = df.where(pd.notna(df), None)
     print(f"[DEBUG] Filas válidas tras limpiar: {len(df)}", file=sys.stderr)
     return df
 
 
+# Filas de la proforma leídas por OCR: item, modelo, descripción, cantidad, precio, total
+OCR_ROW_PATTERN = r"(\d+)\s+([A-Z0-9\-]+)\s+(.+?)\s+(\d+)\s+\$?([\d\.]+)\s+\$?([\d\.]+)"
+
+
+# Resolución del render para OCR y cuántas páginas se le pasan juntas al motor
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_BATCH_SIZE = max(1, int(os.getenv("OCR_BATCH_SIZE", "4")))
+# Procesos que rasterizan páginas escaneadas mientras el OCR trabaja (1 = en este proceso)
+OCR_RENDER_WORKERS = max(1, int(os.getenv("OCR_RENDER_WORKERS", str(min(4, os.cpu_count() or 1)))))
+# Resultados de OCR por hash de contenido de página (reenvíos de la misma proforma)
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "cesch_ocr_cache"))
+# Tope de la caché: sin usar hace más de OCR_CACHE_TTL_DAYS se borra y, pasado
+# OCR_CACHE_MAX_MB, se borran primero las usadas hace más tiempo (LRU por mtime)
+OCR_CACHE_TTL_DAYS = float(os.getenv("OCR_CACHE_TTL_DAYS", "30"))
+OCR_CACHE_MAX_MB = float(os.getenv("OCR_CACHE_MAX_MB", "200"))
+
+# Qué se pasa al OCR:
+#   page    -> la página completa a OCR_DPI (comportamiento original)
+#   regions -> pasada de layout a baja resolución, y solo los recortes con pinta de
+#              tabla (bandas de líneas de texto, ruling vectorial) a un DPI adaptado
+#              al alto de línea; fotos y márgenes no se rasterizan a alta resolución
+OCR_MODE = os.getenv("OCR_MODE", "page")
+OCR_LAYOUT_DPI = int(os.getenv("OCR_LAYOUT_DPI", "72"))
+OCR_MIN_DPI = int(os.getenv("OCR_MIN_DPI", "150"))
+# Alto de línea (px) al que se lleva el texto para el reconocedor
+OCR_LINE_PX = int(os.getenv("OCR_LINE_PX", "32"))
+# Ancho mínimo de una región (fracción de la página): las filas de tabla cruzan columnas
+OCR_REGION_MIN_WIDTH = float(os.getenv("OCR_REGION_MIN_WIDTH", "0.25"))
+
+
+def _page_image(session: PdfSession, i: int, resolution: int = OCR_DPI) -> np.ndarray:
+    """Página i (base 0) rasterizada para OCR desde la sesión (RGB, HxWx3)."""
+    pix = session.pixmap(i, resolution / 72.0)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+
+
+# PDF abierto por cada proceso de render (se recibe una vez en el inicializador)
+_RENDER_DOC = {"doc": None}
+
+
+def _init_render_worker(data: bytes) -> None:
+    import fitz
+    _RENDER_DOC["doc"] = fitz.open(stream=data, filetype="pdf")
+
+
+def _render_page_job(args) -> tuple:
+    i, resolution = args
+    import fitz
+    z = resolution / 72.0
+    pix = _RENDER_DOC["doc"].load_page(i).get_pixmap(matrix=fitz.Matrix(z, z), colorspace=fitz.csRGB, alpha=False)
+    return i, pix.samples, pix.height, pix.width, pix.n
+
+
+def _iter_page_images(session: PdfSession, pages: list[int], resolution: int = OCR_DPI):
+    """
+    (i, imagen) en el orden de `pages`. Con OCR_RENDER_WORKERS > 1 el render va en un
+    pool de procesos y avanza mientras el consumidor hace OCR de lo ya entregado.
+    """
+    workers = min(OCR_RENDER_WORKERS, len(pages))
+    if workers <= 1:
+        for i in pages:
+            yield i, _page_image(session, i, resolution)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker, initargs=(session.data,)) as pool:
+        for i, samples, h, w, n in pool.map(_render_page_job, [(i, resolution) for i in pages]):
+            yield i, np.frombuffer(samples, dtype=np.uint8).reshape(h, w, n)
+
+
+# Celda de la pasada de layout (px a OCR_LAYOUT_DPI)
+_LAYOUT_TILE = 16
+
+
+def _gray(pix) -> np.ndarray:
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)[..., :3].mean(axis=2)
+
+
+def _text_tiles(gray: np.ndarray) -> np.ndarray:
+    """
+    Máscara de celdas con texto: fondo claro con trazos oscuros. Las fotos tienen
+    mayoría de medios tonos y poco blanco; las celdas vacías, nada oscuro.
+    """
+    t = _LAYOUT_TILE
+    h, w = (gray.shape[0] // t) * t, (gray.shape[1] // t) * t
+    tiles = gray[:h, :w].reshape(h // t, t, w // t, t).swapaxes(1, 2)
+    white = (tiles >= 200).mean(axis=(2, 3))
+    ink = (tiles < 160).mean(axis=(2, 3))
+    return (white >= 0.45) & (ink >= 0.02) & (ink <= 0.5)
+
+
+def _text_runs(row: np.ndarray, min_len: int = 4) -> list[tuple[int, int]]:
+    """
+    Tramos (col inicial, col final) de celdas de texto seguidas en una fila de la
+    máscara, tolerando huecos de una celda (espacio entre columnas). Una línea de
+    tabla es un tramo largo; el borde de una foto deja celdas sueltas.
+    """
+    filled = row.copy()
+    filled[1:-1] |= row[:-2] & row[2:]
+    runs, start = [], None
+    for c, v in enumerate(filled):
+        if v and start is None:
+            start = c
+        elif not v and start is not None:
+            if c - start >= min_len:
+                runs.append((start, c - 1))
+            start = None
+    if start is not None and len(filled) - start >= min_len:
+        runs.append((start, len(filled) - 1))
+    return runs
+
+
+def _line_height(gray: np.ndarray) -> Optional[float]:
+    """Alto de línea típico (px) en el recorte: mediana de las franjas de filas con tinta."""
+    inked = (gray < 160).mean(axis=1) > 0.005
+    runs, n = [], 0
+    for v in inked:
+        if v:
+            n += 1
+        elif n:
+            runs.append(n)
+            n = 0
+    if n:
+        runs.append(n)
+    runs = [r for r in runs if r >= 3]
+    return float(np.median(runs)) if runs else None
+
+
+def _adaptive_dpi(line_px: Optional[float], layout_dpi: int) -> int:
+    """DPI para que una línea mida ~OCR_LINE_PX (múltiplos de 25, entre OCR_MIN_DPI y OCR_DPI)."""
+    if not line_px:
+        return OCR_DPI
+    dpi = OCR_LINE_PX * layout_dpi / line_px
+    return int(min(OCR_DPI, max(OCR_MIN_DPI, round(dpi / 25) * 25)))
+
+
+def _ruling_rect(page):
+    """Caja que encierra los dibujos vectoriales de la página (tabla con ruling), o None."""
+    import fitz
+    box = fitz.Rect()
+    for path in page.get_cdrawings():
+        if path.get("rect"):
+            box |= fitz.Rect(path["rect"])
+    return None if box.is_empty else box
+
+
+def ocr_regions(session: PdfSession, i: int) -> list[tuple]:
+    """
+    Regiones de la página i que vale la pena pasar por OCR -> [(fitz.Rect, dpi)] de
+    arriba abajo. Un render a OCR_LAYOUT_DPI se divide en celdas; las filas de celdas
+    con texto forman bandas, y cada banda lo bastante ancha es una región (más la caja
+    del ruling vectorial si el pre-vuelo lo vio). El DPI de cada región sale del alto
+    de sus líneas.
+    """
+    import fitz
+    page = session.page(i)
+    zoom = OCR_LAYOUT_DPI / 72.0
+    gray = _gray(session.pixmap(i, zoom))
+    mask = _text_tiles(gray)
+    t = _LAYOUT_TILE
+    to_pt = t / zoom
+    min_tiles = max(2, int(mask.shape[1] * OCR_REGION_MIN_WIDTH))
+
+    rects = []
+    band = None  # [fila inicial, fila final, col mín, col máx]
+    for r, row in enumerate(mask):
+        runs = _text_runs(row)
+        if runs:
+            c0, c1 = runs[0][0], runs[-1][1]
+            if band is not None and r - band[1] <= 2:
+                band = [band[0], r, min(band[2], c0), max(band[3], c1)]
+            else:
+                if band is not None:
+                    rects.append(band)
+                band = [r, r, c0, c1]
+    if band is not None:
+        rects.append(band)
+
+    regions = []
+    for r0, r1, c0, c1 in rects:
+        if c1 - c0 + 1 < min_tiles:
+            continue  # pie de foto, sello, número de página
+        regions.append(fitz.Rect(c0 * to_pt, r0 * to_pt, (c1 + 1) * to_pt, (r1 + 1) * to_pt)
+                       + (-to_pt / 2, -to_pt / 2, to_pt / 2, to_pt / 2))
+    h, v = session.preflight(i)["ruling"]
+    if h >= 2 and v >= 2:
+        ruled = _ruling_rect(page)
+        if ruled is not None:
+            regions.append(ruled)
+
+    # Regiones que se tocan se funden (una tabla partida por una fila en blanco)
+    merged = []
+    for rect in sorted((r & page.rect for r in regions), key=lambda r: r.y0):
+        if rect.is_empty:
+            continue
+        if merged and merged[-1].intersects(rect):
+            merged[-1] |= rect
+        else:
+            merged.append(rect)
+
+    out = []
+    for rect in merged:
+        y0, y1 = int(rect.y0 * zoom), int(rect.y1 * zoom)
+        x0, x1 = int(rect.x0 * zoom), int(rect.x1 * zoom)
+        out.append((rect, _adaptive_dpi(_line_height(gray[y0:y1, x0:x1]), OCR_LAYOUT_DPI)))
+    return out
+
+
+def _region_images(session: PdfSession, i: int) -> list[np.ndarray]:
+    """Recortes de la página i para OCR (ver ocr_regions); lista vacía si no hay tabla."""
+    images = []
+    for rect, dpi in ocr_regions(session, i):
+        pix = session.pixmap(i, dpi / 72.0, clip=rect)
+        images.append(np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n))
+    return images
+
+
+def _iter_ocr_inputs(session: PdfSession, pages: list[int], mode: str):
+    """(i, [imágenes]) por página: la página entera (page) o sus recortes (regions)."""
+    if mode == "regions":
+        for i in pages:
+            yield i, _region_images(session, i)
+        return
+    for i, img in _iter_page_images(session, pages):
+        yield i, [img]
+
+
+def _ocr_lines(result) -> list[str]:
+    """Textos reconocidos, tanto del formato 2.x ([[box, (texto, score)], ...]) como del 3.x (rec_texts)."""
+    lines = []
+    for block in result or []:
+        if hasattr(block, "get"):
+            lines.extend(block.get("rec_texts") or [])
+            continue
+        for line in block or []:
+            lines.append(line[1][0])
+    return lines
+
+
+def _ocr_batch(ocr, images: list[np.ndarray]) -> list[list[str]]:
+    """Líneas por imagen. PaddleOCR 3.x procesa la lista en lote (predict); 2.x, una a una."""
+    if hasattr(ocr, "predict"):
+        return [_ocr_lines([res]) for res in ocr.predict(images)]
+    return [_ocr_lines(ocr.ocr(img, cls=True)) for img in images]
+
+
+def _ocr_cache_path(key: str) -> str:
+    return os.path.join(OCR_CACHE_DIR, f"{key}.json")
+
+
+def _ocr_cache_get(key: str) -> Optional[list]:
+    path = _ocr_cache_path(key)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = json.load(f)["lines"]
+        os.utime(path)  # mtime = último uso (para el LRU de _ocr_cache_prune)
+        return lines
+    except Exception:
+        return None
+
+
+def _ocr_cache_put(key: str, lines: list) -> None:
+    try:
+        os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+        tmp = _ocr_cache_path(key) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"lines": lines}, f, ensure_ascii=False)
+        os.replace(tmp, _ocr_cache_path(key))
+    except Exception as e:
+        print(f"[WARN] No se pudo guardar el OCR en caché: {e}", file=sys.stderr)
+
+
+def _ocr_cache_prune(ttl_days: float = OCR_CACHE_TTL_DAYS, max_mb: float = OCR_CACHE_MAX_MB) -> int:
+    """
+    Aplica los topes de la caché de OCR: fuera lo no usado en ttl_days y, si el
+    directorio sigue pasando de max_mb, lo usado hace más tiempo. Devuelve cuántos
+    archivos se borraron.
+    """
+    try:
+        entries = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in os.scandir(OCR_CACHE_DIR) if e.is_file()]
+    except OSError:
+        return 0
+    entries.sort()  # más viejo primero
+    cutoff = time.time() - ttl_days * 86400
+    total = sum(size for _, size, _ in entries)
+    cap = max_mb * 1024 * 1024
+    removed = 0
+    for mtime, size, path in entries:
+        if mtime >= cutoff and total <= cap:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+            total -= size
+        except OSError:
+            pass
+    if removed:
+        print(f"[OCR] Caché: {removed} archivo(s) borrados (tope {ttl_days:g} días / {max_mb:g} MB)", file=sys.stderr)
+    return removed
+
+
+def iter_ocr_pages(session: PdfSession, pages: list[int], ocr=None, mode: Optional[str] = None):
+    """
+    (i, líneas OCR) de las páginas (base 0) a medida que están listas. Primero la caché
+    por hash de contenido de página; las que faltan se rasterizan (página completa o
+    regiones, según mode / OCR_MODE) y se pasan al motor en lotes de OCR_BATCH_SIZE imágenes.
+    """
+    mode = mode or OCR_MODE
+    ocr = ocr or get_ocr()
+    suffix = f"{OCR_DPI}" if mode == "page" else f"r{OCR_LAYOUT_DPI}-{OCR_MIN_DPI}-{OCR_DPI}-{OCR_LINE_PX}"
+    keys = {i: f"{session.page_hash(i)}-{suffix}" for i in pages}
+    misses = []
+    for i in pages:
+        cached = _ocr_cache_get(keys[i])
+        if cached is None:
+            misses.append(i)
+        else:
+            yield i, cached
+    print(f"[OCR] {len(pages)} página(s): {len(pages) - len(misses)} desde caché, {len(misses)} a OCR ({mode})", file=sys.stderr)
+    if not misses or ocr is None:
+        return
+
+    batch = []  # [(i, [imágenes])]
+
+    def run(items: list) -> list[list[str]]:
+        # Todas las imágenes del lote juntas; las líneas se vuelven a repartir por página
+        images = [img for _, imgs in items for img in imgs]
+        results = iter(_ocr_batch(ocr, images) if images else [])
+        return [[line for _ in imgs for line in next(results)] for _, imgs in items]
+
+    def flush() -> list[tuple]:
+        try:
+            results = run(batch)
+        except Exception as e:
+            # Una página problemática no tumba el lote: se reintenta de a una
+            print(f"[WARN] Lote OCR falló ({e}); página por página", file=sys.stderr)
+            results = []
+            for item in batch:
+                try:
+                    results.append(run([item])[0])
+                except Exception as e:
+                    print(f"[WARN] Error OCR en página {item[0] + 1}: {e}", file=sys.stderr)
+                    results.append(None)
+        done = []
+        for (i, _), lines in zip(batch, results):
+            if lines is not None:
+                _ocr_cache_put(keys[i], lines)
+                done.append((i, lines))
+        batch.clear()
+        return done
+
+    for i, imgs in _iter_ocr_inputs(session, misses, mode):
+        batch.append((i, imgs))
+        if sum(len(imgs) for _, imgs in batch) >= OCR_BATCH_SIZE:
+            yield from flush()
+    if batch:
+        yield from flush()
+    _ocr_cache_prune()
+
+
+def ocr_pages(session: PdfSession, pages: list[int], ocr=None, mode: Optional[str] = None) -> dict[int, list[str]]:
+    """Líneas OCR de las páginas (base 0); ver iter_ocr_pages."""
+    return dict(iter_ocr_pages(session, pages, ocr, mode))
+
+
+def _rows_from_lines(lines: list[str]) -> list[dict]:
+    """Filas reconocidas por OCR_ROW_PATTERN en las líneas OCR de una página."""
+    rows = []
+    for l in lines:
+        m = re.match(OCR_ROW_PATTERN, l)
+        if m:
+            rows.append({
+                "item_no": m.group(1),
+                "model": m.group(2),
+                "commercial_name": m.group(3),
+                "qty": m.group(4),
+                "unit_price": m.group(5),
+                "total_amount": m.group(6)
+            })
+    return rows
+
+
+# Procesos para extract_tables (None/env, 0 = todos los núcleos); también --workers en el CLI
+TABLE_WORKERS = int(os.getenv("TABLE_WORKERS", "1") or 1)
+
+# Motor de tablas (también --engine en el CLI):
+#   pymupdf    -> page.find_tables() de PyMuPDF
+#   pdfplumber -> page.extract_tables() (motor original)
+#   auto       -> PyMuPDF y, en páginas donde no encuentra tabla (o falla), pdfplumber
+TABLE_ENGINES = ("auto", "pymupdf", "pdfplumber")
+TABLE_ENGINE = os.getenv("TABLE_ENGINE", "pdfplumber")
+
+
+def _resolve_workers(workers: Optional[int]) -> int:
+    if workers is None:
+        workers = TABLE_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, workers)
+
+
+def _tables_of(page) -> list:
+    try:
+        return page.extract_tables() or []
+    finally:
+        # pdfplumber cachea los objetos de cada página; en documentos largos se acumulan
+        if hasattr(page, "close"):
+            page.close()
+
+
+def _tables_pymupdf(page) -> list:
+    """Mismo formato que pdfplumber: [[fila de encabezado], [fila], ...] por tabla."""
+    return [t.extract() for t in page.find_tables().tables]
+
+
+def _page_tables(engine: str, fitz_page, plumber_page) -> list:
+    """Tablas de una página según el motor; fitz_page / plumber_page son callables (perezosos)."""
+    if engine in ("auto", "pymupdf"):
+        try:
+            tables = _tables_pymupdf(fitz_page())
+        except Exception:
+            if engine == "pymupdf":
+                raise
+            tables = []
+        if tables or engine == "pymupdf":
+            return tables
+    return _tables_of(plumber_page())
+
 
-def parse_pdf_hybrid(data: bytes) -> pd.DataFrame:
-    all_rows = []
+# Documentos abiertos por cada proceso del pool de tablas (bytes recibidos una vez en el inicializador)
+_TABLE_PDF = {"data": None, "fitz": None, "plumber": None}
+
+
+def _init_table_worker(data: bytes) -> None:
+    _TABLE_PDF.update(data=data, fitz=None, plumber=None)
+
+
+def _worker_fitz_page(i: int):
+    if _TABLE_PDF["fitz"] is None:
+        import fitz
+        _TABLE_PDF["fitz"] = fitz.open(stream=_TABLE_PDF["data"], filetype="pdf")
+    return _TABLE_PDF["fitz"].load_page(i)
+
+
+def _worker_plumber_page(i: int):
+    if _TABLE_PDF["plumber"] is None:
+        import pdfplumber
+        _TABLE_PDF["plumber"] = pdfplumber.open(io.BytesIO(_TABLE_PDF["data"]))
+    return _TABLE_PDF["plumber"].pages[i]
+
+
+def _extract_tables_job(args) -> list[tuple]:
+    """Worker: tablas de un tramo de páginas -> [(i, tablas | None, error | None)]."""
+    pages, engine = args
+    out = []
+    for i in pages:
+        try:
+            tables = _page_tables(engine, lambda: _worker_fitz_page(i), lambda: _worker_plumber_page(i))
+            out.append((i, tables, None))
+        except Exception as e:
+            out.append((i, None, str(e)))
+    return out
+
+
+def iter_tables(
+    session: PdfSession, pages: list[int], workers: Optional[int] = None, engine: Optional[str] = None,
+):
+    """
+    (i, tablas | None, error | None) por página (base 0), en orden y a medida que cada
+    página (o tramo, en paralelo) termina, con el motor `engine` (TABLE_ENGINES). Con
+    workers > 1 las páginas se reparten en tramos contiguos entre procesos que abren
+    el PDF cada uno; un error en una página no afecta a las demás.
+    """
+    engine = engine or TABLE_ENGINE
+    if engine not in TABLE_ENGINES:
+        raise ValueError(f"Motor de tablas desconocido: {engine} (usa {', '.join(TABLE_ENGINES)})")
+    workers = min(_resolve_workers(workers), len(pages))
+    if workers <= 1:
+        for i in pages:
+            i, (tables, err) = _extract_one(session, i, engine)
+            yield i, tables, err
+        return
+
+    # Tramos contiguos (2 por proceso para equilibrar páginas pesadas); map() conserva el orden
+    n = min(len(pages), workers * 2)
+    size = -(-len(pages) // n)
+    chunks = [(pages[k:k + size], engine) for k in range(0, len(pages), size)]
+    print(f"[PLUMBER] Tablas en paralelo ({engine}): {workers} proceso(s), {len(pages)} página(s)", file=sys.stderr)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_table_worker, initargs=(session.data,)) as pool:
+        for part in pool.map(_extract_tables_job, chunks):
+            yield from part
+
+
+def extract_tables(
+    session: PdfSession, pages: list[int], workers: Optional[int] = None, engine: Optional[str] = None,
+) -> dict[int, tuple]:
+    """Tablas de las páginas (base 0) -> {i: (tablas | None, error | None)}; ver iter_tables."""
+    return {i: (tables, err) for i, tables, err in iter_tables(session, pages, workers, engine)}
+
+
+def _extract_one(session: PdfSession, i: int, engine: str) -> tuple:
+    try:
+        return i, (_page_tables(engine, lambda: session.page(i), lambda: session.plumber_page(i)), None)
+    except Exception as e:
+        return i, (None, str(e))
+
+
+def _table_rows(tables: list) -> list[dict]:
+    """Tablas de una página -> filas dict con la primera fila de cada tabla como encabezado."""
+    rows = []
+    for t in tables:
+        if len(t) > 1:
+            header = t[0]
+            for row in t[1:]:
+                row += [None] * (len(header) - len(row))
+                rows.append(dict(zip(header, row)))
+    return rows
+
+
+def iter_pdf_rows(
+    data: bytes,
+    session: Optional[PdfSession] = None,
+    workers: Optional[int] = None,
+    engine: Optional[str] = None,
+):
+    """
+    Pre-vuelo (PdfSession.plan) y cada página directo a su motor:
+      vector_table -> motor de tablas (si no sale tabla y no hay texto, OCR)
+      text         -> nada tabular que extraer (sin ruling, pdfplumber no arma celdas)
+      scanned      -> OCR a 300 dpi
+      image_only   -> OCR (un escaneo que no llena la página también es tabla)
+      blank        -> se omite
+    Genera (página, filas crudas) a medida que cada página está lista: primero las de
+    tablas, en orden; después las de OCR, por lote. Con session no se vuelve a abrir
+    el PDF: pdfplumber, la capa de texto y el render para OCR salen de la sesión
+    compartida con las demás etapas. workers reparte las tablas por tramos de páginas
+    y engine elige el motor (ver iter_tables).
+    """
     if not OCR_AVAILABLE:
         print("[WARN] PaddleOCR no disponible. Solo se usará pdfplumber.", file=sys.stderr)
 
-    with pdfplumber.open(io.BytesIO(data)) as pdf:
-        print(f"[DEBUG] PDF con {len(pdf.pages)} páginas detectadas", file=sys.stderr)
-        ocr = PaddleOCR(use_angle_cls=True, lang='en') if OCR_AVAILABLE else None
+    own = session is None
+    if own:
+        session = PdfSession(data=data)
+    try:
+        plan = session.plan()
+        kinds = Counter(step["kind"] for step in plan)
+        print(f"[DEBUG] PDF con {len(plan)} páginas detectadas; pre-vuelo: {dict(kinds)}", file=sys.stderr)
+        ocr_queue = []  # páginas que van a OCR, en lote al final
 
-        for i, page in enumerate(pdf.pages, start=1):
-            try:
-                tables = page.extract_tables() or []
+        def route(step: dict, engine: str) -> None:
+            i = step["page"]
+            if engine == "ocr" and OCR_AVAILABLE:
+                print(f"[OCR] Página {i} sin texto legible, aplicando OCR...", file=sys.stderr)
+                ocr_queue.append(i - 1)
+            elif engine == "text":
+                print(f"[PLUMBER] Página {i} sin tablas pero con texto plano", file=sys.stderr)
+            elif engine == "ocr":
+                print(f"[WARN] Página {i} ({step['kind']}) necesita OCR y no hay OCR: se omite", file=sys.stderr)
+            else:
+                print(f"[PREFLIGHT] Página {i} ({step['kind']}): se omite", file=sys.stderr)
+
+        for step in plan:
+            if step["engine"] != "tables":
+                route(step, step["engine"])
+
+        table_pages = [step["page"] - 1 for step in plan if step["engine"] == "tables"]
+        if table_pages:
+            for i, tables, err in iter_tables(session, table_pages, workers, engine):
+                step = plan[i]
+                if err is not None:
+                    print(f"[WARN] Error en página {i + 1}: {err}", file=sys.stderr)
+                    continue
                 if tables:
-                    print(f"[PLUMBER] Página {i}: {len(tables)} tabla(s) detectadas", file=sys.stderr)
-                    for t in tables:
-                        if len(t) > 1:
-                            header = t[0]
-                            for row in t[1:]:
-                                row += [None] * (len(header) - len(row))
-                                all_rows.append(dict(zip(header, row)))
+                    print(f"[PLUMBER] Página {i + 1}: {len(tables)} tabla(s) detectadas", file=sys.stderr)
+                    yield i + 1, _table_rows(tables)
                 else:
-                    text = page.extract_text() or ""
-                    if len(text.strip()) < 30 and OCR_AVAILABLE:
-                        print(f"[OCR] Página {i} sin texto legible, aplicando OCR...", file=sys.stderr)
-                        img = page.to_image(resolution=300).original
-                        img = Image.fromarray(img)
-                        result = ocr.ocr(np.array(img), cls=True)
-                        lines = []
-                        for block in result:
-                            for line in block:
-                                lines.append(line[1][0])
-                        if lines:
-                            pattern = r"(\d+)\s+([A-Z0-9\-]+)\s+(.+?)\s+(\d+)\s+\$?([\d\.]+)\s+\$?([\d\.]+)"
-                            for l in lines:
-                                m = re.match(pattern, l)
-                                if m:
-                                    all_rows.append({
-                                        "item_no": m.group(1),
-                                        "model": m.group(2),
-                                        "commercial_name": m.group(3),
-                                        "qty": m.group(4),
-                                        "unit_price": m.group(5),
-                                        "total_amount": m.group(6)
-                                    })
-                        print(f"[OCR] Página {i}: {len(lines)} líneas OCR leídas", file=sys.stderr)
-                    else:
-                        print(f"[PLUMBER] Página {i} sin tablas pero con texto plano", file=sys.stderr)
+                    route(step, "text" if step["chars"] >= PREFLIGHT_MIN_TEXT else "ocr")
+
+        if ocr_queue:
+            try:
+                for i, lines in iter_ocr_pages(session, sorted(ocr_queue)):
+                    print(f"[OCR] Página {i + 1}: {len(lines)} líneas OCR leídas", file=sys.stderr)
+                    yield i + 1, _rows_from_lines(lines)
             except Exception as e:
-                print(f"[WARN] Error en página {i}: {e}", file=sys.stderr)
-                continue
+                print(f"[WARN] Error en OCR: {e}", file=sys.stderr)
+    finally:
+        if own:
+            session.close()
+
 
+def parse_pdf_hybrid(
+    data: bytes,
+    session: Optional[PdfSession] = None,
+    workers: Optional[int] = None,
+    engine: Optional[str] = None,
+) -> pd.DataFrame:
+    """Todas las filas del PDF (ver iter_pdf_rows) en orden de página, normalizadas juntas."""
+    page_rows = dict(iter_pdf_rows(data, session, workers, engine))
+    all_rows = [row for i in sorted(page_rows) for row in page_rows[i]]
     if not all_rows:
         print("[ERROR] No se detectaron filas válidas", file=sys.stderr)
         return pd.DataFrame()
@@ -181,40 +818,414 @@ def detect_kind(filename: str, content_type: Optional[str]) -> str:
     return "pdf"
 
 
+# Hojas de cálculo: filas por bloque (memoria acotada) y filas revisadas buscando el encabezado
+SHEET_CHUNK_ROWS = max(1, int(os.getenv("SHEET_CHUNK_ROWS", "20000")))
+SHEET_HEADER_SCAN = max(1, int(os.getenv("SHEET_HEADER_SCAN", "30")))
+
+
+def sheet_format(filename: str, content_type: Optional[str], head: bytes = b"") -> str:
+    """xlsx / xls / csv según extensión, content-type y firma del archivo."""
+    ext = (filename.split(".")[-1] or "").lower()
+    ct = content_type or ""
+    if head.startswith(b"PK"):
+        return "xlsx"
+    if head.startswith(b"\xd0\xcf\x11\xe0"):
+        return "xls"
+    if ext in ("xlsx", "xlsm", "xls", "csv"):
+        return "xlsx" if ext == "xlsm" else ext
+    if "csv" in ct:
+        return "csv"
+    return "xlsx" if "openxmlformats" in ct else "xls"
+
+
+def find_header_row(rows: list) -> Optional[int]:
+    """
+    Índice de la fila de encabezados entre las primeras filas de la hoja: la que más
+    columnas destino distintas reconoce HEADER_ALIASES (mínimo 2; los títulos y datos
+    del proveedor de arriba no llegan). None si ninguna parece encabezado.
+    """
+    best, best_hits = None, 1
+    for idx, row in enumerate(rows[:SHEET_HEADER_SCAN]):
+        hits = {best_header_match(str(v)) for v in row if v is not None and str(v).strip()}
+        hits.discard(None)
+        if len(hits) > best_hits:
+            best, best_hits = idx, len(hits)
+    return best
+
+
+def _header_columns(header) -> tuple[list[int], list[str]]:
+    """
+    Posiciones y nombres de las columnas que normalize_dataframe va a usar (primera
+    por columna destino, igual que su deduplicado); el resto ni se copia a memoria.
+    """
+    idx, names, seen = [], [], set()
+    for j, v in enumerate(header):
+        name = "" if v is None else str(v)
+        target = best_header_match(name) if name.strip() else None
+        if target and target not in seen:
+            seen.add(target)
+            idx.append(j)
+            names.append(name)
+    return idx, names
+
+
+def _chunk_frame(rows: list, idx: list[int], names: list[str]) -> pd.DataFrame:
+    cells = [[(r[j] if j < len(r) else None) for j in idx] for r in rows]
+    return pd.DataFrame(cells, columns=names, dtype=object)
+
+
+def _join_frames(parts: list) -> pd.DataFrame:
+    """Junta los bloques ya normalizados (solo filas válidas, en TARGET_COLUMNS)."""
+    if not parts:
+        print("[ERROR] No se detectaron filas válidas", file=sys.stderr)
+        return pd.DataFrame()
+    df = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0].reset_index(drop=True)
+    df = df.where(pd.notna(df), None)
+    print(f"[SHEET] Total filas válidas: {len(df)}", file=sys.stderr)
+    return df
+
+
+def _sheet_chunks(rows_iter, label: str):
+    """
+    Filas de UNA hoja (iterador de tuplas) -> DataFrames de hasta SHEET_CHUNK_ROWS
+    filas con sus encabezados. Solo se retienen a la vez la cabecera y un bloque.
+    """
+    head = []
+    for row in rows_iter:
+        head.append(row)
+        if len(head) >= SHEET_HEADER_SCAN:
+            break
+    h = find_header_row(head)
+    if h is None:
+        print(f"[SHEET] {label}: sin fila de encabezados reconocible, se omite", file=sys.stderr)
+        return
+    idx, names = _header_columns(head[h])
+    print(f"[SHEET] {label}: encabezado en fila {h + 1} -> {names}", file=sys.stderr)
+
+    chunk = head[h + 1:]
+    for row in rows_iter:
+        chunk.append(row)
+        if len(chunk) >= SHEET_CHUNK_ROWS:
+            yield _chunk_frame(chunk, idx, names)
+            chunk = []
+    if chunk:
+        yield _chunk_frame(chunk, idx, names)
+
+
+def _xlsx_chunks(source):
+    try:
+        from openpyxl import load_workbook
+    except ImportError as e:
+        raise ImportError("Leer .xlsx requiere openpyxl (pip install openpyxl)", name="openpyxl") from e
+    # read_only: las filas se leen del XML a medida que se piden (sin cargar la hoja entera)
+    wb = load_workbook(source, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            yield from _sheet_chunks(ws.iter_rows(values_only=True), f"Hoja '{ws.title}'")
+    finally:
+        wb.close()
+
+
+def _xls_chunks(source):
+    # .xls binario: pandas + xlrd (opcional); el formato no permite lectura por partes
+    sheets = pd.read_excel(source, sheet_name=None, header=None, dtype=object)
+    for name, frame in sheets.items():
+        frame = frame.astype(object).where(pd.notna(frame), None)
+        yield from _sheet_chunks(iter(frame.itertuples(index=False, name=None)), f"Hoja '{name}'")
+
+
+def _csv_dialect(sample: bytes) -> tuple[str, str]:
+    """
+    (encoding, separador) a partir de los primeros KB del archivo. El separador es el
+    que da más campos en alguna de las primeras filas (la de encabezados es la más
+    ancha; los títulos de arriba suelen tener un solo campo y confunden a csv.Sniffer).
+    """
+    try:
+        sample.decode("utf-8")
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # un carácter multibyte cortado al final de la muestra no cuenta
+        encoding = "utf-8-sig" if e.start >= len(sample) - 3 else "latin-1"
+    lines = sample.decode(encoding, errors="ignore").splitlines()[:SHEET_HEADER_SCAN]
+    widths = {d: max((len(r) for r in csv.reader(lines, delimiter=d)), default=0) for d in ",;\t|"}
+    return encoding, max(widths, key=widths.get)
+
+
+def _csv_chunks(source, sample: bytes):
+    # csv.reader (en C) línea a línea: tolera filas de distinto largo (títulos arriba)
+    encoding, sep = _csv_dialect(sample)
+    raw = open(source, "rb") if isinstance(source, str) else source
+    try:
+        text = io.TextIOWrapper(raw, encoding=encoding, errors="replace", newline="")
+        for frame in _sheet_chunks(csv.reader(text, delimiter=sep), "CSV"):
+            yield frame.mask(frame.eq(""))
+    finally:
+        raw.close()
+
+
+def iter_sheet_frames(path: Optional[str] = None, data: Optional[bytes] = None, content_type: Optional[str] = None):
+    """
+    Packing list en Excel / CSV -> DataFrames normalizados, uno por bloque de hasta
+    SHEET_CHUNK_ROWS filas (se omiten los que quedan vacíos). xlsx en modo read_only y
+    CSV línea a línea: la memoria depende del bloque, no del largo del archivo. El
+    encabezado se busca entre las primeras filas de cada hoja.
+    """
+    if data is not None:
+        head = data[:65536]
+    else:
+        with open(path, "rb") as f:
+            head = f.read(65536)
+    fmt = sheet_format(path or "", content_type, head)
+    source = io.BytesIO(data) if data is not None else path
+    print(f"[SHEET] Archivo {fmt}", file=sys.stderr)
+    if fmt == "csv":
+        chunks = _csv_chunks(source, head)
+    elif fmt == "xls":
+        chunks = _xls_chunks(source)
+    else:
+        chunks = _xlsx_chunks(source)
+    for chunk in chunks:
+        part = normalize_dataframe(chunk)
+        if not part.empty:
+            yield part
+
+
+def parse_sheet(path: Optional[str] = None, data: Optional[bytes] = None, content_type: Optional[str] = None) -> pd.DataFrame:
+    """Packing list en Excel / CSV -> mismo DataFrame normalizado que parse_pdf_hybrid."""
+    return _join_frames(list(iter_sheet_frames(path, data, content_type)))
+
+
+# Contrato de salida (en español) y de qué columna normalizada sale cada campo
+OUTPUT_COLUMNS = [
+    "nombre_comercial", "descripcion", "modelo", "unidad_de_medida", "cantidad_x_caja",
+    "cajas", "total_unidades", "partida", "precio_unitario_usd", "total_usd",
+]
+
+# Backend JSON: orjson si está instalado (auto), o forzar json / orjson
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _falsy(col: pd.Series) -> pd.Series:
+    """Máscara de `not valor` celda a celda: None, "", 0 / 0.0 / False (NaN NO es falsy)."""
+    mask = col.eq(0)
+    if col.dtype == object:
+        values = col.to_numpy(dtype=object)
+        mask |= pd.Series(values == None, index=col.index) | col.eq("")  # noqa: E711
+    return mask.fillna(False).astype(bool)
+
+
+def _or_default(col: pd.Series, default) -> pd.Series:
+    """`valor or default` para toda la columna."""
+    return col.astype(object).mask(_falsy(col), default)
+
+
+def _nan_like(col: pd.Series) -> pd.Series:
+    """Lo que clean_nans vuelve None: nulos, ±inf y textos "nan" / "<na>"."""
+    mask = col.isna() | col.isin([np.inf, -np.inf])
+    if col.dtype == object:
+        mask |= col.astype(str).str.strip().str.lower().isin({"nan", "<na>"})
+    return mask
+
+
+def output_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    DataFrame normalizado -> columnas del contrato de salida, con los valores por
+    defecto aplicados y los NaN/inf/"nan" ya en None (una pasada por columna).
+    """
+    if df.empty:
+        return pd.DataFrame(columns=OUTPUT_COLUMNS, dtype=object)
+    n = len(df)
+    out = pd.DataFrame({
+        "nombre_comercial": df["commercial_name"].astype(object),
+        "descripcion": _or_default(df["notes"], "Sin descripción"),
+        "modelo": df["model"].astype(object),
+        "unidad_de_medida": ["PZA"] * n,
+        "cantidad_x_caja": _or_default(df["package"], 1),
+        "cajas": [1] * n,
+        "total_unidades": _or_default(df["qty"], 1),
+        "partida": df["hs_code"].astype(object),
+        "precio_unitario_usd": df["unit_price"].astype(object),
+        "total_usd": df["total_amount"].astype(object),
+    }, index=df.index)
+    for c in OUTPUT_COLUMNS:
+        bad = _nan_like(out[c])
+        if bad.any():
+            out[c] = out[c].mask(bad, None)
+    return out
+
+
+def df_to_rows(df: pd.DataFrame) -> list[dict]:
+    """Filas normalizadas (columnas internas) -> filas en español del contrato de salida."""
+    return output_frame(df).to_dict("records")
+
+
+def df_to_columns(df: pd.DataFrame) -> tuple[list[str], list[list]]:
+    """Salida columnar compacta: (columnas, filas como listas en ese orden)."""
+    out = output_frame(df)
+    return list(out.columns), out.to_numpy(dtype=object).tolist()
+
+
+def dumps(obj) -> str:
+    """JSON de salida (UTF-8 sin escapar, sin NaN) con orjson si está disponible."""
+    if orjson is not None and JSON_BACKEND in ("auto", "orjson"):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, default=_json_default)
+
+
+def _json_default(v):
+    # Escalares numpy que to_dict / tolist no convierten (p. ej. columnas object con np.int64)
+    if isinstance(v, np.generic):
+        return v.item()
+    raise TypeError(f"{type(v).__name__} no es serializable a JSON")
+
+
+def parse_proforma_df(
+    path: Optional[str] = None,
+    data: Optional[bytes] = None,
+    content_type: Optional[str] = None,
+    session: Optional[PdfSession] = None,
+    workers: Optional[int] = None,
+    engine: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    DataFrame normalizado (columnas internas) de la proforma; ver parse_proforma.
+    Excel / CSV van a parse_sheet (leído directo del disco, por partes); el resto, PDF.
+    """
+    if data is None and session is not None:
+        data = session.data
+    kind = detect_kind(path or "", content_type)
+    if kind == "excel":
+        return parse_sheet(path, data, content_type)
+
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+    if session is not None:
+        return parse_pdf_hybrid(data, session=session, workers=workers, engine=engine)
+    with PdfSession(path, data) as own:
+        return parse_pdf_hybrid(data, session=own, workers=workers, engine=engine)
+
+
+def parse_proforma(
+    path: Optional[str] = None,
+    data: Optional[bytes] = None,
+    content_type: Optional[str] = None,
+    session: Optional[PdfSession] = None,
+    workers: Optional[int] = None,
+    engine: Optional[str] = None,
+) -> list[dict]:
+    """
+    API importable: devuelve las filas directamente (lo mismo que "rows" del CLI),
+    sin levantar otro intérprete ni pasar por JSON. Con session reutiliza el PDF ya
+    abierto por las otras etapas.
+    """
+    return df_to_rows(parse_proforma_df(
+        path, data, content_type=content_type, session=session, workers=workers, engine=engine,
+    ))
+
+
+def iter_proforma(
+    path: Optional[str] = None,
+    data: Optional[bytes] = None,
+    content_type: Optional[str] = None,
+    session: Optional[PdfSession] = None,
+    workers: Optional[int] = None,
+    engine: Optional[str] = None,
+):
+    """
+    Versión incremental de parse_proforma_df: genera ("page", n, DataFrame) por página
+    del PDF, o ("chunk", n, DataFrame) por bloque de la hoja, normalizados y con filas,
+    a medida que están listos. Cada parte se normaliza por separado, así que una
+    columna numérica con texto en otra página no convierte en texto esta.
+    """
+    if data is None and session is not None:
+        data = session.data
+    if detect_kind(path or "", content_type) == "excel":
+        for n, part in enumerate(iter_sheet_frames(path, data, content_type), 1):
+            yield "chunk", n, part
+        return
+
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+    for page, rows in iter_pdf_rows(data, session, workers, engine):
+        if rows:
+            part = normalize_dataframe(pd.DataFrame(rows))
+            if not part.empty:
+                yield "page", page, part
+
+
+def _emit_line(obj) -> None:
+    _REAL_STDOUT.write(dumps(obj) + "\n")
+    _REAL_STDOUT.flush()
+
+
 def main():
-    if len(sys.argv) < 2:
-        print(json.dumps({"meta": {}, "columns": [], "rows": [], "warnings": ["No file"]}))
+    # ===== stdout limpio: solo el JSON final va al stdout real (PyMuPDF y OCR escriben avisos) =====
+    global _REAL_STDOUT
+    _REAL_STDOUT, sys.stdout = sys.stdout, sys.stderr
+    try:
+        _main()
+    finally:
+        sys.stdout = _REAL_STDOUT
+
+
+def _main():
+    ap = argparse.ArgumentParser(description="Parser de proformas (JSON por stdout)")
+    ap.add_argument("path", nargs="?")
+    ap.add_argument("content_type", nargs="?")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="procesos para extract_tables (0 = todos los núcleos; por defecto TABLE_WORKERS)")
+    ap.add_argument("--engine", choices=TABLE_ENGINES, default=None,
+                    help="motor de tablas (por defecto TABLE_ENGINE, pdfplumber)")
+    ap.add_argument("--format", choices=("rows", "columnar", "ndjson"), default="rows",
+                    help="rows: lista de objetos (por defecto); columnar: columns + rows como arreglos; "
+                         "ndjson: una línea por página / bloque apenas está lista y un resumen al final")
+    args = ap.parse_args()
+    if not args.path:
+        print(json.dumps({"meta": {}, "columns": [], "rows": [], "warnings": ["No file"]}), file=_REAL_STDOUT)
         return
+    try:
+        _emit_parse(args)
+    except ImportError as e:
+        # Falta una dependencia opcional (openpyxl / xlrd para Excel): salida vacía con el aviso
+        print(f"[ERROR] {e}", file=sys.stderr)
+        warning = str(e)
+        if args.format == "ndjson":
+            _emit_line({"type": "summary", "meta": {"currency": "USD", "format": "ndjson"}, "columns": OUTPUT_COLUMNS,
+                        "total_rows": 0, "parts": 0, "warnings": [warning]})
+        else:
+            _emit_line({"meta": {"currency": "USD"}, "columns": [], "rows": [], "warnings": [warning]})
 
-    path = sys.argv[1]
-    content_type = sys.argv[2] if len(sys.argv) >= 3 else None
-    with open(path, "rb") as f:
-        data = f.read()
 
-    kind = detect_kind(path, content_type)
-    df = parse_pdf_hybrid(data)
+def _emit_parse(args) -> None:
+    """Parsea y escribe la salida en el formato pedido (rows / columnar / ndjson)."""
+    if args.format == "ndjson":
+        # {"type": "rows", "page"|"chunk": n, "rows": [...]} ... {"type": "summary", ...}
+        total = parts = 0
+        for unit, n, part in iter_proforma(args.path, content_type=args.content_type or None,
+                                           workers=args.workers, engine=args.engine):
+            rows = df_to_rows(part)
+            total += len(rows)
+            parts += 1
+            _emit_line({"type": "rows", unit: n, "rows": rows})
+        _emit_line({"type": "summary", "meta": {"currency": "USD", "format": "ndjson"}, "columns": OUTPUT_COLUMNS,
+                    "total_rows": total, "parts": parts, "warnings": []})
+        return
 
-    rows = []
-    for _, r in df.iterrows():
-        rows.append({
-            "nombre_comercial": r.get("commercial_name"),
-            "descripcion": r.get("notes") or "Sin descripción",
-            "modelo": r.get("model"),
-            "unidad_de_medida": "PZA",
-            "cantidad_x_caja": r.get("package") or 1,
-            "cajas": 1,
-            "total_unidades": r.get("qty") or 1,
-            "partida": r.get("hs_code"),
-            "precio_unitario_usd": r.get("unit_price"),
-            "total_usd": r.get("total_amount")
-        })
-
-    print(json.dumps(clean_nans({
-        "meta": {"currency": "USD"},
-        "columns": list(rows[0].keys()) if rows else [],
-        "rows": rows,
-        "warnings": []
-    }), ensure_ascii=False, allow_nan=False))
+    df = parse_proforma_df(args.path, content_type=args.content_type or None, workers=args.workers, engine=args.engine)
+
+    if args.format == "columnar":
+        columns, rows = df_to_columns(df)
+        payload = {"meta": {"currency": "USD", "format": "columnar"}, "columns": columns, "rows": rows, "warnings": []}
+    else:
+        rows = df_to_rows(df)
+        payload = {"meta": {"currency": "USD"}, "columns": list(rows[0].keys()) if rows else [], "rows": rows, "warnings": []}
+    _emit_line(payload)
 
 
 if __name__ == "__main__":
@@ -1,20 +1,18 @@
 # scripts/pdf_to_images_b64.py
 import sys, json, base64
 from typing import List
-import fitz  # PyMuPDF
+from sesion_pdf import PdfSession
 
-def pdf_to_images_b64(path: str, max_pages: int = 2, zoom: float = 2.0) -> List[str]:
-    imgs = []
-    doc = fitz.open(path)
-    pages = min(len(doc), max_pages)
-    for i in range(pages):
-        page = doc.load_page(i)
-        mat = fitz.Matrix(zoom, zoom)
-        pix = page.get_pixmap(matrix=mat, alpha=False)
-        b = pix.tobytes("png")
-        imgs.append(base64.b64encode(b).decode("utf-8"))
-    doc.close()
-    return imgs
+def pdf_to_images_b64(path: str, max_pages: int = 2, zoom: float = 2.0, session=None) -> List[str]:
+    own = session is None
+    if own:
+        session = PdfSession(path)
+    try:
+        pages = min(len(session), max_pages)
+        return [base64.b64encode(session.render_png(i, zoom)).decode("utf-8") for i in range(pages)]
+    finally:
+        if own:
+            session.close()
 
 def main():
     if len(sys.argv) < 2:
@@ -1,15 +1,20 @@
-import os, sys, io, json, tempfile, base64, subprocess
+import os, sys, io, json, time, base64, threading, subprocess
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Any, Dict, List
-import requests
 
 # ====== Redirigir stdout a stderr para que los logs NO rompan el JSON ======
 _REAL_STDOUT = sys.stdout
 sys.stdout = sys.stderr  # a partir de aquí, todo print() va a STDERR
 
-try:
-    from extraer_imagenes import extract_images_from_pdf
-except Exception:
-    from extraerimagenes import extract_images_from_pdf
+from extraerimagenes import (
+    iter_images_from_pdf, image_record, image_mime, new_duplicate_index, find_duplicate, classifier_variant,
+    product_check, repeat_pages, CLASSIFY_NON_PRODUCT,
+)
+from sesion_pdf import PdfSession
+from cliente_http import get_client
+from cache_clasificacion import open_cache
+import lote_clasificacion
 
 
 def _emit_json(obj: Dict[str, Any]) -> None:
@@ -36,22 +41,84 @@ def _safe_num(x):
         return None
 
 
-def _run_parser_proforma(pdf_path: str) -> List[Dict[str, Any]]:
-    """Ejecuta parser_proforma.py y devuelve filas normalizadas en español."""
-    script = os.path.join(os.getcwd(), "scripts", "parser_proforma.py")
+# Cómo se corre el parser de proforma:
+#   inprocess  -> parser_proforma.parse_proforma() en este proceso, con la PdfSession compartida
+#   worker     -> en un proceso aparte ya caliente (imports hechos), en paralelo con la extracción
+#   subprocess -> CLI scripts/parser_proforma.py (comportamiento anterior)
+PARSER_MODE = os.getenv("PARSER_MODE", "inprocess")
+
+# Proceso del parser reutilizable entre llamadas (solo PARSER_MODE=worker)
+_PARSER_POOL = None
+# Cargar PaddleOCR al levantar el worker (si está instalado), no con el primer escaneo
+OCR_WARMUP = os.getenv("OCR_WARMUP", "1") == "1"
+
+
+def _warm_parser() -> None:
+    """Inicializador del worker: paga los imports (pandas, pdfplumber) y el OCR una sola vez."""
+    import parser_proforma
+    if OCR_WARMUP:
+        parser_proforma.warm_ocr()
+
+
+def _parser_rows_job(pdf_path: str) -> List[Dict[str, Any]]:
+    from parser_proforma import parse_proforma
+    return parse_proforma(pdf_path)
+
+
+def start_parser_worker(wait: bool = False) -> ProcessPoolExecutor:
+    """Levanta (una vez) el proceso del parser y lo deja caliente; wait=True espera los imports."""
+    global _PARSER_POOL
+    if _PARSER_POOL is None:
+        _PARSER_POOL = ProcessPoolExecutor(max_workers=1, initializer=_warm_parser)
+        # El pool crea el proceso con la primera tarea: una vacía para que arranque ya
+        warm = _PARSER_POOL.submit(int)
+        if wait:
+            warm.result()
+    return _PARSER_POOL
+
+
+def submit_parser_proforma(pdf_path: str, session: PdfSession | None = None, mode: str | None = None):
+    """
+    Arranca el parser y devuelve un callable que entrega las filas crudas. En modo
+    worker el parseo corre mientras se extraen las imágenes; en los otros modos se
+    ejecuta al pedir el resultado.
+    """
+    mode = mode or PARSER_MODE
+    if mode == "worker":
+        future = start_parser_worker().submit(_parser_rows_job, pdf_path)
+        return lambda: future.result(timeout=180)
+    if mode == "subprocess":
+        return lambda: _parser_rows_cli(pdf_path)
+
+    def _inprocess():
+        from parser_proforma import parse_proforma
+        return parse_proforma(pdf_path, session=session)
+    return _inprocess
+
+
+def _parser_rows_cli(pdf_path: str) -> List[Dict[str, Any]]:
+    """Filas crudas vía CLI (un intérprete nuevo + JSON de ida y vuelta)."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser_proforma.py")
     if not os.path.exists(script):
         return []
-
+    out = subprocess.check_output(
+        [sys.executable, script, pdf_path],
+        cwd=os.getcwd(),
+        stderr=subprocess.DEVNULL,
+        timeout=180
+    )
+    data = json.loads(out.decode("utf-8", errors="ignore"))
+    return data.get("rows", []) or []
+
+
+def _run_parser_proforma(
+    pdf_path: str, session: PdfSession | None = None, mode: str | None = None, pending=None,
+) -> List[Dict[str, Any]]:
+    """Ejecuta el parser de proforma (ver PARSER_MODE) y devuelve filas normalizadas en español."""
     try:
-        out = subprocess.check_output(
-            [sys.executable, script, pdf_path],
-            cwd=os.getcwd(),
-            stderr=subprocess.STDOUT,
-            timeout=180
-        )
-        data = json.loads(out.decode("utf-8", errors="ignore"))
-        rows = data.get("rows", []) or []
-    except Exception:
+        rows = (pending or submit_parser_proforma(pdf_path, session, mode))()
+    except Exception as e:
+        print(f"[WARN] Parser de proforma falló: {e}", file=sys.stderr)
         return []
 
     norm: List[Dict[str, Any]] = []
@@ -123,67 +190,214 @@ def _merge_ai_with_proforma(ai_item: Dict[str, Any], proforma_row: Dict[str, Any
 # ==========================================================
 # CLASIFICADOR DE PRODUCTOS
 # ==========================================================
-def classify_b64(b64png: str, api_key: str) -> Dict[str, Any]:
+# Llamadas al clasificador en vuelo a la vez (las imágenes esperan red, no CPU)
+CLASSIFY_CONCURRENCY = max(1, int(os.getenv("CLASSIFY_CONCURRENCY", "4")))
+# Reintentos ante 429 / 5xx / errores de red antes de dejar la imagen con el error
+CLASSIFY_RETRIES = max(0, int(os.getenv("CLASSIFY_RETRIES", "4")))
+# Plazo total por imagen (o lote), reintentos incluidos
+CLASSIFY_DEADLINE = float(os.getenv("CLASSIFY_DEADLINE", "300"))
+# Imágenes por llamada (1 = una por llamada; >1 = lote con un solo prompt de sistema)
+CLASSIFY_BATCH = max(1, int(os.getenv("CLASSIFY_BATCH", "1")))
+
+
+class ClassifyLimiter:
+    """
+    Semáforo de llamadas al clasificador con límite ajustable. Un 429 baja el límite
+    a la mitad (mínimo 1) y pausa a todos los hilos lo que pida Retry-After; cada
+    respuesta buena lo va subiendo de a uno hasta el máximo configurado.
+    """
+
+    def __init__(self, limit: int = CLASSIFY_CONCURRENCY):
+        self.max_limit = self.limit = max(1, limit)
+        self.active = 0
+        self.resume_at = 0.0
+        self.stats = Counter()  # attempts, rate_limited, retries, tokens, batch_fallbacks
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while True:
+                wait = self.resume_at - time.monotonic()
+                if wait <= 0 and self.active < self.limit:
+                    break
+                self._cond.wait(timeout=wait if wait > 0 else None)
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def ok(self) -> None:
+        with self._cond:
+            if self.limit < self.max_limit:
+                self.limit += 1
+                self._cond.notify_all()
+
+    def rate_limited(self, wait: float) -> None:
+        with self._cond:
+            self.stats["rate_limited"] += 1
+            self.limit = max(1, self.limit // 2)
+            self.resume_at = max(self.resume_at, time.monotonic() + wait)
+
+
+_SYSTEM_PROMPT = (
+    "Eres un especialista en clasificación arancelaria (Ecuador / SENAE, NANDINA). "
+    "Devuelve SOLO JSON con este esquema: "
+    '{"hsCode":"xxxxxx","commercialName":"texto","confidence":0-1,'
+    '"reason":"texto","linkCotizador":"url"}. '
+    "Usa Alibaba como prioridad, Amazon solo si es necesario."
+)
+# Lote: el prompt largo viaja una vez por K imágenes; cada imagen va precedida de su id
+_BATCH_PROMPT = (
+    "Eres un especialista en clasificación arancelaria (Ecuador / SENAE, NANDINA). "
+    "Recibirás varias imágenes de productos, cada una precedida por su id. "
+    "Devuelve SOLO JSON con este esquema, un elemento por imagen: "
+    '{"results":[{"id":"img1","hsCode":"xxxxxx","commercialName":"texto","confidence":0-1,'
+    '"reason":"texto","linkCotizador":"url"}]}. '
+    "Usa Alibaba como prioridad, Amazon solo si es necesario."
+)
+
+
+def _post_classifier(payload: Dict[str, Any], api_key: str, limiter: ClassifyLimiter | None = None) -> Dict[str, Any]:
+    """
+    chat/completions por el cliente compartido (pool keep-alive, reintentos con backoff,
+    plazo total); los 429 además bajan el ritmo del limiter. Devuelve el JSON o levanta.
+    """
+    r = get_client().chat(
+        api_key, payload, timeout=120, deadline=CLASSIFY_DEADLINE, retries=CLASSIFY_RETRIES,
+        slot=limiter,
+        on_throttle=limiter.rate_limited if limiter is not None else None,
+        stats=limiter.stats if limiter is not None else None,
+    )
+    r.raise_for_status()
+    body = r.json()
+    if limiter is not None:
+        limiter.ok()
+        usage = body.get("usage") or {}
+        limiter.stats["prompt_tokens"] += int(usage.get("prompt_tokens") or 0)
+        limiter.stats["completion_tokens"] += int(usage.get("completion_tokens") or 0)
+    return body
+
+
+def _classification(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Respuesta del modelo -> clasificación (link de Alibaba por defecto si no vino uno)."""
+    cname = str(data.get("commercialName") or data.get("commercial_name") or "").strip()
+    link = str(data.get("linkCotizador") or "").strip()
+    if not link or "alibaba.com" not in link:
+        q = cname.replace(" ", "+") if cname else "product"
+        link = f"https://www.alibaba.com/trade/search?fsb=y&IndexArea=product_en&SearchText={q}"
+    return {
+        "hs_code": str(data.get("hsCode") or data.get("hs_code") or ""),
+        "commercial_name": cname,
+        "confidence": float(data.get("confidence") or 0),
+        "reason": str(data.get("reason") or ""),
+        "linkCotizador": link,
+    }
+
+
+def _error_result(e: Exception) -> Dict[str, Any]:
+    return {
+        "hs_code": "",
+        "commercial_name": "",
+        "confidence": 0.0,
+        "reason": f"Error: {e}",
+        "linkCotizador": "",
+    }
+
+
+def classify_b64(b64png: str, api_key: str, mime: str = "image/png", limiter: ClassifyLimiter | None = None) -> Dict[str, Any]:
     payload = {
         "model": "gpt-4o-mini",
         "temperature": 0.2,
         "max_tokens": 600,
         "response_format": {"type": "json_object"},
         "messages": [
-            {
-                "role": "system",
-                "content": (
-                    "Eres un especialista en clasificación arancelaria (Ecuador / SENAE, NANDINA). "
-                    "Devuelve SOLO JSON con este esquema: "
-                    '{"hsCode":"xxxxxx","commercialName":"texto","confidence":0-1,'
-                    '"reason":"texto","linkCotizador":"url"}. '
-                    "Usa Alibaba como prioridad, Amazon solo si es necesario."
-                ),
-            },
+            {"role": "system", "content": _SYSTEM_PROMPT},
             {
                 "role": "user",
                 "content": [
                     {"type": "text", "text": "Describe brevemente el producto y genera un link de cotización."},
-                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{b64png}"}} ],
+                    {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{b64png}"}} ],
             },
         ],
     }
 
     try:
-        r = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-            json=payload,
-            timeout=120,
-        )
-        r.raise_for_status()
-        raw = r.json()["choices"][0]["message"]["content"] or "{}"
-        data = json.loads(raw)
-        cname = str(data.get("commercialName") or data.get("commercial_name") or "").strip()
-        link = str(data.get("linkCotizador") or "").strip()
-        if not link or "alibaba.com" not in link:
-            q = cname.replace(" ", "+") if cname else "product"
-            link = f"https://www.alibaba.com/trade/search?fsb=y&IndexArea=product_en&SearchText={q}"
-        return {
-            "hs_code": str(data.get("hsCode") or data.get("hs_code") or ""),
-            "commercial_name": cname,
-            "confidence": float(data.get("confidence") or 0),
-            "reason": str(data.get("reason") or ""),
-            "linkCotizador": link,
-        }
+        body = _post_classifier(payload, api_key, limiter)
+        raw = body["choices"][0]["message"]["content"] or "{}"
+        return _classification(json.loads(raw))
     except Exception as e:
-        return {
-            "hs_code": "",
-            "commercial_name": "",
-            "confidence": 0.0,
-            "reason": f"Error: {e}",
-            "linkCotizador": "",
+        return _error_result(e)
+
+
+def classify_batch(
+    items: List[tuple], api_key: str, limiter: ClassifyLimiter | None = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Clasifica varias imágenes [(clave, b64, mime), ...] en UNA llamada (ver
+    lote_clasificacion); las que el lote no resuelva van de a una con classify_b64.
+    """
+    def send(messages: List[Dict[str, Any]]) -> str:
+        payload = {
+            "model": "gpt-4o-mini",
+            "temperature": 0.2,
+            "max_tokens": 600 * len(items),
+            "response_format": {"type": "json_object"},
+            "messages": messages,
         }
+        return _post_classifier(payload, api_key, limiter)["choices"][0]["message"]["content"]
+
+    def fallback() -> None:
+        if limiter is not None:
+            limiter.stats["batch_fallbacks"] += 1
+
+    return lote_clasificacion.classify_batch(
+        items,
+        system_prompt=_BATCH_PROMPT,
+        request_text=f"Clasifica estas {len(items)} imágenes de productos y genera un link de cotización para cada una.",
+        fields=("hsCode", "commercialName"),
+        parse=_classification,
+        send=send,
+        single=lambda _key, b64, mime: classify_b64(b64, api_key, mime, limiter),
+        on_fallback=fallback,
+    )
+
+
+def classify_all(
+    calls: Dict[str, tuple], api_key: str, limiter: ClassifyLimiter, batch: int = CLASSIFY_BATCH,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Clasifica {nombre: (b64, mime)} en paralelo (limiter.max_limit llamadas en vuelo):
+    una imagen por llamada, o lotes de `batch` imágenes consecutivas si batch > 1.
+    """
+    names = list(calls)
+    with ThreadPoolExecutor(max_workers=limiter.max_limit) as pool:
+        if batch <= 1:
+            futures = {f: pool.submit(classify_b64, *calls[f], api_key, limiter) for f in names}
+            return {f: fut.result() for f, fut in futures.items()}
+        groups = [names[i:i + batch] for i in range(0, len(names), batch)]
+        futures = [pool.submit(classify_batch, [(f, *calls[f]) for f in g], api_key, limiter) for g in groups]
+        results: Dict[str, Dict[str, Any]] = {}
+        for fut in futures:
+            results.update(fut.result())
+    return {f: results[f] for f in names}
+
+
+def _non_product_result(why: str) -> Dict[str, Any]:
+    """Resultado vacío para imágenes que el pre-filtro descarta (no se paga la llamada)."""
+    return {
+        "hs_code": "",
+        "commercial_name": "",
+        "confidence": 0.0,
+        "reason": f"No clasificada: no parece producto ({why})",
+        "linkCotizador": "",
+    }
 
 
-def to_b64(path: str) -> str:
-    with open(path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
+def to_b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("utf-8")
 
 
 # ==========================================================
@@ -195,71 +409,181 @@ def main():
         return
 
     pdf_path, doc_name, api_key = sys.argv[1], sys.argv[2], sys.argv[3]
+    session = None
+    cache = open_cache("prep_liquidacion")
 
     try:
-        with tempfile.TemporaryDirectory() as tmp:
-            out_dir = os.path.join(tmp, "imgs")
-            os.makedirs(out_dir, exist_ok=True)
-
-            # 1) Extrae imágenes
-            extract_images_from_pdf(pdf_path, out_dir)
-            print(f"[DEBUG] Imágenes guardadas en: {os.path.join(out_dir, 'FOTOS')}", file=sys.stderr)
-
-            # 2) Parser proforma
-            proforma_rows = _run_parser_proforma(pdf_path)
-            print(f"[LOG] Parser detectó {len(proforma_rows)} filas válidas", file=sys.stderr)
-
-            # 3) Clasifica + Fusiona
-            final_img_path = os.path.join(out_dir, "FOTOS")
-            files = sorted(os.listdir(final_img_path))
-            images: List[Dict[str, Any]] = []
-
-            for i, f in enumerate(files):
-                fp = os.path.join(final_img_path, f)
-                if not os.path.isfile(fp):
-                    continue
-
-                b64 = to_b64(fp)
-                cls = classify_b64(b64, api_key)
-
-                base_item = {
-                    "id": f"img{i+1}",
-                    "name": f,
-                    "b64": b64,
-                    "hs_code": cls.get("hs_code", ""),
-                    "commercial_name": cls.get("commercial_name", ""),
-                    "confidence": cls.get("confidence", 0),
-                    "reason": cls.get("reason", ""),
-                    "linkCotizador": cls.get("linkCotizador", ""),
-                    "nombre_comercial": cls.get("commercial_name", ""),
+        # 1) Parser proforma (en modo worker corre en paralelo con la extracción)
+        session = PdfSession(pdf_path)
+        pending = submit_parser_proforma(pdf_path, session)
+
+        # 2) Extrae (en memoria, orden visual); las repeticiones se cuentan en todo el documento.
+        #    El dHash solo se calcula si la caché acepta imágenes casi iguales
+        perceptual = cache is not None and cache.phash_distance is not None
+        extracted = [
+            (image_record(index, page, rect, data, perceptual), data)
+            for index, page, rect, data in iter_images_from_pdf(pdf_path, session=session)
+        ]
+        proforma_rows = _run_parser_proforma(pdf_path, pending=pending)
+        print(f"[LOG] Parser detectó {len(proforma_rows)} filas válidas", file=sys.stderr)
+        repeats = repeat_pages([rec for rec, _ in extracted])  # logos / sellos: mismo lugar en varias páginas
+
+        # 3) Pre-filtro: cada imagen se clasifica, reutiliza la clasificación de su
+        #    original (duplicada) o de la caché persistente, o se descarta (no producto);
+        #    las llamadas van después, juntas
+        images: List[Dict[str, Any]] = []
+        classified: Dict[str, Dict[str, Any]] = {}  # nombre -> clasificación ya pagada
+        seen = new_duplicate_index()
+        # Bytes que realmente viajan al clasificador vs la imagen completa (que va a Drive / UI)
+        # y llamadas evitadas por duplicado / por no ser producto
+        sent = {
+            "images": 0, "original_bytes": 0, "sent_bytes": 0,
+            "skipped_duplicates": 0, "skipped_non_product": 0, "cached": 0,
+        }
+        plans = []   # por imagen, en orden: (original, es producto, motivo, "dup" | "skip" | "cache" | "call")
+        calls = {}   # nombre -> (b64 de la variante chica, mime)
+        cached = {}  # nombre -> clasificación de la caché
+        names = set()
+        for rec, data in extracted:
+            f = rec["name"]
+            original = find_duplicate(rec, seen)
+            is_product, why = product_check(data, rec["rect"], repeats.get(rec["sha1"], 1))
+            if original in names:
+                kind = "dup"
+            elif not is_product and not CLASSIFY_NON_PRODUCT:
+                kind = "skip"
+            elif cache is not None and (hit := cache.get(rec["sha1"], rec["phash"])) is not None:
+                kind = "cache"
+                cached[f] = hit
+            else:
+                kind = "call"
+                small, small_mime = classifier_variant(data)
+                sent["images"] += 1
+                sent["original_bytes"] += len(data)
+                sent["sent_bytes"] += len(small)
+                calls[f] = (to_b64(small), small_mime)
+            names.add(f)
+            plans.append((original, is_product, why, kind))
+
+        # 4) Clasifica en paralelo (CLASSIFY_CONCURRENCY llamadas en vuelo; los 429 bajan el ritmo)
+        limiter = ClassifyLimiter()
+        t0 = time.perf_counter()
+        results = classify_all(calls, api_key, limiter)
+        if cache is not None:
+            # Solo clasificaciones reales; los errores (red, cuota) se reintentan la próxima vez
+            by_name = {rec["name"]: rec for rec, _ in extracted}
+            for f, cls in results.items():
+                cache.put(by_name[f]["sha1"], cls, by_name[f]["phash"])
+        sent["classify_seconds"] = round(time.perf_counter() - t0, 3)
+        sent["concurrency"] = limiter.max_limit
+        sent["rate_limited"] = limiter.stats["rate_limited"]
+        sent["retries"] = limiter.stats["retries"]
+        # Costo por imagen: pedidos y tokens (CLASSIFY_BATCH > 1 comparte el prompt entre K imágenes)
+        sent["batch_size"] = CLASSIFY_BATCH
+        sent["api_requests"] = limiter.stats["attempts"]
+        sent["batch_fallbacks"] = limiter.stats["batch_fallbacks"]
+        sent["prompt_tokens"] = limiter.stats["prompt_tokens"]
+        sent["completion_tokens"] = limiter.stats["completion_tokens"]
+        if calls:
+            sent["tokens_per_image"] = round((sent["prompt_tokens"] + sent["completion_tokens"]) / len(calls), 1)
+        sent["http"] = get_client().report()
+        print(
+            f"[LOG] Clasificación: {len(calls)} imágenes en {sent['api_requests']} llamadas, {sent['classify_seconds']}s "
+            f"({limiter.max_limit} en paralelo, {sent['rate_limited']} rate limit)",
+            file=sys.stderr,
+        )
+
+        # 5) Fusiona en el orden de extracción (la fila i de la proforma va con la imagen i)
+        for i, ((rec, data), (original, is_product, why, kind)) in enumerate(zip(extracted, plans)):
+            f = rec["name"]
+            b64 = to_b64(data)
+            mime = image_mime(data)
+            if kind == "dup":
+                # Imagen repetida (logo, sello, misma foto): misma clasificación, su propia fila
+                cls = classified[original]
+                sent["skipped_duplicates"] += 1
+                print(f"[LOG] {f} duplicada de {original}; se reutiliza la clasificación", file=sys.stderr)
+            elif kind == "skip":
+                cls = _non_product_result(why)
+                sent["skipped_non_product"] += 1
+                print(f"[LOG] {f} no parece producto ({why}); no se clasifica", file=sys.stderr)
+            elif kind == "cache":
+                cls = cached[f]
+                sent["cached"] += 1
+            else:
+                cls = results[f]
+            classified[f] = cls
+
+            base_item = {
+                "id": f"img{i+1}",
+                "name": f,
+                "b64": b64,
+                "mime": mime,
+                "duplicate_of": original,
+                "is_product": is_product,
+                "hs_code": cls.get("hs_code", ""),
+                "commercial_name": cls.get("commercial_name", ""),
+                "confidence": cls.get("confidence", 0),
+                "reason": cls.get("reason", ""),
+                "linkCotizador": cls.get("linkCotizador", ""),
+                "nombre_comercial": cls.get("commercial_name", ""),
+            }
+
+            if i < len(proforma_rows):
+                row = proforma_rows[i]
+            elif len(proforma_rows) > 0:
+                row = proforma_rows[-1]
+            else:
+                row = {
+                    "nombre_comercial": "",
+                    "descripcion": "",
+                    "unidad_de_medida": "PZA",
+                    "cantidad_x_caja": 1,
+                    "cajas": 1,
+                    "total_unidades": 1,
+                    "partida": cls.get("hs_code", ""),
+                    "precio_unitario_usd": None,
+                    "total_usd": None,
+                    "proveedores": "",
+                    "modelo": "",
                 }
 
-                if i < len(proforma_rows):
-                    row = proforma_rows[i]
-                elif len(proforma_rows) > 0:
-                    row = proforma_rows[-1]
-                else:
-                    row = {
-                        "nombre_comercial": "",
-                        "descripcion": "",
-                        "unidad_de_medida": "PZA",
-                        "cantidad_x_caja": 1,
-                        "cajas": 1,
-                        "total_unidades": 1,
-                        "partida": cls.get("hs_code", ""),
-                        "precio_unitario_usd": None,
-                        "total_usd": None,
-                        "proveedores": "",
-                        "modelo": "",
-                    }
-
-                merged = _merge_ai_with_proforma(base_item, row)
-                images.append(merged)
-
-            _emit_json({"success": True, "documentName": doc_name, "images": images})
+            merged = _merge_ai_with_proforma(base_item, row)
+            images.append(merged)
+
+        sent["saved_bytes"] = sent["original_bytes"] - sent["sent_bytes"]
+        sent["api_calls_avoided"] = sent["skipped_duplicates"] + sent["skipped_non_product"] + sent["cached"]
+        if cache is not None:
+            sent["cache"] = cache.report()
+        print(
+            f"[LOG] Clasificador: {sent['images']} imágenes, {sent['sent_bytes'] // 1024} KB enviados "
+            f"(ahorro {sent['saved_bytes'] // 1024} KB frente a la resolución completa)",
+            file=sys.stderr,
+        )
+        print(
+            f"[LOG] Llamadas evitadas: {sent['api_calls_avoided']} "
+            f"({sent['skipped_duplicates']} duplicadas, {sent['skipped_non_product']} no-producto, "
+            f"{sent['cached']} en caché)",
+            file=sys.stderr,
+        )
+        doc_stats = session.report()
+        print(
+            f"[LOG] Sesión PDF: {doc_stats['pages_parsed']} páginas interpretadas, "
+            f"máx. {doc_stats['max_parses_per_page']} vez por página",
+            file=sys.stderr,
+        )
+        _emit_json({
+            "success": True, "documentName": doc_name, "images": images,
+            "classifierStats": sent, "documentStats": doc_stats,
+        })
 
     except Exception as e:
         _emit_json({"success": False, "error": str(e)})
+    finally:
+        if session is not None:
+            session.close()
+        if cache is not None:
+            cache.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,257 @@
+# scripts/sesion_pdf.py
+"""
+Sesión de documento PDF compartida entre etapas (extracción de imágenes, parser de
+tablas, render de páginas para la IA). El archivo se lee y se abre UNA vez; cada
+página se interpreta una sola vez (display list de PyMuPDF) y de ahí salen los
+clips de imágenes, el texto y los renders de página completa.
+
+Los contadores de `stats` permiten comprobar que, en una corrida completa, ninguna
+página se interpretó ni se rasterizó (al mismo zoom) más de una vez.
+
+plan() es el pre-vuelo: clasifica cada página (tabla vectorial, texto, escaneada,
+solo imágenes) para que los parsers vayan directo al motor más barato que sirve.
+
+Uso: python scripts/sesion_pdf.py <pdf>   -> plan por página en JSON
+"""
+
+import io, os, sys, json, hashlib
+from collections import Counter
+
+import fitz  # PyMuPDF
+
+
+# ==========================================================
+# PRE-VUELO
+# ==========================================================
+# Menos caracteres que esto = página sin texto útil (mismo umbral que el parser)
+PREFLIGHT_MIN_TEXT = int(os.getenv("PREFLIGHT_MIN_TEXT", "30"))
+# Fracción de la página cubierta por imágenes para considerarla escaneada
+PREFLIGHT_SCAN_COVERAGE = float(os.getenv("PREFLIGHT_SCAN_COVERAGE", "0.5"))
+
+# tipo de página -> motor
+PAGE_ENGINES = {
+    "vector_table": "tables",   # pdfplumber extract_tables
+    "text": "text",             # capa de texto (sin ruling no hay tablas que extraer)
+    "scanned": "ocr",           # raster de página completa
+    "image_only": "ocr",        # imágenes sin capa de texto: puede ser un escaneo chico o recortado
+    "blank": "skip",            # sin texto, imágenes ni dibujos: nada que leer
+}
+
+
+def _ruling_edges(page) -> tuple[int, int]:
+    """
+    Bordes horizontales / verticales dibujados (líneas y rectángulos). pdfplumber arma
+    celdas solo a partir de estos bordes, así que sin ≥2 de cada tipo no hay tabla.
+    Las curvas cuentan como ambos (conservador: mejor intentar que perder una tabla).
+    """
+    h = v = 0
+    for path in page.get_cdrawings():
+        for item in path.get("items", ()):
+            op = item[0]
+            if op == "l":
+                (x0, y0), (x1, y1) = item[1], item[2]
+                if abs(y1 - y0) < 1.0:
+                    h += 1
+                elif abs(x1 - x0) < 1.0:
+                    v += 1
+            elif op in ("re", "qu", "c"):
+                h += 2
+                v += 2
+    return h, v
+
+
+class PdfSession:
+    def __init__(self, path: str | None = None, data: bytes | None = None):
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        self.path = path
+        self.data = data
+        self._doc = None
+        self._plumber = None
+        self._pages = {}        # i -> fitz.Page
+        self._dlists = {}       # i -> fitz.DisplayList
+        self._textpages = {}    # i -> fitz.TextPage (con bloques de imagen)
+        self._text = {}         # i -> str
+        self._plan = {}         # i -> dict (pre-vuelo)
+        self._hashes = {}       # i -> sha1 del contenido de la página
+        self._png = {}          # (i, zoom) -> bytes
+        self.stats = {
+            "opened": Counter(),        # motor -> veces abierto
+            "parsed": Counter(),        # página -> display lists construidos
+            "plumber_pages": Counter(), # página -> accesos pdfplumber (tablas)
+            "rendered": Counter(),      # (página, zoom) -> rasterizaciones
+            "preflight": Counter(),     # página -> pasadas de pre-vuelo (dibujos vectoriales)
+        }
+
+    # ------------------------------ PyMuPDF ------------------------------
+    @property
+    def doc(self):
+        if self._doc is None:
+            self._doc = fitz.open(stream=self.data, filetype="pdf")
+            self.stats["opened"]["fitz"] += 1
+        return self._doc
+
+    def __len__(self) -> int:
+        return len(self.doc)
+
+    def page(self, i: int):
+        """Página i (base 0), cargada una sola vez."""
+        if i not in self._pages:
+            self._pages[i] = self.doc.load_page(i)
+        return self._pages[i]
+
+    def displaylist(self, i: int):
+        """Contenido de la página i ya interpretado; todo lo demás se saca de aquí."""
+        if i not in self._dlists:
+            self._dlists[i] = self.page(i).get_displaylist()
+            self.stats["parsed"][i] += 1
+        return self._dlists[i]
+
+    def textpage(self, i: int):
+        """TextPage de la página i desde el display list (incluye bloques de imagen)."""
+        if i not in self._textpages:
+            tp = fitz.TextPage(self.displaylist(i).get_textpage(fitz.TEXTFLAGS_TEXT | fitz.TEXT_PRESERVE_IMAGES))
+            tp.parent = self.page(i)
+            self._textpages[i] = tp
+        return self._textpages[i]
+
+    def text(self, i: int) -> str:
+        """Capa de texto de la página i (desde el display list, sin reinterpretar)."""
+        if i not in self._text:
+            self._text[i] = self.page(i).get_text(textpage=self.textpage(i))
+        return self._text[i]
+
+    def preflight(self, i: int) -> dict:
+        """
+        Clasifica la página i: vector_table / text / scanned / image_only / blank, y el motor
+        que le toca (PAGE_ENGINES). Texto e imágenes salen del TextPage ya construido;
+        solo los dibujos vectoriales requieren una pasada extra (barata) por la página.
+        """
+        if i not in self._plan:
+            self.stats["preflight"][i] += 1
+            page = self.page(i)
+            chars = len(self.text(i).strip())
+            area = abs(page.rect) or 1.0
+            covered = 0.0
+            for b in self.textpage(i).extractBLOCKS():
+                if b[6] == 1:  # bloque de imagen
+                    covered += abs(fitz.Rect(b[:4]) & page.rect)
+            coverage = min(1.0, covered / area)
+            h, v = _ruling_edges(page)
+
+            if h >= 2 and v >= 2 and chars > 0:
+                kind = "vector_table"
+            elif chars >= PREFLIGHT_MIN_TEXT:
+                kind = "text"
+            elif chars == 0 and covered == 0 and h == 0 and v == 0:
+                kind = "blank"
+            elif coverage >= PREFLIGHT_SCAN_COVERAGE:
+                kind = "scanned"
+            else:
+                kind = "image_only"
+            self._plan[i] = {
+                "page": i + 1,
+                "kind": kind,
+                "engine": PAGE_ENGINES[kind],
+                "chars": chars,
+                "ruling": [h, v],
+                "image_coverage": round(coverage, 3),
+            }
+        return self._plan[i]
+
+    def plan(self) -> list[dict]:
+        """Plan de procesamiento de todo el documento, una entrada por página."""
+        return [self.preflight(i) for i in range(len(self))]
+
+    def pixmap(self, i: int, zoom: float = 2.0, alpha: bool = False, clip=None):
+        """
+        Render de la página (sin caché: para OCR y usos de una sola vez). Con clip
+        (fitz.Rect en puntos) solo se rasteriza ese recorte.
+        """
+        key = (i, zoom) if clip is None else (i, zoom, tuple(clip))
+        self.stats["rendered"][key] += 1
+        return self.displaylist(i).get_pixmap(
+            matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csRGB, alpha=alpha, clip=clip,
+        )
+
+    def render_png(self, i: int, zoom: float = 2.0) -> bytes:
+        """PNG de la página completa, cacheado por (página, zoom)."""
+        key = (i, zoom)
+        if key not in self._png:
+            self._png[key] = self.pixmap(i, zoom).tobytes("png")
+        return self._png[key]
+
+    def page_hash(self, i: int) -> str:
+        """
+        sha1 del contenido de la página i: stream de contenido + streams crudos de sus
+        imágenes + tamaño/rotación. Igual entre dos subidas del mismo PDF aunque el
+        resto del documento cambie (p. ej. una proforma corregida en otras páginas).
+        """
+        if i not in self._hashes:
+            page = self.page(i)
+            h = hashlib.sha1()
+            h.update(f"{tuple(page.rect)}|{page.rotation}".encode())
+            h.update(page.read_contents())
+            for meta in page.get_images(full=True):
+                try:
+                    h.update(self.doc.xref_stream_raw(meta[0]) or b"")
+                except Exception:
+                    h.update(str(meta[0]).encode())
+            self._hashes[i] = h.hexdigest()
+        return self._hashes[i]
+
+    # ------------------------------ pdfplumber ------------------------------
+    @property
+    def plumber(self):
+        """pdfplumber sobre los mismos bytes (se abre una vez, perezoso)."""
+        if self._plumber is None:
+            import pdfplumber
+            self._plumber = pdfplumber.open(io.BytesIO(self.data))
+            self.stats["opened"]["pdfplumber"] += 1
+        return self._plumber
+
+    def plumber_page(self, i: int):
+        self.stats["plumber_pages"][i] += 1
+        return self.plumber.pages[i]
+
+    # ------------------------------ Reporte ------------------------------
+    def report(self) -> dict:
+        """Resumen de los contadores; max_* == 1 significa “cada página una sola vez”."""
+        s = self.stats
+        return {
+            "pages": len(self) if self._doc is not None else None,
+            "opened": dict(s["opened"]),
+            "pages_parsed": len(s["parsed"]),
+            "max_parses_per_page": max(s["parsed"].values(), default=0),
+            "max_plumber_per_page": max(s["plumber_pages"].values(), default=0),
+            "renders": sum(s["rendered"].values()),
+            "max_renders_per_page_zoom": max(s["rendered"].values(), default=0),
+            "max_preflight_per_page": max(s["preflight"].values(), default=0),
+        }
+
+    def close(self) -> None:
+        self._textpages.clear()
+        self._pages.clear()
+        self._dlists.clear()
+        if self._plumber is not None:
+            self._plumber.close()
+            self._plumber = None
+        if self._doc is not None:
+            self._doc.close()
+            self._doc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Uso: python sesion_pdf.py <pdf_path>")
+        sys.exit(1)
+    with PdfSession(sys.argv[1]) as session:
+        plan = session.plan()
+    print(json.dumps({"pages": plan, "summary": dict(Counter(p["kind"] for p in plan))}, ensure_ascii=False))
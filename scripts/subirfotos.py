@@ -1,8 +1,9 @@
 #scripts/subirfotos.py
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload
 from autenticacion import authenticate
-import os, time, mimetypes, re
+from extraerimagenes import load_manifest
+import os, io, time, mimetypes, re
 
 IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"}
 MAX_RETRIES = 3
@@ -21,11 +22,71 @@ def _build_links(file_id: str) -> dict:
     download = f"https://drive.google.com/uc?export=download&id={file_id}"
     return {"preview": preview, "view": view, "download": download}
 
+def _upload_with_retries(drive, make_media, filename: str, folder_id: str):
+    """Crea el archivo en Drive (con reintentos) y lo hace público. Devuelve (preview_url, id) o None."""
+    retries = 0
+    while retries < MAX_RETRIES:
+        try:
+            created = drive.files().create(
+                body={"name": filename, "parents": [folder_id]},
+                media_body=make_media(),
+                fields="id,name",
+                supportsAllDrives=True,
+            ).execute()
+
+            file_id = created["id"]
+
+            # Público (cualquiera con el enlace, solo lectura)
+            drive.permissions().create(
+                fileId=file_id,
+                body={"type": "anyone", "role": "reader"},
+                supportsAllDrives=True,
+            ).execute()
+
+            links = _build_links(file_id)
+            print(f"[upload] {filename} -> {links['preview']}")
+            return links["preview"], file_id  # <- preview para <img>
+        except Exception as e:
+            retries += 1
+            print(f"[upload] Error {filename}: {e}")
+            if retries < MAX_RETRIES:
+                time.sleep(2)
+            else:
+                print(f"[upload] Falló definitivamente: {filename}")
+    return None
+
+
+def _mime_for_name(filename: str) -> str:
+    mime, _ = mimetypes.guess_type(filename)
+    if not mime:
+        ext = os.path.splitext(filename)[1].lstrip(".").lower()
+        mime = f"image/{'jpeg' if ext == 'jpg' else ext}"
+    return mime
+
+
+def upload_image_bytes(data: bytes, filename: str, folder_id: str, drive=None):
+    """
+    Sube una imagen desde memoria (sin archivo temporal) a *folder_id*.
+    Devuelve (url_lh3, id) o None si falló tras los reintentos.
+    """
+    if drive is None:
+        drive = build("drive", "v3", credentials=authenticate())
+    mime = _mime_for_name(filename)
+    return _upload_with_retries(
+        drive,
+        lambda: MediaIoBaseUpload(io.BytesIO(data), mimetype=mime, resumable=True),
+        filename,
+        folder_id,
+    )
+
+
 def upload_images_to_drive(output_folder: str, folder_id: str):
     """
     Sube imágenes a *folder_id* (el que llega desde la UI) y devuelve
     (urls_para_mostrar, nombres, ids). Las URLs son de lh3.googleusercontent.com
     para que carguen perfectas en <img>.
+    Si la carpeta trae manifest.json del extractor, las imágenes marcadas como
+    duplicate_of reutilizan la subida de la original (misma URL / id, sin nueva subida).
     """
     print(f"[upload] Carpeta local: {output_folder}")
     print(f"[upload] Carpeta Drive destino: {folder_id}")
@@ -35,53 +96,41 @@ def upload_images_to_drive(output_folder: str, folder_id: str):
 
     files = [f for f in os.listdir(output_folder) if _is_valid_image(f)]
     files.sort(key=_natural_key)
+    manifest = load_manifest(output_folder)
 
     image_urls, image_names, image_ids = [], [], []
+    uploaded = {}  # nombre -> (url, id) de lo ya subido
+    reused = 0
 
     for filename in files:
         path = os.path.join(output_folder, filename)
         if not os.path.isfile(path):
             continue
 
-        retries = 0
-        while retries < MAX_RETRIES:
-            try:
-                mime, _ = mimetypes.guess_type(path)
-                if not mime:
-                    ext = os.path.splitext(filename)[1].lstrip(".").lower()
-                    mime = f"image/{'jpeg' if ext == 'jpg' else ext}"
-
-                media = MediaFileUpload(path, mimetype=mime, resumable=True)
-                created = drive.files().create(
-                    body={"name": filename, "parents": [folder_id]},
-                    media_body=media,
-                    fields="id,name",
-                    supportsAllDrives=True,
-                ).execute()
-
-                file_id = created["id"]
-
-                # Público (cualquiera con el enlace, solo lectura)
-                drive.permissions().create(
-                    fileId=file_id,
-                    body={"type": "anyone", "role": "reader"},
-                    supportsAllDrives=True,
-                ).execute()
-
-                links = _build_links(file_id)
-                image_names.append(filename)
-                image_urls.append(links["preview"])  # <- para <img>
-                image_ids.append(file_id)
-
-                print(f"[upload] {filename} -> {links['preview']}")
-                break
-            except Exception as e:
-                retries += 1
-                print(f"[upload] Error {filename}: {e}")
-                if retries < MAX_RETRIES:
-                    time.sleep(2)
-                else:
-                    print(f"[upload] Falló definitivamente: {filename}")
-
-    print(f"[upload] Subidas: {len(image_urls)}")
+        original = (manifest.get(filename) or {}).get("duplicate_of")
+        if original in uploaded:
+            url, file_id = uploaded[original]
+            image_names.append(filename)
+            image_urls.append(url)
+            image_ids.append(file_id)
+            uploaded[filename] = (url, file_id)
+            reused += 1
+            print(f"[upload] {filename} = {original} (duplicada, sin subir)")
+            continue
+
+        mime = _mime_for_name(filename)
+        result = _upload_with_retries(
+            drive,
+            lambda: MediaFileUpload(path, mimetype=mime, resumable=True),
+            filename,
+            folder_id,
+        )
+        if result:
+            url, file_id = result
+            image_names.append(filename)
+            image_urls.append(url)
+            image_ids.append(file_id)
+            uploaded[filename] = result
+
+    print(f"[upload] Subidas: {len(image_urls) - reused} (+{reused} duplicadas reutilizadas)")
     return image_urls, image_names, image_ids